@@ -1,4 +1,3 @@
-import pickle
 from random import choice
 
 from Chess.Repository.ChessRepository import ChessRepository
@@ -9,8 +8,7 @@ from Chess.Pieces.king import King
 from Chess.Pieces.knight import Knight
 from Chess.Pieces.pawn import Pawn
 from Chess.Pieces.piece import Piece
-from Chess.Pieces.queen import Queen
-from Chess.Pieces.rook import Rook
+from Chess.Repository.Bitboard import PAWN, PIECE_INDEX, QUEEN, decode_move, encode_move, move_to_uci, uci_to_move
 from Chess.utils.move_handlers import process_algebraic_notation, process_location, convert_to_algebraic_notation, \
     print_board
 
@@ -25,14 +23,9 @@ class GameState:
         :param move: The move to make
         :return: None
         """
-        # Update the half-move counter
-        self.board.half_moves += 1
-
-        # Make a copy of the board and the pieces
-
-        initial_board = pickle.loads(pickle.dumps(self.board.board, -1))
-        initial_pieces = pickle.loads(pickle.dumps(self.board.pieces, -1))
-
+        move = move.strip()
+        if len(move) > 4 and move[4:].lower() not in ("n", "b", "r", "q"):
+            raise IllegalMove(f"{move[4:]} is not a piece a pawn can promote to")
         # Calculate the start and end squares
         end, start = process_algebraic_notation(move)
 
@@ -44,196 +37,64 @@ class GameState:
         if piece.color != self.board.turn:
             raise WrongColor("That's not your piece!")
         # Check if the move is legal
-        if end not in piece.get_legal_moves(self.board.board, self.board.history, self.board.pieces):
-            raise IllegalMove("That move is illegal!")
-
-        # Check if king is in check
-        king = None
-        for row in self.board.board:
-            for square in row:
-                if square is not None and square.color == self.board.turn and isinstance(square, King):
-                    king = square
-                    break
-
-        # Check if the move is a capture
-        if self.board.board[end[0]][end[1]] is not None:
-            # If the piece is a friendly piece, the move is illegal
-            if self.board.board[end[0]][end[1]].color == self.board.turn:
-                raise IllegalMove("You can't capture your own piece!")
-            # If the piece is an enemy piece, remove it from the list of pieces
-            captured_piece = self.board.board[end[0]][end[1]]
-            for pieces in self.board.pieces:
-                if pieces.position == captured_piece.position and pieces.type == captured_piece.type:
-                    self.board.remove_piece(captured_piece)
-                    break
-
-            # Update the list of pieces
-            self.board.pieces = [piece for row in self.board.board for piece in row if piece is not None]
-            self.board.half_moves = 0
-
-        if king.is_in_check(self.board.board, self.board.pieces, self.board.history):
-            # Simulate the move to see if the king is still in check
-            if self.board.board[end[0]][end[1]] is not None and self.board.board[end[0]][
-                end[1]].color != self.board.turn:
-                captured_piece = self.board.board[end[0]][end[1]]
-                for pieces in self.board.pieces:
-                    if pieces.position == captured_piece.position and pieces.type == captured_piece.type:
-                        self.board.remove_piece(captured_piece)
-            self.board.board[end[0]][end[1]] = piece
-            self.board.board[start[0]][start[1]] = None
-            piece.position = end
-            if king.is_in_check(self.board.board, self.board.pieces, self.board.history):
-                self.rollback(initial_board, initial_pieces)
+        if self.encode_move(move) not in self.board.position.legal_moves():
+            if end not in piece.get_legal_moves(self.board.board, self.board.history, self.board.pieces):
+                raise IllegalMove("That move is illegal!")
+            if self.board.is_in_check(piece.color):
                 raise IllegalMove("You must get out of check!")
-            self.rollback(pickle.loads(pickle.dumps(initial_board, -1)), pickle.loads(pickle.dumps(initial_pieces, -1)))
-
-        # Castling rights
-        if isinstance(piece, Rook):
-            # Remove the castling rights if the rook moves
-            if start == (0, 0) or start == (7, 0):
-                king.castling_rights[0] = False
-            if start == (0, 7) or start == (7, 7):
-                king.castling_rights[1] = False
-
-        if (king.castling_rights[0] or king.castling_rights) and isinstance(piece, King):
-            # Check if the move is a castling move
-            if isinstance(piece, King) and abs(end[1] - start[1]) == 2 and (
-                    king.castling_rights[0] or king.castling_rights[1]):
-                # Check if there are pieces between the king and the rook
-                if end[1] > 4 and self.board.board[end[0]][end[1] - 1] is not None and self.board.board[end[0]][
-                    end[1] - 2] \
-                        is not None:
-                    raise IllegalMove("You can't castle through pieces!")
-                if end[1] < 4 and self.board.board[end[0]][end[1] + 1] is not None and self.board.board[end[0]][
-                    end[1] + 2] \
-                        is not None:
-                    raise IllegalMove("You can't castle through pieces!")
-                # If there are no pieces between the king and the rook, check the castling rights
-                elif end not in king.get_legal_moves(self.board.board, self.board.history, self.board.pieces):
-                    raise IllegalMove(f'You don\'t have the right to castle '
-                                      f'{"king" if king.castling_rights[0] else "queen"} side!')
-
-                # If the king is not in check and there are no pieces between the king and the rook, castle
-                else:
-                    # Move the rook
-                    if end[1] == 6:
-                        if self.board.board[end[0]][7] is None:
-                            raise IllegalMove("Something went wrong")
-                        self.board.board[end[0]][7].position = (end[0], 5)
-                        self.board.board[end[0]][5] = self.board.board[end[0]][7]
-                        self.board.board[end[0]][7] = None
-                    else:
-                        if self.board.board[end[0]][0] is None:
-                            raise IllegalMove("Something went wrong")
-                        self.board.board[end[0]][0].position = (end[0], 3)
-                        self.board.board[end[0]][3] = self.board.board[end[0]][0]
-                        self.board.board[end[0]][0] = None
-
-            # Remove the castling rights
-            king.castling_rights[0] = False
-            king.castling_rights[1] = False
-
-        # Check if the move is an en passant capture
-        if isinstance(piece, Pawn) and self.board.board[end[0]][end[1]] is None and end[1] != start[1]\
-                and isinstance(self.board.board[start[0]][end[1]], Pawn) and self.board.board[start[0]][end[1]].color != \
-                self.board.turn:
-            # If the pawn moves diagonally and there is no piece at the end square, it is an en passant capture
-            self.board.board[start[0]][end[1]] = None
-
-        # Move the piece
-        self.board.board[start[0]][start[1]] = None
-        self.board.board[end[0]][end[1]] = piece
-        piece.position = end
-        if isinstance(piece, Pawn):
-            self.board.half_moves = 0
-
-        # Check if the king is in check after the move
-        if king.is_in_check(self.board.board, self.board.pieces, self.board.history):
-            self.rollback(initial_board, initial_pieces)
             raise IllegalMove("You can't move a pinned piece")
 
-        # Check if the move is a pawn promotion
-        if isinstance(piece, Pawn) and (end[0] == 0 or end[0] == 7):
-            # Check if the piece is a pawn and if it is on the last rank
-            # If it is, promote it
-            self.board.board[start[0]][start[1]] = None
-            self.board.board[end[0]][end[1]] = Queen(piece.color, end)
-
-        # Update the board.history
-        self.board.history = move
-
-        # Update the turn
-        self.board.turn = "b" if self.board.turn == "w" else "w"
-
-        # Update the list of pieces
-        self.board.pieces = [piece for row in self.board.board for piece in row if piece is not None]
-        self.board.number_of_moves += 1
-
-        # Find the enemy king
-        for i in self.board.pieces:
-            if isinstance(i, King) and i.color == self.board.turn:
-                king = i
-                break
-
-        initial_board = pickle.loads(pickle.dumps(self.board.board, -1))
-        initial_pieces = pickle.loads(pickle.dumps(self.board.pieces, -1))
-        # Check if the king is in checkmate
-        if king.is_in_check(self.board.board, self.board.pieces, self.board.history):
-            if not king.get_legal_moves(self.board.board, self.board.history, self.board.pieces):
-                # If the king has no legal moves, check if the checking piece can be captured or blocked
-                move_found = False
-                for i in self.board.pieces:
-                    if i.color == self.board.turn:
-                        if isinstance(i, King):
-                            continue
-                        legal_moves = i.get_legal_moves(self.board.board, self.board.history, self.board.pieces)
-                        initial_position = pickle.loads(pickle.dumps(i.position, -1))
-                        for move in legal_moves:
-                            move_found = False
-                            self.board.board[i.position[0]][i.position[1]] = None
-                            self.board.board[move[0]][move[1]] = i
-                            i.position = move
-                            self.board.pieces = [piece for row in self.board.board for piece in row if
-                                                 piece is not None]
-                            if not king.is_in_check(self.board.board, self.board.pieces, self.board.history):
-                                move_found = True
-                                break
-                            self.rollback(pickle.loads(pickle.dumps(initial_board, -1)),
-                                          pickle.loads(pickle.dumps(initial_pieces, -1)))
-                            i.position = initial_position
-                if not move_found:
-                    self.board.game_over = True
-                    self.rollback(initial_board, initial_pieces)
-                    self.board.result = 1 if self.board.turn == "w" else 0
-                    raise Checkmate(f'Game over: {"1-0" if self.board.turn == "b" else "0-1"}!')
-
-                self.rollback(pickle.loads(pickle.dumps(initial_board, -1)),
-                              pickle.loads(pickle.dumps(initial_pieces, -1)))
-
-        # Check if the king is in stalemate
-        else:
-            if not king.get_legal_moves(self.board.board, self.board.history, self.board.pieces):
-                # If the king has no legal moves but is not in check, check if the player has any legal moves
-                move_found = False
-                for i in self.board.pieces:
-                    move_found = False
-                    if i.color == self.board.turn:
-                        self.rollback(pickle.loads(pickle.dumps(initial_board, -1)),
-                                      pickle.loads(pickle.dumps(initial_pieces, -1)))
-                        if isinstance(i, King):
-                            continue
-                        legal_moves = i.get_legal_moves(self.board.board, self.board.history, self.board.pieces)
-                        if legal_moves:
-                            move_found = True
-                            break
-                if not move_found:
-                    self.board.game_over = True
-                    self.rollback(initial_board, initial_pieces)
-                    self.board.result = 0.5
-                    raise Checkmate(f'Game over: 1/2-1/2!')
-
-                self.rollback(pickle.loads(pickle.dumps(initial_board, -1)),
-                              pickle.loads(pickle.dumps(initial_pieces, -1)))
+        self.push(move)
+        self.check_game_over()
+
+    def push(self, move: str | int):
+        """ Play a move without validating it or checking if the game ended. The move can be taken back with pop
+
+         :param move: The move to make, as a move string or encoded with Bitboard.encode_move"""
+        if isinstance(move, str):
+            move = self.encode_move(move)
+        # The history always holds the full notation, including the promotion piece
+        self.board.push_move(move, move_to_uci(move))
+
+    def pop(self) -> str:
+        """ Take back the last move in O(1) using the undo entry recorded by push
+
+         :return: The move that was taken back"""
+        return self.board.pop_move()
+
+    def copy(self) -> "GameState":
+        """ Returns an independent copy of the game state
+
+         :return: The copy"""
+        return GameState(self.board.copy())
+
+    def encode_move(self, move: str) -> int:
+        """ Encode a move string, promoting pawns to a queen unless another piece is asked for
+
+         :param move: The move string
+         :return: The encoded move"""
+        encoded = uci_to_move(move)
+        start, end, promotion = decode_move(encoded)
+        if not promotion and end // 8 in (0, 7) and self.board.position.piece_at(start) in (PAWN, PAWN + 6):
+            encoded = encode_move(start, end, QUEEN)
+        return encoded
+
+    def has_legal_move(self) -> bool:
+        """ Check if the player to move has at least one move that doesn't leave their king in check
+
+         :return: True if there is a legal move, False otherwise"""
+        return next(self.board.position.legal_moves(), None) is not None
+
+    def check_game_over(self):
+        """ Check if the game ended after the last move and raise Checkmate if it did """
+        # Check if the king is in checkmate or stalemate
+        if not self.has_legal_move():
+            self.board.game_over = True
+            if self.board.is_in_check():
+                self.board.result = 1 if self.board.turn == "w" else 0
+                raise Checkmate(f'Game over: {"1-0" if self.board.turn == "b" else "0-1"}!')
+            self.board.result = 0.5
+            raise Checkmate(f'Game over: 1/2-1/2!')
 
         # Check if the game is over due to insufficient material
         if self.is_insufficient_material():
@@ -242,7 +103,7 @@ class GameState:
             raise Checkmate(f'Game over: 1/2-1/2!')
 
         # Check if the game is over due to the 50-move rule
-        if self.board.half_moves == 100:
+        if self.board.half_moves >= 100:
             self.board.game_over = True
             self.board.result = 0.5
             raise Checkmate(f'Game over: 1/2-1/2!')
@@ -271,36 +132,36 @@ class GameState:
          :param start: The start square
          :return: The list of legal moves"""
         start = process_location(start)
-        piece: Piece | King = self.board.board[start[0]][start[1]]
-        if piece is None:
+        if self.board.board[start[0]][start[1]] is None:
             raise IllegalMove("There is no piece at the start location!")
-        return piece.get_legal_moves(self.board.board, self.board.history, self.board.pieces)
+        square = start[0] * 8 + start[1]
+        ends = [decode_move(move)[1] for move in self.board.position.legal_moves() if move & 63 == square]
+        # Promotions give the same end square four times
+        return [(end // 8, end % 8) for end in dict.fromkeys(ends)]
+
+    def legal_moves(self):
+        """ Generate the strictly legal moves for the current player, every move can be played without leaving the
+        king in check
+
+         :return: A generator of move strings, promotions carry the piece letter (e.g. "e7e8q")"""
+        for move in self.board.position.legal_moves():
+            yield move_to_uci(move)
 
     def possible_moves(self):
         """ Return all possible moves for the current player
 
          :return: A list of all possible moves for the current player"""
-        # TODO: Remove the moves that put the king in check
-        moves = []
-        for i in self.board.pieces:
-            if i.color == self.board.turn:
-                for move in self.get_legal_moves(convert_to_algebraic_notation(i.position)):
-                    moves += [convert_to_algebraic_notation(i.position) + convert_to_algebraic_notation(move)]
-        return moves
+        return list(self.legal_moves())
 
     def play_random_move(self, moves=None):
         """ Play a random legal move
 
-         :param moves: A list of moves to choose from"""
+         :param moves: A list of legal moves to choose from"""
         if moves is None:
             moves = self.possible_moves()
         if moves:
-            move = choice(moves)
-            try:
-                self.make_move(move)
-            except IllegalMove:
-                moves.remove(move)
-                self.play_random_move(moves)
+            self.push(choice(moves))
+            self.check_game_over()
 
     def get_value(self) -> float:
         """ Return the value of the board. Positive if white is winning, negative if black is winning
@@ -330,36 +191,29 @@ class GameState:
         """ Checks if there is enough material on the board to checkmate
 
          :return: True if there is not enough material to checkmate, False otherwise"""
-        # Check if there is a rook, queen or pawn
-        for piece in self.board.pieces:
-            if isinstance(piece, Rook) or isinstance(piece, Queen) or isinstance(piece, Pawn):
-                return False
-
-        # We will split the pieces into two lists, one for each color
-        white_pieces = [piece for piece in self.board.pieces if piece.color == "w"]
-        black_pieces = [piece for piece in self.board.pieces if piece.color == "b"]
-        # If there are only two pieces left (the two kings), the game is over
-        if len(white_pieces) + len(black_pieces) == 2:
-            return True
-
-        # King and a minor piece against a king is a draw
-        elif len(white_pieces) + len(black_pieces) == 3:
+        # Count the material on the bitboards, building the Piece views on every rollout ply would be far slower
+        pieces = self.board.position.pieces
+        # A pawn, a rook or a queen can always mate
+        if any(pieces[PIECE_INDEX[symbol]] for symbol in "PRQprq"):
+            return False
+        white_knights = pieces[PIECE_INDEX["N"]].bit_count()
+        black_knights = pieces[PIECE_INDEX["n"]].bit_count()
+        white_minors = white_knights + pieces[PIECE_INDEX["B"]].bit_count()
+        black_minors = black_knights + pieces[PIECE_INDEX["b"]].bit_count()
+
+        # Two kings, or a king and a minor piece against a king
+        if white_minors + black_minors <= 1:
             return True
 
         # King and bishop or knight against a king and bishop or knight is a draw
-        if len(white_pieces) == 2 and len(black_pieces) == 2:
+        if white_minors == 1 and black_minors == 1:
             return True
 
         # King against a king and two knights is a draw
-        if len(white_pieces) == 1 and len(black_pieces) == 3:
-            for piece in black_pieces:
-                if not isinstance(piece, Knight) or not isinstance(piece, King):
-                    return True
-
-        if len(white_pieces) == 3 and len(black_pieces) == 1:
-            for piece in white_pieces:
-                if not isinstance(piece, Knight) or not isinstance(piece, King):
-                    return True
+        if white_minors == 0 and black_knights == black_minors == 2:
+            return True
+        if black_minors == 0 and white_knights == white_minors == 2:
+            return True
 
         # If there's enough material, the game is not over
         return False
@@ -372,6 +226,12 @@ class GameState:
     def game_over(self):
         return self.board.game_over
 
+    def get_key(self) -> int:
+        """ Returns the Zobrist key of the position, equal for every transposition of the same position
+
+         :return: The 64-bit key"""
+        return self.board.key
+
     def get_turn(self):
         return self.board.turn
     # Potentially useless
@@ -1,7 +1,5 @@
-import pickle
-from copy import deepcopy
-
 from Chess.Pieces.piece import Piece
+from Chess.utils.attack_tables import is_square_attacked_on_board
 
 
 class King(Piece):
@@ -11,84 +9,47 @@ class King(Piece):
 
     def get_legal_moves(self, board, move_history, pieces):
         legal_moves = []
-        enemy_pieces = []
-        for piece in pickle.loads(pickle.dumps(pieces, -1)):
-            if piece.color != self.color:
-                enemy_pieces.append(piece)
-
-        # Check the eight squares that the king can move to
-        for row_offset in [-1, 0, 1]:
-            for col_offset in [-1, 0, 1]:
-                if row_offset == 0 and col_offset == 0:
-                    continue
-                board_copy = pickle.loads(pickle.dumps(board, -1))
-                initial_position = pickle.loads(pickle.dumps(self._position, -1))
-                new_row = self._position[0] + row_offset
-                new_col = self._position[1] + col_offset
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
-                    # Check if the square is occupied by a friendly piece
-                    if board_copy[new_row][new_col] is None or board_copy[new_row][new_col].color != self.color:
-                        # Check if the king would be in check after moving to the square
-                        board_copy[self._position[0]][self._position[1]] = None
-                        board_copy[new_row][new_col] = self
-                        self._position = (new_row, new_col)
-                        if not self.is_in_check(board_copy, enemy_pieces, move_history):
-                            # Only append the new position if the king would not be in check
-                            legal_moves.append((new_row, new_col))
-                        board_copy[self._position[0]][self._position[1]] = self
-                        board_copy[initial_position[0]][initial_position[1]] = None
-                        self._position = initial_position
+        enemy = "b" if self.color == "w" else "w"
         row, col = self._position
 
-        # Check if the king can castle
-        if self.castling_rights[0] and self.position == (row, 4):
-            board_copy = pickle.loads(pickle.dumps(board, -1))
-            # Check if the squares between the king and the rook are empty
-            if board[row][col + 1] is None and board[row][col + 2] is None and self.position == (row, 4):
-                # Check if the king doesn't pass through or end up in check
-                board_copy[row][col] = None
-                board_copy[row][col + 1] = self
-                self._position = (row, col + 1)
-                if not self.is_in_check(board_copy, enemy_pieces, move_history):
-                    board_copy[row][col + 1] = None
-                    board_copy[row][col + 2] = self
-                    self._position = (row, col + 2)
-                    if not self.is_in_check(board_copy, enemy_pieces, move_history):
-                        legal_moves.append((row, col + 2))
-                board_copy[row][col + 2] = None
-                board_copy[row][col] = self
-                self._position = (row, col)
-
-        if self.castling_rights[1] and self.position == (row, 4):
-            board_copy = pickle.loads(pickle.dumps(board, -1))
-            # Check if the squares between the king and the rook are empty
-            if board[row][col - 1] is None and board[row][col - 2] is None:
-                # Check if the king doesn't pass through or end up in check
-                board_copy[row][col] = None
-                board_copy[row][col - 1] = self
-                self._position = (row, col - 1)
-                if not self.is_in_check(board_copy, enemy_pieces, move_history):
-                    board_copy[row][col - 1] = None
-                    board_copy[row][col - 2] = self
-                    self._position = (row, col - 2)
-                    if not self.is_in_check(board_copy, enemy_pieces, move_history):
-                        legal_moves.append((row, col - 2))
-                board_copy[row][col - 2] = None
-                board_copy[row][col] = self
-                self._position = (row, col)
+        # Lift the king off the board so sliding pieces attack the squares behind it
+        board[row][col] = None
+        try:
+            # Check the eight squares that the king can move to
+            for row_offset in [-1, 0, 1]:
+                for col_offset in [-1, 0, 1]:
+                    if row_offset == 0 and col_offset == 0:
+                        continue
+                    new_row = row + row_offset
+                    new_col = col + col_offset
+                    if 0 <= new_row < 8 and 0 <= new_col < 8:
+                        # Check if the square is occupied by a friendly piece
+                        if board[new_row][new_col] is None or board[new_row][new_col].color != self.color:
+                            # Only append the new position if the king would not be in check
+                            if not is_square_attacked_on_board(board, (new_row, new_col), enemy):
+                                legal_moves.append((new_row, new_col))
+        finally:
+            board[row][col] = self
+
+        # Check if the king can castle, it can't castle out of, through or into check
+        if col != 4 or (not self.castling_rights[0] and not self.castling_rights[1]) or \
+                is_square_attacked_on_board(board, (row, col), enemy):
+            return legal_moves
+        if self.castling_rights[0] and board[row][col + 1] is None and board[row][col + 2] is None:
+            if not is_square_attacked_on_board(board, (row, col + 1), enemy) and \
+                    not is_square_attacked_on_board(board, (row, col + 2), enemy):
+                legal_moves.append((row, col + 2))
+        if self.castling_rights[1] and board[row][col - 1] is None and board[row][col - 2] is None and \
+                board[row][col - 3] is None:
+            if not is_square_attacked_on_board(board, (row, col - 1), enemy) and \
+                    not is_square_attacked_on_board(board, (row, col - 2), enemy):
+                legal_moves.append((row, col - 2))
 
         return legal_moves
 
-    def is_in_check(self, board, pieces, move_history):
-        enemy_pieces = []
-        for piece in pieces:
-            if piece.color != self.color:
-                enemy_pieces.append(piece)
-        # Check if the king is in check
-        for piece in enemy_pieces:
-            if self._position in piece.get_legal_moves(board, move_history, pieces):
-                return True
-        return False
+    def is_in_check(self, board, pieces=None, move_history=None):
+        # Check if any enemy piece attacks the king's square
+        return is_square_attacked_on_board(board, self._position, "b" if self.color == "w" else "w")
 
     def get_value(self):
         # TODO: Implement a better evaluation function
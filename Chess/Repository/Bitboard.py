@@ -0,0 +1,553 @@
+""" Compact bitboard representation of a chess position.
+
+Squares are numbered 0..63 with a1 = 0, h1 = 7 and h8 = 63, which matches the (row, col) tuples used by the rest
+of the engine (square = row * 8 + col). The position is kept in twelve 64-bit integers, one per piece type and
+color, plus the side to move, the castling rights, the en passant square and the move clocks. """
+from Chess.utils.attack_tables import BETWEEN, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, RAYS, ROOK_DIRECTIONS, \
+    bishop_attacks, rook_attacks
+from Chess.utils.zobrist import BLACK_TO_MOVE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS, PIECE_KEYS
+
+PIECE_SYMBOLS = "PNBRQKpnbrqk"  # Index of the piece set for every symbol, white pieces first
+PIECE_INDEX = {symbol: index for index, symbol in enumerate(PIECE_SYMBOLS)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+# Castling right flags
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+
+# The castling rights that survive a move touching the given square
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] &= ~WHITE_QUEENSIDE
+CASTLING_MASK[4] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7] &= ~WHITE_KINGSIDE
+CASTLING_MASK[56] &= ~BLACK_QUEENSIDE
+CASTLING_MASK[60] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[63] &= ~BLACK_KINGSIDE
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+def square_index(row: int, col: int) -> int:
+    """ Convert a (row, col) tuple to a square index
+
+     :param row: The row of the square (0 is the first rank)
+     :param col: The column of the square (0 is the a-file)
+     :return: The square index"""
+    return row * 8 + col
+
+
+def square_name(square: int) -> str:
+    """ Convert a square index to algebraic notation
+
+     :param square: The square index
+     :return: The algebraic notation of the square"""
+    return chr(square % 8 + 97) + str(square // 8 + 1)
+
+
+def parse_square(name: str) -> int:
+    """ Convert algebraic notation to a square index
+
+     :param name: The algebraic notation of the square
+     :return: The square index"""
+    return (int(name[1]) - 1) * 8 + ord(name[0]) - 97
+
+
+def encode_move(start: int, end: int, promotion: int = 0) -> int:
+    """ Pack a move into a 16-bit integer: 6 bits for each square and 4 bits for the promotion piece
+
+     :param start: The start square
+     :param end: The end square
+     :param promotion: The piece type to promote to (KNIGHT..QUEEN), 0 if the move is not a promotion
+     :return: The encoded move"""
+    return start | end << 6 | promotion << 12
+
+
+def decode_move(move: int) -> tuple[int, int, int]:
+    """ Unpack a move encoded with encode_move
+
+     :param move: The encoded move
+     :return: A tuple of the form (start, end, promotion)"""
+    return move & 63, (move >> 6) & 63, move >> 12
+
+
+def move_to_uci(move: int) -> str:
+    """ Convert an encoded move to the string notation used by GameState (e.g. "e2e4" or "e7e8q")
+
+     :param move: The encoded move
+     :return: The move string"""
+    start, end, promotion = decode_move(move)
+    uci = square_name(start) + square_name(end)
+    if promotion:
+        uci += PIECE_SYMBOLS[promotion + 6]
+    return uci
+
+
+def uci_to_move(uci: str) -> int:
+    """ Convert a move string (e.g. "e2e4" or "e7e8q") to an encoded move
+
+     :param uci: The move string
+     :return: The encoded move"""
+    promotion = PIECE_INDEX[uci[4].upper()] if len(uci) > 4 else 0
+    return encode_move(parse_square(uci[:2]), parse_square(uci[2:4]), promotion)
+
+
+def iterate_squares(bitboard: int):
+    """ Iterate over the squares set in a bitboard, lowest square first
+
+     :param bitboard: The bitboard to iterate over"""
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def _nearest(bitboard: int, direction: int) -> int | None:
+    """ Returns the square of a ray bitboard that is nearest to the ray's origin
+
+     :param bitboard: A subset of a ray
+     :param direction: The direction of the ray, as indexed in attack_tables.DIRECTIONS
+     :return: The nearest square, or None if the bitboard is empty"""
+    if not bitboard:
+        return None
+    if direction < 4:
+        return (bitboard & -bitboard).bit_length() - 1
+    return bitboard.bit_length() - 1
+
+
+class Bitboard:
+    """ A chess position stored as twelve 64-bit piece sets plus the game state flags. """
+    __slots__ = ("pieces", "turn", "castling", "en_passant", "half_moves", "number_of_moves", "key")
+
+    def __init__(self):
+        self.pieces: list[int] = [0] * 12  # One set per piece symbol, indexed like PIECE_SYMBOLS
+        self.turn = "w"  # The side to move
+        self.castling = 0  # Castling right flags
+        self.en_passant: int | None = None  # The square a pawn can capture en passant on
+        self.half_moves = 0  # The number of half-moves since the last capture or pawn move
+        self.number_of_moves = 0  # The number of half-moves made since game start
+        self.key = 0  # The Zobrist key of the position, kept up to date by make_move and unmake_move
+
+    def set_fen(self, fen: str = STARTING_FEN):
+        """ Set up the position described by a FEN string
+
+         :param fen: The FEN to set the position from"""
+        fields = fen.split(" ")
+        self.pieces = [0] * 12
+        for row, rank in enumerate(reversed(fields[0].split("/"))):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    self.pieces[PIECE_INDEX[char]] |= 1 << square_index(row, col)
+                    col += 1
+        self.turn = fields[1] if len(fields) > 1 else "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.castling = (WHITE_KINGSIDE if "K" in castling else 0) | (WHITE_QUEENSIDE if "Q" in castling else 0) | \
+            (BLACK_KINGSIDE if "k" in castling else 0) | (BLACK_QUEENSIDE if "q" in castling else 0)
+        self.en_passant = parse_square(fields[3]) if len(fields) > 3 and fields[3] != "-" else None
+        self.half_moves = int(fields[4]) if len(fields) > 4 else 0
+        full_moves = int(fields[5]) if len(fields) > 5 else 1
+        self.number_of_moves = (full_moves - 1) * 2 + (1 if self.turn == "b" else 0)
+        self.key = self.compute_key()
+
+    def compute_key(self) -> int:
+        """ Compute the Zobrist key of the position from scratch
+
+         :return: The 64-bit key"""
+        key = BLACK_TO_MOVE_KEY if self.turn == "b" else 0
+        for piece, bitboard in enumerate(self.pieces):
+            for square in iterate_squares(bitboard):
+                key ^= PIECE_KEYS[piece][square]
+        return key ^ CASTLING_KEYS[self.castling] ^ self.en_passant_key()
+
+    def en_passant_key(self) -> int:
+        """ Returns the part of the Zobrist key that comes from the en passant square. The square only counts when a
+        pawn of the side to move can capture on it, otherwise the position is the same as without it
+
+         :return: The key of the en passant file, or 0"""
+        if self.en_passant is None:
+            return 0
+        if self.turn == "w":
+            capturers = PAWN_ATTACKS[1][self.en_passant] & self.pieces[PAWN]
+        else:
+            capturers = PAWN_ATTACKS[0][self.en_passant] & self.pieces[PAWN + 6]
+        return EN_PASSANT_KEYS[self.en_passant % 8] if capturers else 0
+
+    def fen(self) -> str:
+        """ Returns a FEN representation of the position
+
+         :return: A FEN representation of the position"""
+        mailbox = self.mailbox()
+        ranks = []
+        for row in range(7, -1, -1):
+            rank = ""
+            empty_squares = 0
+            for col in range(8):
+                piece = mailbox[square_index(row, col)]
+                if piece is None:
+                    empty_squares += 1
+                    continue
+                if empty_squares:
+                    rank += str(empty_squares)
+                    empty_squares = 0
+                rank += PIECE_SYMBOLS[piece]
+            if empty_squares:
+                rank += str(empty_squares)
+            ranks.append(rank)
+        return f'{"/".join(ranks)} {self.fen_state()}'
+
+    def fen_state(self) -> str:
+        """ Returns the fields of the FEN representation that follow the piece placement
+
+         :return: The side to move, castling rights, en passant square and move counters"""
+        castling = ""
+        for flag, symbol in ((WHITE_KINGSIDE, "K"), (WHITE_QUEENSIDE, "Q"), (BLACK_KINGSIDE, "k"),
+                             (BLACK_QUEENSIDE, "q")):
+            if self.castling & flag:
+                castling += symbol
+        en_passant = square_name(self.en_passant) if self.en_passant is not None else "-"
+        return f'{self.turn} {castling or "-"} {en_passant} {self.half_moves} {self.number_of_moves // 2 + 1}'
+
+    def mailbox(self) -> list[int | None]:
+        """ Returns a 64 element list with the piece index on every square (None for empty squares)
+
+         :return: The piece index of every square"""
+        mailbox: list[int | None] = [None] * 64
+        for piece, bitboard in enumerate(self.pieces):
+            for square in iterate_squares(bitboard):
+                mailbox[square] = piece
+        return mailbox
+
+    def piece_at(self, square: int) -> int | None:
+        """ Returns the index of the piece set occupying a square
+
+         :param square: The square to look at
+         :return: The piece index, or None if the square is empty"""
+        bit = 1 << square
+        for piece, bitboard in enumerate(self.pieces):
+            if bitboard & bit:
+                return piece
+        return None
+
+    def occupancy(self, color: str | None = None) -> int:
+        """ Returns the set of squares occupied by one side, or by both sides if no color is given
+
+         :param color: "w", "b" or None
+         :return: The occupancy bitboard"""
+        pieces = self.pieces
+        if color == "w":
+            return pieces[0] | pieces[1] | pieces[2] | pieces[3] | pieces[4] | pieces[5]
+        if color == "b":
+            return pieces[6] | pieces[7] | pieces[8] | pieces[9] | pieces[10] | pieces[11]
+        return self.occupancy("w") | self.occupancy("b")
+
+    def king_square(self, color: str) -> int | None:
+        """ Returns the square of the king of the given color
+
+         :param color: The color of the king
+         :return: The square of the king, or None if there is no king on the board"""
+        king = self.pieces[KING if color == "w" else KING + 6]
+        return king.bit_length() - 1 if king else None
+
+    def is_square_attacked(self, square: int, by_color: str, occupied: int | None = None) -> bool:
+        """ Check if a square is attacked by any piece of a color, using the precomputed attack tables
+
+         :param square: The square to check
+         :param by_color: The color of the attacking pieces
+         :param occupied: The occupancy to use for the sliding pieces, the current one by default
+         :return: True if the square is attacked, False otherwise"""
+        pieces = self.pieces
+        them = 0 if by_color == "w" else 6
+        if KNIGHT_ATTACKS[square] & pieces[them + KNIGHT] or KING_ATTACKS[square] & pieces[them + KING]:
+            return True
+        # A pawn of by_color attacks the square from where a pawn of the other color standing on it would attack
+        if PAWN_ATTACKS[1 if them == 0 else 0][square] & pieces[them + PAWN]:
+            return True
+        if occupied is None:
+            occupied = self.occupancy()
+        queens = pieces[them + QUEEN]
+        if bishop_attacks(square, occupied) & (pieces[them + BISHOP] | queens):
+            return True
+        return bool(rook_attacks(square, occupied) & (pieces[them + ROOK] | queens))
+
+    def attackers(self, square: int, by_color: str) -> int:
+        """ Returns the set of pieces of a color that attack a square
+
+         :param square: The square to check
+         :param by_color: The color of the attacking pieces
+         :return: The bitboard of the attacking pieces"""
+        pieces = self.pieces
+        them = 0 if by_color == "w" else 6
+        occupied = self.occupancy()
+        queens = pieces[them + QUEEN]
+        return (KNIGHT_ATTACKS[square] & pieces[them + KNIGHT]) | (KING_ATTACKS[square] & pieces[them + KING]) | \
+            (PAWN_ATTACKS[1 if them == 0 else 0][square] & pieces[them + PAWN]) | \
+            (bishop_attacks(square, occupied) & (pieces[them + BISHOP] | queens)) | \
+            (rook_attacks(square, occupied) & (pieces[them + ROOK] | queens))
+
+    def pins(self, color: str) -> dict[int, int]:
+        """ Find the pieces of a color that are pinned to their king
+
+         :param color: The color of the king
+         :return: A dictionary mapping every pinned square to the squares the pinned piece can still move to"""
+        pinned = {}
+        king = self.king_square(color)
+        if king is None:
+            return pinned
+        pieces = self.pieces
+        them = 6 if color == "w" else 0
+        own = self.occupancy(color)
+        occupied = own | self.occupancy("b" if color == "w" else "w")
+        queens = pieces[them + QUEEN]
+        for direction in range(8):
+            sliders = (pieces[them + ROOK] if direction in ROOK_DIRECTIONS else pieces[them + BISHOP]) | queens
+            ray = RAYS[direction][king]
+            if not ray & sliders:
+                continue
+            blockers = ray & occupied
+            # The first blocker has to be ours and the second one an enemy slider moving along this line
+            first = _nearest(blockers, direction)
+            if first is None or not own & (1 << first):
+                continue
+            second = _nearest(blockers ^ (1 << first), direction)
+            if second is not None and sliders & (1 << second):
+                pinned[first] = BETWEEN[king][second] | (1 << second)
+        return pinned
+
+    def legal_moves(self):
+        """ Generate the strictly legal moves of the side to move. Pins and checks are worked out up front so every
+        move that is yielded can be played, including castling, en passant and the four promotions
+
+         :return: A generator of encoded moves"""
+        pieces = self.pieces
+        color = self.turn
+        enemy = "b" if color == "w" else "w"
+        us = 0 if color == "w" else 6
+        own = self.occupancy(color)
+        enemies = self.occupancy(enemy)
+        occupied = own | enemies
+        king = self.king_square(color)
+        if king is None:
+            return
+
+        # King moves, with the king lifted off the board so it can't hide behind itself from a slider
+        without_king = occupied ^ (1 << king)
+        for end in iterate_squares(KING_ATTACKS[king] & ~own):
+            if not self.is_square_attacked(end, enemy, without_king):
+                yield encode_move(king, end)
+
+        checkers = self.attackers(king, enemy)
+        if checkers & (checkers - 1):
+            return  # Only the king can get out of a double check
+        if checkers:
+            # Capture the checking piece or block the line between it and the king
+            targets = checkers | BETWEEN[king][checkers.bit_length() - 1]
+        else:
+            targets = ~own
+        pinned = self.pins(color)
+
+        for start in iterate_squares(pieces[us + KNIGHT]):
+            if start not in pinned:  # A pinned knight can never move along the pin
+                for end in iterate_squares(KNIGHT_ATTACKS[start] & targets & ~own):
+                    yield encode_move(start, end)
+        for piece, attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, None)):
+            for start in iterate_squares(pieces[us + piece]):
+                if attacks is None:
+                    moves = bishop_attacks(start, occupied) | rook_attacks(start, occupied)
+                else:
+                    moves = attacks(start, occupied)
+                moves &= targets & ~own & pinned.get(start, ~0)
+                for end in iterate_squares(moves):
+                    yield encode_move(start, end)
+
+        # Pawns
+        step = 8 if color == "w" else -8
+        start_row, last_row = (1, 7) if color == "w" else (6, 0)
+        pawn_attacks = PAWN_ATTACKS[0 if color == "w" else 1]
+        for start in iterate_squares(pieces[us + PAWN]):
+            allowed = targets & pinned.get(start, ~0)
+            ends = pawn_attacks[start] & enemies
+            single = start + step
+            if not occupied & (1 << single):
+                ends |= 1 << single
+                double = single + step
+                if start // 8 == start_row and not occupied & (1 << double):
+                    ends |= 1 << double
+            for end in iterate_squares(ends & allowed):
+                if end // 8 == last_row:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        yield encode_move(start, end, promotion)
+                else:
+                    yield encode_move(start, end)
+
+        # En passant removes two pieces from the same rank, so it's simplest to try the move
+        if self.en_passant is not None:
+            for start in iterate_squares(PAWN_ATTACKS[1 if color == "w" else 0][self.en_passant] & pieces[us + PAWN]):
+                move = encode_move(start, self.en_passant)
+                undo = self.make_move(move)
+                in_check = self.is_square_attacked(king, enemy)
+                self.unmake_move(move, undo)
+                if not in_check:
+                    yield move
+
+        # Castling, the king can't castle out of, through or into check
+        if not checkers:
+            row = 0 if color == "w" else 56
+            kingside, queenside = (WHITE_KINGSIDE, WHITE_QUEENSIDE) if color == "w" else \
+                (BLACK_KINGSIDE, BLACK_QUEENSIDE)
+            if self.castling & kingside and king == row + 4 and pieces[us + ROOK] & (1 << (row + 7)) and \
+                    not occupied & (0b11 << (row + 5)) and not self.is_square_attacked(row + 5, enemy) and \
+                    not self.is_square_attacked(row + 6, enemy):
+                yield encode_move(king, row + 6)
+            if self.castling & queenside and king == row + 4 and pieces[us + ROOK] & (1 << row) and \
+                    not occupied & (0b111 << (row + 1)) and not self.is_square_attacked(row + 3, enemy) and \
+                    not self.is_square_attacked(row + 2, enemy):
+                yield encode_move(king, row + 2)
+
+    def is_in_check(self, color: str | None = None) -> bool:
+        """ Check if the king of a color, the side to move by default, is attacked
+
+         :param color: The color of the king
+         :return: True if the king is in check, False otherwise"""
+        color = color or self.turn
+        king = self.king_square(color)
+        return king is not None and self.is_square_attacked(king, "b" if color == "w" else "w")
+
+    def put_piece(self, piece: int, square: int):
+        """ Put a piece on a square, replacing whatever was there
+
+         :param piece: The piece index
+         :param square: The square"""
+        self.remove_piece(square)
+        self.pieces[piece] |= 1 << square
+        self.key = self.compute_key()
+
+    def remove_piece(self, square: int):
+        """ Remove the piece standing on a square, if any
+
+         :param square: The square"""
+        mask = ~(1 << square)
+        self.pieces = [bitboard & mask for bitboard in self.pieces]
+        self.key = self.compute_key()
+
+    def make_move(self, move: int) -> tuple:
+        """ Apply an encoded move to the position. The move is assumed to be legal, this handles captures, castling,
+        en passant, promotions, the castling rights and the move clocks
+
+         :param move: The encoded move
+         :return: The undo entry to pass to unmake_move to take the move back"""
+        start, end, promotion = decode_move(move)
+        pieces = self.pieces
+        start_bit = 1 << start
+        end_bit = 1 << end
+        us = 0 if self.turn == "w" else 6
+        them = 6 - us
+        undo = (None, self.castling, self.en_passant, self.half_moves, self.key)
+        # Take the side to move, castling rights and en passant file out of the key, they are put back at the end
+        key = self.key ^ BLACK_TO_MOVE_KEY ^ CASTLING_KEYS[self.castling] ^ self.en_passant_key()
+
+        moving = us
+        while not pieces[moving] & start_bit:
+            moving += 1
+        self.half_moves += 1
+
+        # Remove the captured piece
+        for captured in range(them, them + 6):
+            if pieces[captured] & end_bit:
+                pieces[captured] ^= end_bit
+                key ^= PIECE_KEYS[captured][end]
+                self.half_moves = 0
+                undo = (captured,) + undo[1:]
+                break
+
+        pieces[moving] ^= start_bit | end_bit
+        key ^= PIECE_KEYS[moving][start] ^ PIECE_KEYS[moving][end]
+        en_passant = None
+        if moving == us + PAWN:
+            self.half_moves = 0
+            if end == self.en_passant:
+                # The captured pawn stands behind the en passant square
+                captured_square = end - 8 if us == 0 else end + 8
+                pieces[them + PAWN] &= ~(1 << captured_square)
+                key ^= PIECE_KEYS[them + PAWN][captured_square]
+            elif abs(end - start) == 16:
+                en_passant = (start + end) // 2
+            if promotion:
+                pieces[moving] ^= end_bit
+                pieces[us + promotion] |= end_bit
+                key ^= PIECE_KEYS[moving][end] ^ PIECE_KEYS[us + promotion][end]
+        elif moving == us + KING and abs(end - start) == 2:
+            # Castling, move the rook to the other side of the king
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            pieces[us + ROOK] ^= (1 << rook_start) | (1 << rook_end)
+            key ^= PIECE_KEYS[us + ROOK][rook_start] ^ PIECE_KEYS[us + ROOK][rook_end]
+
+        self.castling &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        self.en_passant = en_passant
+        self.turn = "b" if self.turn == "w" else "w"
+        self.number_of_moves += 1
+        self.key = key ^ CASTLING_KEYS[self.castling] ^ self.en_passant_key()
+        return undo
+
+    def unmake_move(self, move: int, undo: tuple):
+        """ Take back a move applied with make_move
+
+         :param move: The encoded move
+         :param undo: The undo entry returned by make_move"""
+        start, end, promotion = decode_move(move)
+        captured, self.castling, self.en_passant, self.half_moves, self.key = undo
+        self.turn = "b" if self.turn == "w" else "w"
+        self.number_of_moves -= 1
+        pieces = self.pieces
+        start_bit = 1 << start
+        end_bit = 1 << end
+        us = 0 if self.turn == "w" else 6
+        them = 6 - us
+
+        if promotion:
+            pieces[us + promotion] ^= end_bit
+            pieces[us + PAWN] |= start_bit
+            moving = us + PAWN
+        else:
+            moving = us
+            while not pieces[moving] & end_bit:
+                moving += 1
+            pieces[moving] ^= start_bit | end_bit
+
+        if captured is not None:
+            pieces[captured] |= end_bit
+        elif moving == us + PAWN and end == self.en_passant:
+            pieces[them + PAWN] |= 1 << (end - 8 if us == 0 else end + 8)
+        elif moving == us + KING and abs(end - start) == 2:
+            if end > start:
+                pieces[us + ROOK] ^= (1 << (start + 3)) | (1 << (start + 1))
+            else:
+                pieces[us + ROOK] ^= (1 << (start - 4)) | (1 << (start - 1))
+
+    def copy(self) -> "Bitboard":
+        """ Returns an independent copy of the position
+
+         :return: The copy"""
+        position = Bitboard.__new__(Bitboard)
+        position.pieces = self.pieces.copy()
+        position.turn = self.turn
+        position.castling = self.castling
+        position.en_passant = self.en_passant
+        position.half_moves = self.half_moves
+        position.number_of_moves = self.number_of_moves
+        position.key = self.key
+        return position
+
+    def __eq__(self, other):
+        return isinstance(other, Bitboard) and self.pieces == other.pieces and self.turn == other.turn and \
+            self.castling == other.castling and self.en_passant == other.en_passant
+
+    def __hash__(self):
+        return self.key
+
+    def __repr__(self):
+        return self.fen()
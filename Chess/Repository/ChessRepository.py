@@ -5,106 +5,131 @@ from Chess.Pieces.pawn import Pawn
 from Chess.Pieces.piece import Piece
 from Chess.Pieces.queen import Queen
 from Chess.Pieces.rook import Rook
+from Chess.Repository.Bitboard import Bitboard, PIECE_INDEX, PIECE_SYMBOLS, STARTING_FEN, WHITE_KINGSIDE, \
+    WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE, square_index
 
 
 class ChessRepository:
     def __init__(self):
-        # The __board is a 2D array of 8x8 squares
-        self.__board: list[list[Piece | None]] = [[None for _ in range(8)] for _ in range(8)]
-        self.__turn = "w"  # White makes the first move
+        # The position is stored as bitboards, the 2D array of 8x8 squares and the list of pieces are views of it
+        # that are only built when they are asked for
+        self.__position = Bitboard()
+        self.__board: list[list[Piece | None]] | None = None  # Lazily built 8x8 view of the position
+        self.__pieces: list[Piece] | None = None  # Lazily built list of pieces
         self.__history = []  # Here we will store the history of moves
+        self.__undo_stack = []  # The (move, undo entry) pairs needed to take the moves in the history back
         self.__game_over = False  # Game is still ongoing
-        self.__pieces: list[Piece] = []  # List of __pieces
-        self.__castling_rights = {"w": {"O-O": True, "O-O-O": True},
-                                  "b": {"O-O": True, "O-O-O": True}}  # Castling rights
         self.__result = None  # The result of the game
-        self.__number_of_moves = 0  # The number of half-moves made since game start
-        self.__half_moves = 0  # The number of half-moves since the last capture or pawn move
 
-    def initialize_board(self, fen="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"):
+    def initialize_board(self, fen=STARTING_FEN):
         """ Initialize the board with the FEN provided, or the initial chess position if no FEN is provided
 
          :param fen: The FEN to initialize the board with"""
-        pieces = {"r": Rook, "n": Knight, "b": Bishop, "q": Queen, "k": King, "p": Pawn}
-        fen = fen.split(" ")
-        fen_pieces = fen[0].split("/")
-        fen_pieces.reverse()
-        pos = (0, 0)
-        for row in fen_pieces:
-            for char in row:
-                if char.isdigit():
-                    for _ in range(int(char)):
-                        self.__board[pos[0]][pos[1]] = None
-                        pos = (pos[0], pos[1] + 1)
-                if char.lower() in pieces:
-                    if char.islower():
-                        piece = pieces[char]("b", pos)
-                        self.__pieces.append(piece)
-                        self.__board[pos[0]][pos[1]] = piece
-                    else:
-                        piece = pieces[char.lower()]("w", pos)
-                        self.__pieces.append(piece)
-                        self.__board[pos[0]][pos[1]] = piece
-                    pos = (pos[0], pos[1] + 1)
-            pos = (pos[0] + 1, 0)
-        # Set the game variables from the FEN string
-        self.turn = fen[1]  # Set the turn
-        self.__castling_rights = {
-            "w": {"O-O": True if "K" in fen[2] else False, "O-O-O": True if "Q" in fen[2] else False},
-            "b": {"O-O": True if "k" in fen[2] else False, "O-O-O": True if "q" in fen[2] else False}
-        }
-        self.__half_moves = int(fen[4])
-        self.__number_of_moves = int(fen[5])
+        self.__position.set_fen(fen)
+        self.__undo_stack = []
+        self.__invalidate()
 
     def fen(self):
         """ Returns a FEN representation of the board
 
          :return: A FEN representation of the board"""
-        FEN = ""
-        for row in self.board:
-            empty_squares = 0
-            fen = ""
-            for piece in row:
-                if piece is None:
-                    empty_squares += 1
-                    continue
-                elif empty_squares != 0:
-                    fen += str(empty_squares)
-                if piece.color == "w":
-                    fen += piece.type
-                    empty_squares = 0
-                else:
-                    fen += piece.type.lower()
-                    empty_squares = 0
-            if empty_squares != 0:
-                fen += str(empty_squares)
-            FEN = fen + "/" + FEN
-        FEN = FEN[:-1]  # Remove the last slash
-        FEN += " " + self.turn  # Add the turn
-
-        # Castling rights
-        castling_rights = ""
-        if self.castling_rights["w"]["O-O"]:
-            castling_rights += "K"
-        if self.castling_rights["w"]["O-O-O"]:
-            castling_rights += "Q"
-        if self.castling_rights["b"]["O-O"]:
-            castling_rights += "k"
-        if self.castling_rights["b"]["O-O-O"]:
-            castling_rights += "q"
-        if not castling_rights:
-            castling_rights = "-"
-        FEN += " " + castling_rights
-        # TODO: En passant
-        FEN += " -"  # Placeholder, no en passant support
-
-        FEN += " " + str(self.half_moves)  # Number of half moves since the last capture or pawn move
-        FEN += " " + str(self.number_of_moves // 2 + 1)  # Number of full moves
-        return FEN
+        return self.__position.fen()
+
+    def push_move(self, move: int, notation: str):
+        """ Apply an encoded move to the position and remember how to take it back
+
+         :param move: The move, encoded with Bitboard.encode_move
+         :param notation: The move string to record in the history"""
+        self.__undo_stack.append((move, self.__position.make_move(move)))
+        self.__history.append(notation)
+        self.__invalidate()
+
+    def pop_move(self) -> str:
+        """ Take back the last move applied with push_move
+
+         :return: The move string of the move that was taken back"""
+        move, undo = self.__undo_stack.pop()
+        self.__position.unmake_move(move, undo)
+        self.__game_over = False
+        self.__result = None
+        self.__invalidate()
+        return self.__history.pop()
+
+    def copy(self) -> "ChessRepository":
+        """ Returns an independent copy of the repository without going through the Piece views
+
+         :return: The copy"""
+        repository = ChessRepository()
+        repository.__position = self.__position.copy()
+        repository.__history = self.__history.copy()
+        repository.__undo_stack = self.__undo_stack.copy()
+        repository.__game_over = self.__game_over
+        repository.__result = self.__result
+        return repository
+
+    def is_square_attacked(self, square: int, by_color: str) -> bool:
+        """ Check if a square is attacked by any piece of a color
+
+         :param square: The square index (row * 8 + col)
+         :param by_color: The color of the attacking pieces
+         :return: True if the square is attacked, False otherwise"""
+        return self.__position.is_square_attacked(square, by_color)
+
+    def is_in_check(self, color: str | None = None) -> bool:
+        """ Check if the king of a color, the side to move by default, is in check
+
+         :param color: The color of the king
+         :return: True if the king is in check, False otherwise"""
+        return self.__position.is_in_check(color)
+
+    def __invalidate(self):
+        """ Drop the board and pieces views after the position changed """
+        self.__board = None
+        self.__pieces = None
+
+    def __build_views(self):
+        """ Build the 8x8 board and the list of pieces from the bitboards """
+        pieces = {"R": Rook, "N": Knight, "B": Bishop, "Q": Queen, "K": King, "P": Pawn}
+        castling_rights = self.castling_rights
+        board: list[list[Piece | None]] = [[None for _ in range(8)] for _ in range(8)]
+        piece_list = []
+        for square, index in enumerate(self.__position.mailbox()):
+            if index is None:
+                continue
+            symbol = PIECE_SYMBOLS[index]
+            color = "w" if symbol.isupper() else "b"
+            piece = pieces[symbol.upper()](color, (square // 8, square % 8))
+            if isinstance(piece, King):
+                piece.castling_rights = [castling_rights[color]["O-O"], castling_rights[color]["O-O-O"]]
+            board[square // 8][square % 8] = piece
+            piece_list.append(piece)
+        self.__board = board
+        self.__pieces = piece_list
+
+    def __set_pieces(self, pieces):
+        """ Replace the pieces of the position, keeping the side to move, castling rights and clocks
+
+         :param pieces: An iterable of the pieces to put on the board"""
+        bitboards = [0] * 12
+        for piece in pieces:
+            symbol = piece.type if piece.color == "w" else piece.type.lower()
+            bitboards[PIECE_INDEX[symbol]] |= 1 << square_index(*piece.position)
+        self.__position.pieces = bitboards
+        self.__position.key = self.__position.compute_key()
 
     # Getters
+    @property
+    def position(self) -> Bitboard:
+        return self.__position
+
+    @property
+    def key(self) -> int:
+        return self.__position.key
+
     @property
     def board(self):
+        if self.__board is None:
+            self.__build_views()
         return self.__board
 
     @property
@@ -117,11 +142,15 @@ class ChessRepository:
 
     @property
     def pieces(self):
+        if self.__pieces is None:
+            self.__build_views()
         return self.__pieces
 
     @property
     def castling_rights(self):
-        return self.__castling_rights
+        castling = self.__position.castling
+        return {"w": {"O-O": bool(castling & WHITE_KINGSIDE), "O-O-O": bool(castling & WHITE_QUEENSIDE)},
+                "b": {"O-O": bool(castling & BLACK_KINGSIDE), "O-O-O": bool(castling & BLACK_QUEENSIDE)}}
 
     @property
     def result(self):
@@ -129,40 +158,48 @@ class ChessRepository:
 
     @property
     def number_of_moves(self):
-        return self.__number_of_moves
+        return self.__position.number_of_moves
 
     @property
     def half_moves(self):
-        return self.__half_moves
+        return self.__position.half_moves
 
     @property
     def turn(self):
-        return self.__turn
+        return self.__position.turn
 
     # Setters
     @board.setter
     def board(self, board):
-        self.__board = board
+        self.__set_pieces(piece for row in board for piece in row if piece is not None)
+        self.__invalidate()
 
     @pieces.setter
     def pieces(self, pieces):
-        self.__pieces = pieces
+        self.__set_pieces(piece for piece in pieces if piece is not None)
+        self.__invalidate()
 
     @turn.setter
     def turn(self, turn):
-        self.__turn = turn
+        self.__position.turn = turn
+        self.__position.key = self.__position.compute_key()
 
     @castling_rights.setter
     def castling_rights(self, castling_rights):
-        self.__castling_rights = castling_rights
+        self.__position.castling = (WHITE_KINGSIDE if castling_rights["w"]["O-O"] else 0) | \
+                                   (WHITE_QUEENSIDE if castling_rights["w"]["O-O-O"] else 0) | \
+                                   (BLACK_KINGSIDE if castling_rights["b"]["O-O"] else 0) | \
+                                   (BLACK_QUEENSIDE if castling_rights["b"]["O-O-O"] else 0)
+        self.__position.key = self.__position.compute_key()
+        self.__invalidate()
 
     @half_moves.setter
     def half_moves(self, half_moves):
-        self.__half_moves = half_moves
+        self.__position.half_moves = half_moves
 
     @number_of_moves.setter
     def number_of_moves(self, number_of_moves):
-        self.__number_of_moves = number_of_moves
+        self.__position.number_of_moves = number_of_moves
 
     @game_over.setter
     def game_over(self, game_over):
@@ -180,5 +217,5 @@ class ChessRepository:
         """ Remove a piece from the board
 
          :param piece: The piece to remove"""
-        self.__board[piece.position[0]][piece.position[1]] = None
-        self.__pieces = [p for p in self.__pieces if p != piece and p is not None]
+        self.__position.remove_piece(square_index(*piece.position))
+        self.__invalidate()
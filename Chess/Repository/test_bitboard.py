@@ -0,0 +1,46 @@
+import pytest
+
+from Chess.Repository.Bitboard import STARTING_FEN, Bitboard, move_to_uci, uci_to_move
+
+# Positions with their known move counts at depth 1, 2, ... (https://www.chessprogramming.org/Perft_Results)
+PERFT_POSITIONS = [
+    (STARTING_FEN, [20, 400, 8902, 197281]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+]
+
+
+def position(fen: str) -> Bitboard:
+    board = Bitboard()
+    board.set_fen(fen)
+    return board
+
+
+def perft(board: Bitboard, depth: int) -> int:
+    """ Count the leaf positions of the move tree, checking that every move is taken back exactly """
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in list(board.legal_moves()):
+        key = board.key
+        undo = board.make_move(move)
+        assert board.key == board.compute_key()
+        nodes += perft(board, depth - 1)
+        board.unmake_move(move, undo)
+        assert board.key == key
+    return nodes
+
+
+@pytest.mark.parametrize("fen, counts", PERFT_POSITIONS)
+def test_perft(fen, counts):
+    board = position(fen)
+    for depth, count in enumerate(counts, 1):
+        assert perft(board, depth) == count
+    assert board.fen() == fen
+
+
+def test_move_notation_round_trip():
+    for uci in ("e2e4", "g1f3", "e7e8q", "a2a1n", "h7g8r", "b7c8b"):
+        assert move_to_uci(uci_to_move(uci)) == uci
@@ -40,10 +40,12 @@ class UI:
                 print("Invalid color")
 
     def handle_difficulty_selection(self):
-        """ Handles the difficulty that the AI will be playing at """
-        commands = {"easy": 2,
+        """ Handles the difficulty that the AI will be playing at
+
+         :return: The seconds the AI searches every move for"""
+        commands = {"easy": 1,
                     "medium": 5,
-                    "hard": 10
+                    "hard": 15
                     }
 
         while True:
@@ -67,13 +69,19 @@ class UI:
             print(string)
         print("\n")
 
-    def start(self):
-        """ Starts the game """
+    def start(self, root_workers: int = 1, tree_workers: int = 1, ponder: bool = True):
+        """ Starts the game
+
+         :param root_workers: The number of processes the AI searches with in parallel
+         :param tree_workers: The number of threads the AI searches its tree with, their model evaluations are
+         batched together
+         :param ponder: Whether the AI keeps searching while waiting for the player's move"""
         algorithm = self.handle_algorithm_selection()
         difficulty = self.handle_difficulty_selection()
         color = self.handle_color_selection()
         algorithm == "MCTS"
-        self.ai = MCTS(self.state, iterations=difficulty, depth_limit=None, use_opening_book=True, model=self.model)
+        self.ai = MCTS(self.state, iterations=None, time_limit=difficulty, depth_limit=None, use_opening_book=True,
+                       model=self.model, root_workers=root_workers, tree_workers=tree_workers)
         
 
         while not self.state.board.game_over:
@@ -82,7 +90,10 @@ class UI:
                 self.state.make_move(move)
                 self.print_board(self.state.board)
             else:
+                if ponder:
+                    self.ai.ponder(self.state)
                 move = input("Your move: ")
+                self.ai.stop_pondering()
                 try:
                     self.state.make_move(move)
                     self.print_board(self.state.board)
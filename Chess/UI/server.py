@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from Chess.Board.GameState import GameState
+from Chess.Exceptions.Checkmate import Checkmate
+from Chess.Exceptions.IllegalMoveException import IllegalMove
+from Chess.Exceptions.WrongColor import WrongColor
+from Chess.Repository.Bitboard import STARTING_FEN
+from Chess.Repository.ChessRepository import ChessRepository
+from MCTS.monte_carlo_tree_search import MCTS
+from MCTS.self_play import game_result
+from MCTS.time_control import allocate_time
+from transformer.eval_cache import EvaluationCache
+from transformer.evaluator import BatchEvaluator
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+TIME_SLICE = 0.05  # The seconds a session searches before the next waiting session gets its turn
+MOVE_TIME = 1.0  # The seconds a move is searched for when the request gives no time
+
+
+class Session:
+    """ A game hosted by the server: its position, its search, and the move request waiting for search time """
+
+    def __init__(self, session_id: int, state: GameState, search: MCTS):
+        """ Create the session
+
+         :param session_id: The id the clients refer to the session with
+         :param state: The position of the game
+         :param search: The search of the game, its tree is kept between the moves"""
+        self.id = session_id
+        self.state = state
+        self.search = search
+        self.remaining = 0.0  # The search time left for the requested move
+        self.move = None  # The future of the requested move, None when no move is requested
+        self.closed = False
+
+
+class EngineServer:
+    """ Hosts many games at once in one process. All the sessions share the model, one batched evaluator and one
+    evaluation cache, so the positions of every game are evaluated together.
+
+    The searches are scheduled fairly: a session waiting for a move searches for one time slice in a worker thread,
+    then goes to the back of the queue, until it has had the time of its move. The clients talk to the server over a
+    local socket, one JSON request per line and one JSON response per line:
+
+    {"op": "new", "fen": ...} -> {"session": id}, the fen is optional
+    {"op": "move", "session": id, "move": "e7e5"} -> {"fen": ...}, plays the move of the client
+    {"op": "go", "session": id, "time": 1.0} -> {"move": "e2e4", "fen": ...}, searches and plays the engine's move.
+    Instead of "time" the request can give "clock", "increment" and "moves_to_go"
+    {"op": "close", "session": id} -> {}
+    {"op": "stats"} -> the sessions, the queue and the evaluator statistics
+
+    A finished game adds "result" to the response, a failed request answers {"error": ...}. The "id" of a request is
+    copied to its response """
+
+    def __init__(self, model=None, workers: int | None = None, time_slice: float = TIME_SLICE,
+                 hashtable_size_mb: float = 1):
+        """ Create the server
+
+         :param model: The model guiding every search, None for plain rollouts
+         :param workers: The number of threads running searches at the same time, all the cores if None
+         :param time_slice: The seconds a session searches before the next one gets its turn
+         :param hashtable_size_mb: The size of the transposition table of every session"""
+        self.model = model
+        self.evaluator = BatchEvaluator(model) if model is not None else None
+        self.eval_cache = EvaluationCache()
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.time_slice = time_slice
+        self.hashtable_size_mb = hashtable_size_mb
+        self.sessions = {}
+        self.session_ids = count(1)
+        self.ready = None  # The queue of the sessions waiting for a time slice, created in the event loop
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """ Accept connections until cancelled
+
+         :param host: The address to listen on
+         :param port: The port to listen on"""
+        self.ready = asyncio.Queue()
+        schedulers = [asyncio.create_task(self._schedule()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for scheduler in schedulers:
+                scheduler.cancel()
+            self.close()
+
+    def close(self):
+        """ Stop the worker threads and the evaluator """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.evaluator is not None:
+            self.evaluator.close()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        opened = []  # The sessions created over this connection, closed with it
+        try:
+            while line := await reader.readline():
+                request = {}
+                try:
+                    request = json.loads(line)
+                    response = await self.handle(request)
+                    if request["op"] == "new":
+                        opened.append(response["session"])
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {"error": str(error)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in opened:
+                if session_id in self.sessions:
+                    self._close_session(self.sessions[session_id])
+            writer.close()
+
+    async def handle(self, request: dict) -> dict:
+        """ Answer one request
+
+         :param request: The request
+         :return: The response"""
+        operation = request["op"]
+        if operation == "new":
+            return self._new_session(request.get("fen", STARTING_FEN))
+        if operation == "stats":
+            return self.stats()
+        session = self.sessions.get(request["session"])
+        if session is None:
+            raise KeyError(f"No session {request['session']}")
+        if operation == "close":
+            self._close_session(session)
+            return {}
+        if session.move is not None:
+            raise ValueError("The engine is searching a move in this session")
+        if operation == "move":
+            return self._play(session, request["move"])
+        if operation == "go":
+            if session.state.board.game_over or not session.state.has_legal_move():
+                raise ValueError("The game is over")
+            time_limit = request.get("time")
+            if time_limit is None:
+                clock = request.get("clock")
+                time_limit = (allocate_time(clock, request.get("increment", 0), request.get("moves_to_go"))
+                              if clock is not None else MOVE_TIME)
+            move = await self._search(session, time_limit)
+            return dict(self._play(session, move), move=move)
+        raise ValueError(f"Unknown operation {operation}")
+
+    def _close_session(self, session: Session):
+        """ Remove a session and stop its search. A search waiting for its turn or running a time slice is closed by
+        its scheduler once the slice ends
+
+         :param session: The session"""
+        session.closed = True
+        del self.sessions[session.id]
+        if session.move is None:
+            session.search.close()
+            return
+        session.search.stop()
+        if not session.move.done():
+            session.move.set_exception(ValueError("The session was closed"))
+
+    def _new_session(self, fen: str) -> dict:
+        repository = ChessRepository()
+        repository.initialize_board(fen)
+        state = GameState(repository)
+        search = MCTS(state, None, model=self.model, evaluator=self.evaluator, eval_cache=self.eval_cache,
+                      hashtable_size_mb=self.hashtable_size_mb)
+        session = Session(next(self.session_ids), state, search)
+        self.sessions[session.id] = session
+        return {"session": session.id}
+
+    @staticmethod
+    def _play(session: Session, move: str) -> dict:
+        """ Play a move in a session
+
+         :param session: The session
+         :param move: The move
+         :return: The response: the new position, and the result if the move ended the game"""
+        state = session.state
+        try:
+            state.make_move(move)
+        except Checkmate:
+            return {"fen": state.fen(), "result": game_result(state)}
+        except (IllegalMove, WrongColor) as error:
+            raise ValueError(str(error))
+        except (ValueError, IndexError):
+            raise ValueError(f"Invalid move {move}")
+        return {"fen": state.fen()}
+
+    async def _search(self, session: Session, time_limit: float) -> str:
+        """ Queue the session for search time and wait for its move
+
+         :param session: The session
+         :param time_limit: The seconds to search the move for
+         :return: The move"""
+        session.remaining = time_limit
+        session.move = asyncio.get_running_loop().create_future()
+        self.ready.put_nowait(session)
+        try:
+            return await session.move
+        finally:
+            session.move = None
+
+    async def _schedule(self):
+        """ Give time slices to the waiting sessions in turn, one scheduler runs per worker thread """
+        loop = asyncio.get_running_loop()
+        while True:
+            session = await self.ready.get()
+            if session.closed:
+                session.search.close()
+                continue
+            if session.move is None:
+                continue
+            try:
+                started = time.perf_counter()
+                await loop.run_in_executor(self.executor, session.search.search, session.state,
+                                           min(self.time_slice, session.remaining))
+                session.remaining -= time.perf_counter() - started
+                if session.closed:
+                    session.search.close()
+                    continue
+                if session.remaining > 0 and not session.closed:
+                    self.ready.put_nowait(session)
+                    continue
+                move = await loop.run_in_executor(self.executor, session.search.best_move)
+            except Exception as error:
+                if not session.move.done():
+                    session.move.set_exception(error)
+                continue
+            if not session.move.done():
+                session.move.set_result(move)
+
+    def stats(self) -> dict:
+        """ Returns the load of the server
+
+         :return: The number of sessions and waiting sessions, and the batching and caching of the evaluations"""
+        return {
+            "sessions": len(self.sessions),
+            "waiting": self.ready.qsize() if self.ready is not None else 0,
+            "average_batch_size": self.evaluator.average_batch_size() if self.evaluator is not None else 0.0,
+            "cache_hit_rate": self.eval_cache.hit_rate(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve many games from one engine process")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--model", default=None, help="An exported model artifact (.npz)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-slice", type=float, default=TIME_SLICE)
+    args = parser.parse_args()
+    server_model = None
+    if args.model:
+        from transformer.runtime import InferenceModel
+        server_model = InferenceModel.load(args.model)
+    engine_server = EngineServer(server_model, args.workers, args.time_slice)
+    try:
+        asyncio.run(engine_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,65 @@
+import io
+
+from Chess.Repository.Bitboard import move_to_uci
+from Chess.UI.uci import OPTIONS, UCIEngine
+
+
+def run(commands: list[str]) -> tuple[UCIEngine, list[str]]:
+    """ Run the engine over the commands, the search started by go ends when the input does """
+    output = io.StringIO()
+    engine = UCIEngine(output=output)
+    for command in commands:
+        engine.handle(command)
+        if command.startswith("go") and engine.search_thread is not None:
+            engine.search_thread.join()
+    engine.run(iter([]))
+    return engine, output.getvalue().splitlines()
+
+
+def legal_moves(engine: UCIEngine) -> set[str]:
+    return {move_to_uci(move) for move in engine.state.board.position.legal_moves()}
+
+
+def test_handshake():
+    _, lines = run(["uci", "isready"])
+    assert lines[0].startswith("id name ")
+    assert lines[1].startswith("id author ")
+    assert [line.split()[2] for line in lines if line.startswith("option")] == list(OPTIONS)
+    assert lines[-2:] == ["uciok", "readyok"]
+
+
+def test_go_answers_a_legal_move():
+    engine, lines = run(["position startpos moves e2e4 e7e5", "go nodes 30"])
+    assert engine.state.board.history == ["e2e4", "e7e5"]
+    assert any(line.startswith("info depth") for line in lines)
+    assert lines[-1].startswith("bestmove ")
+    assert lines[-1].split()[1] in legal_moves(engine)
+
+
+def test_go_from_a_fen():
+    engine, lines = run(["position fen 8/8/8/4k3/8/8/8/R3K3 w - - 0 1", "go nodes 30"])
+    assert lines[-1].split()[1] in legal_moves(engine)
+
+
+def test_game_over_answers_the_null_move():
+    _, lines = run(["position fen 7k/6Q1/6K1/8/8/8/8/8 b - - 0 1", "go nodes 10"])
+    assert lines[-1] == "bestmove 0000"
+
+
+def test_ponder_move_only_when_pondering_is_enabled():
+    _, lines = run(["position startpos", "go nodes 60"])
+    assert len(lines[-1].split()) == 2
+    _, lines = run(["setoption name Ponder value true", "position startpos", "go nodes 60"])
+    assert lines[-1].split()[2] == "ponder"
+
+
+def test_setoption_validates_the_values():
+    engine, lines = run(["setoption name Hash value 99999", "setoption name Threads value many",
+                         "setoption name Selection value puct", "setoption name Selection value best",
+                         "setoption name Model value missing.npz", "setoption name Colour value white"])
+    assert engine.options["Hash"] == 4096
+    assert engine.options["Threads"] == 1
+    assert engine.options["Selection"] == "puct"
+    assert engine.options["Model"] == ""
+    assert len(lines) == 5
+    assert all(line.startswith("info string") for line in lines)
@@ -0,0 +1,355 @@
+import argparse
+import sys
+import threading
+import time
+
+from Chess.Board.GameState import GameState
+from Chess.Exceptions.Checkmate import Checkmate
+from Chess.Repository.Bitboard import STARTING_FEN
+from Chess.Repository.ChessRepository import ChessRepository
+from MCTS.monte_carlo_tree_search import MCTS
+from MCTS.time_control import allocate_time
+from transformer.eval_cache import EvaluationCache
+from transformer.evaluator import BatchEvaluator
+
+ENGINE_NAME = "MCTS-UCB Transformer Ensemble"
+ENGINE_AUTHOR = "IM07813"
+INFO_INTERVAL = 1.0  # The seconds between two info lines during a search
+
+# The options of the engine: name to (UCI type, default value, UCI declaration of the bounds or choices)
+OPTIONS = {
+    "Hash": ("spin", 16, "min 1 max 4096"),
+    "Threads": ("spin", 1, "min 1 max 64"),
+    "LeafRollouts": ("spin", 1, "min 1 max 256"),
+    "Selection": ("combo", "ucb1", "var ucb1 var puct"),
+    "OwnBook": ("check", False, ""),
+    "Ponder": ("check", False, ""),
+    "Model": ("string", "", ""),
+}
+
+
+class UCIEngine:
+    """ Plays through the Universal Chess Interface: reads commands from an input stream and answers on an output
+    stream, so GUIs and match runners can drive the engine. The search runs in a background thread, the commands
+    keep being read while it thinks, so stop and ponderhit take effect right away.
+
+    The search tree is kept between the positions of a game and the evaluator and its cache are shared by all the
+    searches of the engine """
+
+    def __init__(self, model=None, output=sys.stdout):
+        """ Create the engine
+
+         :param model: The model guiding the search, None for plain rollouts
+         :param output: The stream the answers are written to"""
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.options = {name: default for name, (_, default, _) in OPTIONS.items()}
+        self.model = None
+        self.evaluator = None
+        self.eval_cache = EvaluationCache()
+        self._set_model(model)
+        self.state = None
+        self.base_fen = None  # The position the moves of the current game start from
+        self.search = None  # The search of the current game, created when a position is searched
+        self.search_thread = None
+        self.searching = None  # Set while the current search runs, its info reporter stops when it is cleared
+        self.ponder_limits = None  # The time limits of a ponder search, applied by ponderhit
+        self.timer = None  # Stops the search when the time of a ponder search that was hit runs out
+        self._set_position(STARTING_FEN, [])
+
+    def send(self, line: str):
+        """ Write a line to the GUI
+
+         :param line: The line"""
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self, lines=sys.stdin):
+        """ Read and execute commands until quit or the end of the input
+
+         :param lines: The stream of commands"""
+        for line in lines:
+            if not self.handle(line):
+                break
+        self._stop_search()
+        if self.search is not None:
+            self.search.close()
+
+    def handle(self, line: str) -> bool:
+        """ Execute one command, unknown commands are ignored like the protocol asks
+
+         :param line: The command
+         :return: False if the command was quit, True otherwise"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "quit":
+            return False
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            for name, (kind, default, bounds) in OPTIONS.items():
+                if kind == "check":
+                    default = str(default).lower()
+                self.send(f"option name {name} type {kind} default {default or '<empty>'} {bounds}".rstrip())
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self._set_option(arguments)
+        elif command == "ucinewgame":
+            self._stop_search()
+            self._new_search()
+        elif command == "position":
+            self._stop_search()
+            self._position(arguments)
+        elif command == "go":
+            self._stop_search()
+            self._go(arguments)
+        elif command == "stop":
+            self._stop_search()
+        elif command == "ponderhit":
+            self._ponderhit()
+        return True
+
+    def _set_model(self, model):
+        if self.evaluator is not None:
+            self.evaluator.close()
+        self.model = model
+        self.evaluator = BatchEvaluator(model) if model is not None else None
+        self.eval_cache.clear()
+
+    def _set_option(self, arguments: list[str]):
+        """ Handle setoption name <name> [value <value>], the search is rebuilt with the new settings for the next
+        position
+
+         :param arguments: The words after setoption"""
+        if "name" not in arguments:
+            return
+        value_index = arguments.index("value") if "value" in arguments else len(arguments)
+        name = " ".join(arguments[arguments.index("name") + 1:value_index])
+        value = " ".join(arguments[value_index + 1:])
+        if name not in OPTIONS:
+            self.send(f"info string Unknown option {name}")
+            return
+        try:
+            value = self._parse_option(name, value)
+            model = self._load_model(value) if name == "Model" else None
+        except (OSError, ValueError, KeyError) as error:
+            self.send(f"info string Option {name} not set: {error}")
+            return
+        self._stop_search()
+        self.options[name] = value
+        if name == "Model":
+            self._set_model(model)
+        self._new_search()
+
+    def _parse_option(self, name: str, value: str):
+        """ Turn the value of a setoption into the value of the option, spin values out of bounds are clamped
+
+         :param name: The name of the option
+         :param value: The value sent by the GUI
+         :return: The value of the option
+         :raises ValueError: If the value doesn't fit the type of the option"""
+        kind, _, declaration = OPTIONS[name]
+        words = declaration.split()
+        if kind == "spin":
+            number = int(value)
+            minimum, maximum = int(words[words.index("min") + 1]), int(words[words.index("max") + 1])
+            clamped = min(max(number, minimum), maximum)
+            if clamped != number:
+                self.send(f"info string Option {name} clamped to {clamped}, the range is {minimum} to {maximum}")
+            return clamped
+        if kind == "check":
+            if value.lower() not in ("true", "false"):
+                raise ValueError(f"{value} is not true or false")
+            return value.lower() == "true"
+        if kind == "combo":
+            choices = words[1::2]
+            if value not in choices:
+                raise ValueError(f"{value} is not one of {', '.join(choices)}")
+            return value
+        return "" if value == "<empty>" else value
+
+    @staticmethod
+    def _load_model(path: str):
+        """ Load the model artifact of the Model option
+
+         :param path: The path of the artifact, empty for no model
+         :return: The model, None for plain rollouts"""
+        if not path:
+            return None
+        from transformer.runtime import InferenceModel
+        return InferenceModel.load(path)
+
+    def _new_search(self):
+        """ Drop the search, the next one starts a new tree """
+        if self.search is not None:
+            self.search.close()
+        self.search = None
+
+    def _position(self, arguments: list[str]):
+        """ Handle position [startpos | fen <fen>] [moves <move> ...]
+
+         :param arguments: The words after position"""
+        moves_index = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments and arguments[0] == "fen":
+            fen = " ".join(arguments[1:moves_index])
+        else:
+            fen = STARTING_FEN
+        self._set_position(fen, arguments[moves_index + 1:])
+
+    def _set_position(self, fen: str, moves: list[str]):
+        repository = ChessRepository()
+        repository.initialize_board(fen)
+        state = GameState(repository)
+        for move in moves:
+            state.push(move)
+        try:
+            state.check_game_over()
+        except Checkmate:
+            pass
+        if fen != self.base_fen:
+            # The tree follows the moves played since its root, it can't be reused from another starting position
+            self._new_search()
+            self.base_fen = fen
+        self.state = state
+
+    def _go(self, arguments: list[str]):
+        """ Handle go: start a search of the current position with the given limits in the background
+
+         :param arguments: The words after go"""
+        limits = {}
+        words = iter(arguments)
+        for word in words:
+            if word in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "nodes", "depth"):
+                limits[word] = int(next(words, 0))
+            elif word in ("infinite", "ponder"):
+                limits[word] = True
+
+        if not self.state.has_legal_move() or self.state.board.game_over:
+            self.send("bestmove 0000")
+            return
+        if self.search is None:
+            self.search = MCTS(self.state, None, hashtable_size_mb=self.options["Hash"],
+                               selection=self.options["Selection"], model=self.model, evaluator=self.evaluator,
+                               eval_cache=self.eval_cache, use_opening_book=self.options["OwnBook"],
+                               tree_workers=self.options["Threads"], leaf_rollouts=self.options["LeafRollouts"])
+
+        search_limits = self._search_limits(limits)
+        self.ponder_limits = None
+        if limits.get("ponder") or limits.get("infinite"):
+            # Search until stop, or until ponderhit gives the search its time
+            if limits.get("ponder"):
+                self.ponder_limits = search_limits
+            search_limits = {"time_limit": None}
+        self.search.iterations = limits.get("nodes")
+        self.search.depth_limit = limits.get("depth")
+        # The search goes on from the subtree of the position, the info counts the simulations of this search only
+        self.search.set_current_node(self.state)
+        progress = (time.perf_counter(), self._root_visits())
+        self.searching = threading.Event()
+        self.searching.set()
+        self.search_thread = threading.Thread(target=self._search, daemon=True,
+                                              args=(self.state.copy(), search_limits, self.searching, progress))
+        self.search_thread.start()
+        threading.Thread(target=self._report, args=(self.searching, progress), daemon=True).start()
+
+    def _search_limits(self, limits: dict) -> dict:
+        """ The time limit of a search
+
+         :param limits: The parsed arguments of go
+         :return: The time arguments of MCTS.select_move"""
+        if "movetime" in limits:
+            return {"time_limit": limits["movetime"] / 1000}
+        side = "w" if self.state.board.turn == "w" else "b"
+        if f"{side}time" in limits:
+            return {"clock": limits[f"{side}time"] / 1000, "increment": limits.get(f"{side}inc", 0) / 1000,
+                    "moves_to_go": limits.get("movestogo")}
+        return {"time_limit": None}
+
+    def _search(self, state: GameState, limits: dict, searching: threading.Event, progress: tuple[float, int]):
+        """ Run the search in the background and answer with the best move
+
+         :param state: The position to search
+         :param limits: The time arguments of MCTS.select_move
+         :param searching: The event of the search, cleared when it ends
+         :param progress: The time.perf_counter() time the search started at and the visits the root had"""
+        try:
+            move = self.search.select_move(state, **limits)
+        finally:
+            searching.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        line = self.search.principal_variation(move)
+        self._info(line, progress)
+        # The expected reply is only offered to a GUI that lets the engine ponder
+        ponder = f" ponder {line[1]}" if self.options["Ponder"] and len(line) > 1 else ""
+        self.send(f"bestmove {move}{ponder}")
+
+    def _report(self, searching: threading.Event, progress: tuple[float, int]):
+        """ Send an info line every INFO_INTERVAL seconds while the search runs
+
+         :param searching: The event of the search
+         :param progress: The time.perf_counter() time the search started at and the visits the root had"""
+        while searching.is_set():
+            time.sleep(INFO_INTERVAL)
+            if searching.is_set():
+                self._info(self.search.principal_variation(), progress)
+
+    def _info(self, line: list[str], progress: tuple[float, int]):
+        """ Send the progress of the search: the depth of the line, the simulations, the simulations per second and
+        the line
+
+         :param line: The principal variation
+         :param progress: The time.perf_counter() time the search started at and the visits the root had"""
+        started, start_visits = progress
+        elapsed = time.perf_counter() - started
+        nodes = max(self._root_visits() - start_visits, 0)
+        nps = int(nodes / elapsed) if elapsed > 0 else 0
+        pv = f" pv {' '.join(line)}" if line else ""
+        self.send(f"info depth {len(line)} nodes {nodes} nps {nps} time {int(elapsed * 1000)}{pv}")
+
+    def _root_visits(self) -> int:
+        """ The visits of the root of the search, read under the lock of its tree while the search runs """
+        with self.search.tree_lock:
+            return int(self.search.tree.visits[self.search.tree.root])
+
+    def _ponderhit(self):
+        """ The opponent played the expected move: the ponder search goes on as a normal search with its time """
+        if self.ponder_limits is None or self.searching is None or not self.searching.is_set():
+            return
+        limits, self.ponder_limits = self.ponder_limits, None
+        time_limit = limits.get("time_limit")
+        if "clock" in limits:
+            time_limit = allocate_time(limits["clock"], limits["increment"], limits["moves_to_go"])
+        if time_limit is not None:
+            self.timer = threading.Timer(time_limit, self.search.stop)
+            self.timer.start()
+
+    def _stop_search(self):
+        """ Stop the running search, it answers with its best move before this returns """
+        if self.search_thread is None:
+            return
+        self.search.stop()
+        self.search_thread.join()
+        self.search_thread = None
+        # The search may have ended on its own before stop, the next one mustn't see the request
+        self.search.stop_event.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the engine over the Universal Chess Interface")
+    parser.add_argument("--model", default=None, help="An exported model artifact (.npz)")
+    args = parser.parse_args()
+    engine_model = None
+    if args.model:
+        from transformer.runtime import InferenceModel
+        engine_model = InferenceModel.load(args.model)
+    engine = UCIEngine(engine_model)
+    if args.model:
+        engine.options["Model"] = args.model
+    engine.run()
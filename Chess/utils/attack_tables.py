@@ -0,0 +1,150 @@
+""" Precomputed attack tables for the 64 squares (a1 = 0, h8 = 63).
+
+Knight, king and pawn attacks are simple lookups. Sliding pieces use one ray per direction: the ray is cut at the
+first blocker, which is the lowest set bit for the directions that increase the square index and the highest set bit
+for the others. Every table exists both as bitboards (for Bitboard positions) and as lists of squares (for the 8x8
+board of Piece objects). """
+
+KNIGHT_OFFSETS = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+KING_OFFSETS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+# Directions of the sliding pieces, the first four increase the square index and the last four decrease it
+ROOK_DIRECTIONS = [0, 1, 4, 5]  # N, E, S, W
+BISHOP_DIRECTIONS = [2, 3, 6, 7]  # NE, NW, SE, SW
+DIRECTIONS = [(1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, 1), (-1, -1)]
+
+
+def _targets(square: int, offsets) -> list[int]:
+    """ Returns the squares reached from a square with each of the offsets that stay on the board
+
+     :param square: The start square
+     :param offsets: The (row, col) offsets
+     :return: The list of squares"""
+    row, col = divmod(square, 8)
+    return [(row + row_offset) * 8 + col + col_offset for row_offset, col_offset in offsets
+            if 0 <= row + row_offset < 8 and 0 <= col + col_offset < 8]
+
+
+def _ray(square: int, direction: tuple[int, int]) -> list[int]:
+    """ Returns the squares from a square to the edge of the board in one direction, nearest first
+
+     :param square: The start square
+     :param direction: The (row, col) step
+     :return: The list of squares"""
+    row, col = divmod(square, 8)
+    squares = []
+    row, col = row + direction[0], col + direction[1]
+    while 0 <= row < 8 and 0 <= col < 8:
+        squares.append(row * 8 + col)
+        row, col = row + direction[0], col + direction[1]
+    return squares
+
+
+def _to_bitboard(squares) -> int:
+    """ Convert a list of squares to a bitboard
+
+     :param squares: The squares
+     :return: The bitboard"""
+    bitboard = 0
+    for square in squares:
+        bitboard |= 1 << square
+    return bitboard
+
+
+KNIGHT_SQUARES = [_targets(square, KNIGHT_OFFSETS) for square in range(64)]
+KING_SQUARES = [_targets(square, KING_OFFSETS) for square in range(64)]
+# PAWN_SQUARES[0] are the squares attacked by a white pawn, PAWN_SQUARES[1] by a black pawn
+PAWN_SQUARES = [[_targets(square, [(1, -1), (1, 1)]) for square in range(64)],
+                [_targets(square, [(-1, -1), (-1, 1)]) for square in range(64)]]
+RAY_SQUARES = [[_ray(square, direction) for square in range(64)] for direction in DIRECTIONS]
+
+KNIGHT_ATTACKS = [_to_bitboard(squares) for squares in KNIGHT_SQUARES]
+KING_ATTACKS = [_to_bitboard(squares) for squares in KING_SQUARES]
+PAWN_ATTACKS = [[_to_bitboard(squares) for squares in PAWN_SQUARES[color]] for color in range(2)]
+RAYS = [[_to_bitboard(squares) for squares in RAY_SQUARES[direction]] for direction in range(8)]
+
+
+def _between() -> list[list[int]]:
+    """ Returns the table of the squares strictly between two squares on the same line (0 if they are not aligned)
+
+     :return: The 64x64 table of bitboards"""
+    between = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        for direction in range(8):
+            squares = RAY_SQUARES[direction][square]
+            for index, target in enumerate(squares):
+                between[square][target] = _to_bitboard(squares[:index])
+    return between
+
+
+BETWEEN = _between()
+
+
+def ray_attacks(square: int, occupied: int, directions) -> int:
+    """ Returns the squares attacked by a sliding piece, including the first blocker in every direction
+
+     :param square: The square of the sliding piece
+     :param occupied: The bitboard of all occupied squares
+     :param directions: The directions the piece slides in
+     :return: The attack bitboard"""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if direction < 4:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[direction][first]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square: int, occupied: int) -> int:
+    """ Returns the squares attacked by a rook
+
+     :param square: The square of the rook
+     :param occupied: The bitboard of all occupied squares
+     :return: The attack bitboard"""
+    return ray_attacks(square, occupied, ROOK_DIRECTIONS)
+
+
+def bishop_attacks(square: int, occupied: int) -> int:
+    """ Returns the squares attacked by a bishop
+
+     :param square: The square of the bishop
+     :param occupied: The bitboard of all occupied squares
+     :return: The attack bitboard"""
+    return ray_attacks(square, occupied, BISHOP_DIRECTIONS)
+
+
+def is_square_attacked_on_board(board, position: tuple[int, int], by_color: str) -> bool:
+    """ Check if a square of an 8x8 board of Piece objects is attacked by a color
+
+     :param board: The 8x8 board
+     :param position: The (row, col) of the square
+     :param by_color: The color of the attacking pieces
+     :return: True if a piece of by_color attacks the square, False otherwise"""
+    square = position[0] * 8 + position[1]
+    for target in KNIGHT_SQUARES[square]:
+        piece = board[target >> 3][target & 7]
+        if piece is not None and piece.color == by_color and piece.type == "N":
+            return True
+    for target in KING_SQUARES[square]:
+        piece = board[target >> 3][target & 7]
+        if piece is not None and piece.color == by_color and piece.type == "K":
+            return True
+    # A pawn of by_color attacks the square from where a pawn of the other color standing on the square would attack
+    for target in PAWN_SQUARES[1 if by_color == "w" else 0][square]:
+        piece = board[target >> 3][target & 7]
+        if piece is not None and piece.color == by_color and piece.type == "P":
+            return True
+    for direction in range(8):
+        sliders = "RQ" if direction in ROOK_DIRECTIONS else "BQ"
+        for target in RAY_SQUARES[direction][square]:
+            piece = board[target >> 3][target & 7]
+            if piece is not None:
+                if piece.color == by_color and piece.type in sliders:
+                    return True
+                break
+    return False
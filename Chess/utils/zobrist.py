@@ -0,0 +1,15 @@
+""" Zobrist keys for Bitboard positions.
+
+Every (piece, square) pair, castling right combination, en passant file and the side to move get a fixed random
+64-bit number. The key of a position is the XOR of the numbers of everything that is true in it, so a move only has
+to XOR in and out the numbers that it changes. The numbers come from a seeded generator so keys are stable across
+processes and runs. """
+from random import Random
+
+_random = Random(0x5EED)
+
+PIECE_KEYS = [[_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)]
+EN_PASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+CASTLING_KEYS[0] = 0  # No castling rights leaves the key unchanged
@@ -1,34 +1,58 @@
 import math
-from typing import Tuple
-from Chess.Board.GameState import GameState
+
+from Chess.Repository.Bitboard import move_to_uci
+from MCTS.search_tree import SearchTree
 
 
 class MCTSNode:
-    """ This is a node in the Monte Carlo Search Tree. """
-
-    def __init__(self, state: GameState, parent=None, move=None, alpha=-float("inf"), beta=float("inf"), model = None):
-        """ Create a new node
-
-         :param state: The current state
-         :param parent: The parent node
-         :param move: The move that led to the current state
-         :param alpha: The alpha value
-         :param beta: The beta value"""
-        self.state = state
-        self.parent = parent
-        self.move = move
-        self.children = []
-        self.visits = 0
-        self.wins = 0
-        self.alpha = alpha
-        self.beta = beta
-        self.model = model 
+    """ This is a node in the Monte Carlo Search Tree. The statistics live in the arrays of a SearchTree, a node is
+    only a view of one index of those arrays and is created on demand. """
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: SearchTree, index: int):
+        """ Create a view of a node
+
+         :param tree: The tree holding the node
+         :param index: The index of the node in the tree"""
+        self.tree = tree
+        self.index = index
+
+    @property
+    def parent(self):
+        parent = int(self.tree.parent[self.index])
+        return MCTSNode(self.tree, parent) if parent >= 0 else None
+
+    @property
+    def move(self) -> str | None:
+        return move_to_uci(int(self.tree.move[self.index])) if self.parent is not None else None
+
+    @property
+    def children(self) -> dict[str, "MCTSNode"]:
+        return {move_to_uci(int(self.tree.move[child])): MCTSNode(self.tree, child)
+                for child in self.tree.children(self.index)}
+
+    @property
+    def visits(self) -> int:
+        return int(self.tree.visits[self.index])
+
+    @property
+    def wins(self) -> float:
+        return float(self.tree.wins[self.index])
+
+    @property
+    def alpha(self) -> float:
+        return float(self.tree.alpha[self.index])
+
+    @property
+    def beta(self) -> float:
+        return float(self.tree.beta[self.index])
 
     def not_fully_expanded(self) -> bool:
         """ Check if the node has been fully expanded
 
-         :return: True if the node has not been fully expanded, False otherwise"""
-        return len(self.children) < len(self.state.possible_moves())
+         :return: True if the node has not been expanded or has an unvisited child, False otherwise"""
+        children = self.tree.children(self.index)
+        return not children or bool((self.tree.visits[children.start:children.stop] == 0).any())
 
     def ucb1(self, exploration_constant: float) -> float:
         """ Apply the UCT formula (Upper Confidence Bound applied to Trees)
@@ -37,12 +61,10 @@ class MCTSNode:
          :return: The UCT value"""
         if self.visits == 0:
             return float('inf')
-        if self.model is not None:
-            predicted_result = self.model.predict(self.state.fen())
-            print(predicted_result)
-            if predicted_result[0 if self.state.get_turn() == "b" else 2] > 0.5:
-                return float('inf')
-            else:
-                return self.wins / self.visits + exploration_constant * math.sqrt(math.log(self.parent.visits) / self.visits)
-        else:
-            return self.wins / self.visits + exploration_constant * math.sqrt(math.log(self.parent.visits) / self.visits)
+        return self.wins / self.visits + exploration_constant * math.sqrt(math.log(self.parent.visits) / self.visits)
+
+    def __eq__(self, other):
+        return isinstance(other, MCTSNode) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
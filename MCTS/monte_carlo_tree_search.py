@@ -1,21 +1,33 @@
+import argparse
+import cProfile
 import io
-import pickle
-import pstats
 import math
-from collections import deque
-from datetime import time
-from transformer.transformer import PositionalEncoding
-from transformer.transformer import TransformerBlock
-from transformer.transformer import ChessTransformer
+import os
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from multiprocessing import Pool
+import numpy as np
+from transformer.evaluator import BatchEvaluator
+from transformer.eval_cache import EvaluationCache
 from MCTS.Exceptions.LosingState import LosingState
-from hash_table import HashTable
+from hash_table import TranspositionTable
 from MCTS.monte_carlo_node import MCTSNode
+from MCTS.search_tree import SearchTree, ONGOING, TERMINAL
+from MCTS.selection import most_visited, puct_scores, select_best, ucb1_scores
+from MCTS.parallel import init_root_worker, rollout_leaf, search_root
+from MCTS.stats import SearchStats, StatsSink
+from MCTS.time_control import allocate_time
+from Chess.Repository.Bitboard import move_to_uci, uci_to_move
 from Chess.Repository.ChessRepository import ChessRepository
 from Chess.Board.GameState import GameState
 from Chess.utils.move_handlers import print_board
 from Chess.Exceptions.Checkmate import Checkmate
-import time
-import cProfile
+
+STOP_CHECK_INTERVAL = 8  # The number of iterations between two checks of whether the best root child is decided
 
 
 class MCTS:
@@ -31,24 +43,75 @@ class MCTS:
     The following implementation also uses a hashtable to store the results of the simulations, this allows the
     algorithm to avoid simulating the same game state multiple times. It also includes alpha-beta pruning to speed up
     the simulations."""
-    def __init__(self, state: GameState, iterations: int, exploration_constant: float = math.sqrt(2),
+    def __init__(self, state: GameState, iterations: int | None, exploration_constant: float = math.sqrt(2),
                  depth_limit: int | None = None, use_opening_book: bool = False,
-                 model: TransformerBlock = None):
+                 model=None, hashtable_size_mb: float = 16, selection: str = "ucb1",
+                 seed: int | None = None, evaluator: BatchEvaluator | None = None,
+                 eval_cache: EvaluationCache | None = None, root_workers: int = 1, tree_workers: int = 1,
+                 virtual_loss: int = 1, leaf_rollouts: int = 1, leaf_workers: int | None = None,
+                 time_limit: float | None = None, stats_sink: StatsSink | None = None):
         """ Initialize the MCTS object
 
         :param state: The initial state of the game
-        :param iterations: The number of iterations to run the algorithm
+        :param iterations: The number of iterations to run the algorithm, None to only search for the time limit
         :param exploration_constant: The exploration constant to use in the UCB1 algorithm
         :param depth_limit: The depth limit to use in the algorithm
-        :param use_opening_book: Whether to use the opening book """
+        :param use_opening_book: Whether to use the opening book
+        :param model: The model guiding the selection, a ChessTransformer or an exported InferenceModel
+        :param hashtable_size_mb: The memory budget of the transposition table in megabytes
+        :param selection: The selection formula, "ucb1" or "puct"
+        :param seed: The seed of the random generator used to break ties
+        :param evaluator: The batched evaluation service to send positions to, one is created for the model if None
+        :param eval_cache: The cache of model predictions, it is kept across moves
+        :param root_workers: The number of processes searching independent trees from the root, their root child
+        statistics are merged before the move is picked. 1 searches in this process
+        :param tree_workers: The number of threads searching the one tree of this process together
+        :param virtual_loss: The number of visits without a win a tree-parallel worker adds to the nodes on its path
+        until its result is backed up, so the other workers spread over other branches
+        :param leaf_rollouts: The number of random games played together from every selected node, their results are
+        backed up at once. 1 plays a single game in this process
+        :param leaf_workers: The number of processes playing the games of a leaf, all the cores if None
+        :param time_limit: The seconds to search every move for, the search stops at whichever of the iterations
+        and the time limit comes first
+        :param stats_sink: The JSON-lines file the statistics of every search are appended to """
         self.iterations = iterations  # The number of iterations to perform
+        self.time_limit = time_limit  # The seconds to search every move for
+        self.stats = SearchStats()  # The statistics of the last search
+        self.stats_sink = stats_sink
         self.exploration_constant = exploration_constant  # The exploration constant, sqrt(2) by default
-        self.root = MCTSNode(state)
-        self.hashtable = HashTable(1009)  # The hashtable to store the results of the simulations
-        self.current_node = self.root
+        self.hashtable = TranspositionTable(hashtable_size_mb)  # Stores the results of the simulations
+        self.model = model
+        # An evaluator passed in is shared with other searches, close() only stops the one created here
+        self.owns_evaluator = evaluator is None and model is not None
+        if self.owns_evaluator:
+            evaluator = BatchEvaluator(model)
+        self.evaluator = evaluator
+        self.eval_cache = eval_cache if eval_cache is not None else EvaluationCache()
+        self.selection = selection
+        self.rng = np.random.default_rng(seed)
+        self.root_workers = root_workers
+        self.pool = None  # The root-parallel worker processes, started by the first search that needs them
+        self.tree_workers = tree_workers
+        self.virtual_loss = virtual_loss if tree_workers > 1 else 0
+        # Guards the tree, the hashtable and the cache against the other searching threads and the threads reading
+        # the search, released during the rollouts and the model evaluations
+        self.tree_lock = threading.Lock()
+        # The evaluations submitted and not back yet, by key, so a worker waits for the one another worker sent
+        self.pending = {}
+        self.stop_event = threading.Event()  # Set to stop the running search after its current iteration
+        self.ponder_thread = None  # The thread searching on the opponent's time
+        self.leaf_rollouts = leaf_rollouts
+        self.leaf_workers = leaf_workers or os.cpu_count() or 1
+        self.leaf_pool = None  # The leaf-parallel worker processes, started by the first search that needs them
+        # The settings the root-parallel workers build their own searches with
+        self.options = {"exploration_constant": exploration_constant, "depth_limit": depth_limit, "model": model,
+                        "hashtable_size_mb": hashtable_size_mb, "selection": selection}
+        # The search plays its moves on one working copy of the state at the root of the tree
+        self.state = state.copy()
+        self.root_history_length = len(state.board.history)
+        self._new_tree()
         self.depth_limit = depth_limit
         self.use_opening_book = use_opening_book
-        self.model = model 
         # TODO: Create a stronger opening book
         self.opening_book = {
             # 6 moves of exchange QGD
@@ -66,156 +129,643 @@ class MCTS:
             "rnbqk2r/ppppbppp/4pn2/8/2PP4/6P1/PP1BPP1P/RN1QKBNR": "g1d3"
         }
 
+    @property
+    def root(self) -> MCTSNode:
+        return MCTSNode(self.tree, self.tree.root)
+
+    @property
+    def current_node(self) -> MCTSNode:
+        return self.root
+
+    def _new_tree(self):
+        """ Start an empty tree for the position of the working state """
+        self.tree = SearchTree()
+        self._describe_root()
+
+    def _describe_root(self):
+        """ Set the key, status and result of the root from the working state. A child that was never visited has
+        none of them yet when the tree is re-rooted onto it """
+        tree = self.tree
+        tree.key[tree.root] = self.state.get_key()
+        tree.status[tree.root] = TERMINAL if self.state.board.game_over or not self.state.has_legal_move() else ONGOING
+        tree.result[tree.root] = self.state.board.result or 0
+
     def set_current_node(self, state: GameState):
-        """ Set the current node to the one corresponding to the given state
+        """ Set the current node to the one corresponding to the given state. The moves played since the root are
+        followed down the tree, the matching subtree becomes the new root and the rest of the tree is reclaimed
 
          :param state: The state to set the current node to"""
-        # First look in the children of the current node
-        for child in self.current_node.children:
-            if child.state == state:
-                self.current_node = child
-                print_board(self.current_node.state.get_board())
-                return
-        # If it's not in the children of the node, look in the entire tree
-        queue = deque([self.root])
-        while queue:
-            node = queue.popleft()
-            if node.state == state and node != self.root and node != self.current_node:
-                self.current_node = node
-                print_board(self.current_node.state.get_board())
-                return
-            queue.extend(node.children)
-        if not self.current_node.state == state:
-            self.current_node = MCTSNode(state)
-
-    def _select(self, node: MCTSNode, depth: int) -> MCTSNode:
-        """ Select the next node to explore using the UCB1 algorithm
+        # Threads reading the search, like the info reports of the UCI engine, must not see the root half moved
+        with self._locked():
+            self._set_current_node(state)
+
+    def _set_current_node(self, state: GameState):
+        history = state.board.history
+        node = None
+        if history[:self.root_history_length] == self.state.board.history:
+            node = self.tree.root
+            for move in history[self.root_history_length:]:
+                node = self.tree.find_child(node, uci_to_move(move))
+                if node is None:
+                    break
+        if node is None:
+            # The game left the tree through another move order, look the position up by its key
+            node = self.tree.find_key(state.get_key())
+
+        self.state = state.copy()
+        self.root_history_length = len(history)
+        if node is None:
+            self._new_tree()
+        else:
+            self.tree.set_root(node)
+            self._describe_root()
+
+    def _child_scores(self, node: int, state: GameState | None = None) -> tuple[range, np.ndarray]:
+        """ Score all the children of a node in one vectorized expression over the tree arrays. Children that are
+        pruned by alpha-beta get -inf
+
+         :param node: The node
+         :param state: The working state, at the node's position
+         :return: The range of child indices and the score of every child"""
+        state = self.state if state is None else state
+        tree = self.tree
+        children = tree.children(node)
+        span = slice(children.start, children.stop)
+        visits = tree.visits[span].astype(np.float64)
+        parent_visits = int(tree.visits[node])
+        if self.selection == "puct":
+            scores = puct_scores(visits, tree.wins[span], tree.prior[span], parent_visits, self.exploration_constant)
+        else:
+            scores = ucb1_scores(visits, tree.wins[span], parent_visits, self.exploration_constant)
+        scores[tree.alpha[span] > tree.beta[node]] = -np.inf
+        if self.evaluator is not None:
+            candidates = np.flatnonzero(np.isfinite(scores))
+            if len(candidates):
+                # Evaluate the uncached candidate children in one batch, the model forces the children it predicts a
+                # win for
+                predicted_results = np.zeros((len(candidates), 3), dtype=np.float32)
+                sides, missing, submitted = [], [], []
+                for row, index in enumerate(candidates):
+                    state.push(int(tree.move[children.start + int(index)]))
+                    sides.append(0 if state.get_turn() == "b" else 2)
+                    key = state.get_key()
+                    cached = self.eval_cache.get(key)
+                    if cached is not None:
+                        predicted_results[row] = cached
+                    elif key in self.pending:
+                        missing.append((row, key, self.pending[key]))
+                    else:
+                        future = self.evaluator.submit(state.board.position.copy())
+                        self.pending[key] = future
+                        missing.append((row, key, future))
+                        submitted.append(key)
+                    state.pop()
+                if missing:
+                    try:
+                        # Other tree-parallel workers descend while this one waits for its batch
+                        with self._unlocked():
+                            started = time.perf_counter()
+                            self.evaluator.flush()
+                            evaluated = [future.result() for _, _, future in missing]
+                            seconds = time.perf_counter() - started
+                    finally:
+                        for key in submitted:
+                            self.pending.pop(key, None)
+                    self.stats.add("evaluate", seconds, len(submitted))
+                    for (row, key, _), predicted_result in zip(missing, evaluated):
+                        self.eval_cache.put(key, predicted_result)
+                        predicted_results[row] = predicted_result
+                forced = predicted_results[np.arange(len(candidates)), sides] > 0.5
+                scores[candidates[forced]] = np.inf
+        return children, scores
+
+    def _select(self, node: int, depth: int, state: GameState | None = None) -> int:
+        """ Select the next node to explore using the UCB1 algorithm, playing the moves on the working state. Every
+        node entered gets the virtual loss of the tree-parallel search
 
          :param node: The node to select from
          :param depth: The depth of the node
+         :param state: The working state, at the node's position
          :return: The selected node """
-        while not node.state.board.game_over:
-            if node.not_fully_expanded():
+        state = self.state if state is None else state
+        tree = self.tree
+        while tree.status[node] != TERMINAL:
+            if MCTSNode(tree, node).not_fully_expanded():
                 return node
             if self.depth_limit and depth >= self.depth_limit:
                 return node
-            hashtable_result = self.hashtable.lookup(node.state)
+            hashtable_result = self.hashtable.lookup(state.get_key())
             if hashtable_result:
                 value, move = hashtable_result
-                if node.state.board.turn == "w":
-                    if value >= node.beta:
+                if state.board.turn == "w":
+                    if value >= tree.beta[node]:
                         return node
                 else:
-                    if value <= node.alpha:
+                    if value <= tree.alpha[node]:
                         return node
-            children = node.children
-            children = [child for child in children if child.alpha <= node.beta]
-            if len(children) == 0:
+            children, scores = self._child_scores(node, state)
+            best = select_best(scores, self.rng)
+            if best is None:
                 return node
-            node = max(children, key=lambda c: c.ucb1(self.exploration_constant))
+            node = children.start + best
+            if self.virtual_loss:
+                tree.visits[node] += self.virtual_loss
+            state.push(int(tree.move[node]))
             depth += 1
         return node
 
-    def _expand(self, node: MCTSNode) -> MCTSNode:
-        """ Expand the selected node by creating new children
+    def _expand(self, node: int, state: GameState | None = None) -> int:
+        """ Expand the selected node: create its children if needed, then play one of the unvisited ones
 
          :param node: The node to expand
+         :param state: The working state, at the node's position
          :return: The new child node """
-        next_state = pickle.loads(pickle.dumps(node.state, -1))
+        state = self.state if state is None else state
+        tree = self.tree
+        if tree.status[node] == TERMINAL:
+            return node
+        if tree.first_child[node] < 0:
+            # Every generated move is legal, so the children are exactly the moves that can be played
+            tree.add_children(node, list(state.board.position.legal_moves()))
+            self.stats.branching[tree.child_count[node]] += 1
+        children = tree.children(node)
+        unvisited = np.flatnonzero(tree.visits[children.start:children.stop] == 0)
+        if len(unvisited) == 0:
+            return node
+        child = children.start + int(self.rng.choice(unvisited))
+        if self.virtual_loss:
+            # Keep the other tree-parallel workers off the child until its result is backed up
+            tree.visits[child] += self.virtual_loss
+        state.push(int(tree.move[child]))
+        tree.key[child] = state.get_key()
         try:
-            next_state.play_random_move()
+            state.check_game_over()
+            tree.status[child] = ONGOING
         except Checkmate:
-            return node
-        new_node = MCTSNode(next_state, parent=node, alpha=node.alpha, beta=node.beta,
-                            move=next_state.board.history[-1], model=self.model)
-        node.children.append(new_node)
-        return new_node
+            # The move ended the game, the child is a terminal node
+            tree.status[child] = TERMINAL
+            tree.result[child] = state.board.result
+        return child
 
-    def _simulate(self, node: MCTSNode) -> int:
+    def _simulate(self, node: int, state: GameState | None = None) -> float:
         """ Simulate the game to a terminal state and return the result
 
          :param node: The node to simulate from
+         :param state: The working state, at the node's position
          :return: The result of the simulation """
-        state = pickle.loads(pickle.dumps(node.state, -1))
-        # start = time.time()
-        while not state.board.game_over:
-            hashtable_result = self.hashtable.lookup(state)
-            if hashtable_result:
-                value, move = hashtable_result
-                if state.board.turn == "w":
-                    if value >= node.beta:
-                        return -1
-                    node.alpha = max(node.alpha, value)
-                else:
-                    if value <= node.alpha:
-                        return 1
-                    node.beta = min(node.beta, value)
-            else:
+        tree = self.tree
+        if tree.status[node] == TERMINAL:
+            return float(tree.result[node])
+        # Play the rollout on the working state and take the moves back afterwards instead of copying it
+        state = self.state if state is None else state
+        start_depth = len(state.board.history)
+        try:
+            while not state.board.game_over:
+                hashtable_result = self.hashtable.lookup(state.get_key())
+                if hashtable_result:
+                    # A stored value outside the window ends the rollout as a win for the side it favours, one
+                    # inside only narrows the window and the rollout goes on
+                    value, move = hashtable_result
+                    if state.board.turn == "w":
+                        if value >= tree.beta[node]:
+                            return 1
+                        with self._locked():
+                            tree.alpha[node] = max(tree.alpha[node], value)
+                    else:
+                        if value <= tree.alpha[node]:
+                            return 0
+                        with self._locked():
+                            tree.beta[node] = min(tree.beta[node], value)
                 try:
                     state.play_random_move()
-                except Checkmate as e:
-                    # print(e)
-                    # end = time.time()
-                    # print(end - start)
+                except Checkmate:
                     return state.board.result
-        # end = time.time()
-        # print(end - start)
-        return state.board.result
+            return state.board.result
+        finally:
+            while len(state.board.history) > start_depth:
+                state.pop()
+
+    def _simulate_leaf(self, node: int, state: GameState) -> tuple[float, int]:
+        """ Simulate the game from the node, playing leaf_rollouts games at once in the leaf-parallel workers
+
+         :param node: The node to simulate from
+         :param state: The working state, at the node's position
+         :return: The sum of the results of the simulations and their number"""
+        if self.leaf_rollouts <= 1:
+            return self._simulate(node, state), 1
+        if self.tree.status[node] == TERMINAL:
+            return float(self.tree.result[node]) * self.leaf_rollouts, self.leaf_rollouts
+        # The games are split over the workers. They play them without the alpha-beta cutoffs of _simulate, the
+        # hashtable is only in this process
+        shares = [len(share) for share in np.array_split(range(self.leaf_rollouts), self.leaf_workers) if len(share)]
+        seeds = self.rng.integers(1 << 31, size=len(shares))
+        tasks = [(state, share, int(seed)) for share, seed in zip(shares, seeds)]
+        return sum(self.leaf_pool.starmap(rollout_leaf, tasks)), self.leaf_rollouts
 
-    def _backpropagate(self, node: MCTSNode, result: int):
-        """ Backpropagate the result of the simulation from the terminal node to the root node
+    def _backpropagate(self, node: int, result: float, simulations: int = 1):
+        """ Backpropagate the result of the simulation from the terminal node to the root node, taking back the
+        virtual loss added on the way down
 
          :param node: The terminal node
-         :param result: The result of the simulation"""
-        while node is not None:
-            node.visits += 1
-            node.wins += result
-            node = node.parent
+         :param result: The result of the simulation, the sum of the results when several were played
+         :param simulations: The number of simulations the result stands for"""
+        tree = self.tree
+        while node >= 0:
+            if node != tree.root:
+                tree.visits[node] -= self.virtual_loss
+            tree.visits[node] += simulations
+            tree.wins[node] += result
+            self._store(node)
+            node = tree.parent[node]
 
-    def select_move(self, state: GameState) -> str:
-        """ Perform the MCTS algorithm and select the best move
+    def _store(self, node: int):
+        """ Record the statistics of a node in the transposition table, so the probes of the selection and of the
+        rollouts find the positions the tree has searched. The depth of the entry is the bit length of the visit
+        count, so the replacement policy keeps the positions searched the most
 
+         :param node: The node"""
+        tree = self.tree
+        visits = int(tree.visits[node])
+        if visits <= 0:
+            return
+        move = None
+        children = tree.children(node)
+        if children:
+            child_visits = tree.visits[children.start:children.stop]
+            if child_visits.max() > 0:
+                move = int(tree.move[children.start + int(child_visits.argmax())])
+        self.hashtable.store(int(tree.key[node]), float(tree.wins[node]) / visits, move, visits.bit_length(), visits)
+
+    def _return_to_root(self, state: GameState | None = None):
+        """ Take back the moves played on the working state during an iteration
+
+         :param state: The working state"""
+        state = self.state if state is None else state
+        while len(state.board.history) > self.root_history_length:
+            state.pop()
+
+    def _locked(self) -> threading.Lock:
+        """ The lock of the tree """
+        return self.tree_lock
+
+    @contextmanager
+    def _unlocked(self):
+        """ Release the lock of the tree held by the calling thread for the duration of the block """
+        self.tree_lock.release()
+        try:
+            yield
+        finally:
+            self.tree_lock.acquire()
+
+    def select_move(self, state: GameState, time_limit: float | None = None, clock: float | None = None,
+                    increment: float = 0.0, moves_to_go: int | None = None) -> str:
+        """ Perform the MCTS algorithm and select the best move. With a time budget the search can be stopped at any
+        iteration, the move is then the best one found so far
+
+         :param state: The state to select a move for
+         :param time_limit: The seconds to search this move for, the time limit of the search if None
+         :param clock: The seconds left on the clock of the side to move, the budget is allocated from it when no
+         time limit is given
+         :param increment: The seconds added to the clock after every move
+         :param moves_to_go: The number of moves until the next time control
          :return: The best move """
+        started = time.perf_counter()
+        if time_limit is None:
+            time_limit = allocate_time(clock, increment, moves_to_go) if clock is not None else self.time_limit
+        deadline = started + time_limit if time_limit is not None else None
+        self.stats = SearchStats()
+        self.stats.start(self)
         self.set_current_node(state)
 
         if self.use_opening_book:
-            fen = self.root.state.fen().split(" ")[0]
+            fen = self.state.fen().split(" ")[0]
             if fen in self.opening_book:
+                self._finish_stats(self.opening_book[fen])
                 return self.opening_book[fen]
 
-        for _ in range(self.iterations):
-            node = self._select(self.current_node, 0)
-            try:
-                if node.not_fully_expanded():
-                    node = self._expand(node)
-            except LosingState:
-                pass
-            result = self._simulate(node)
-            self._backpropagate(node, result)
+        if self.root_workers > 1:
+            self._merge_root_statistics(self._search_root_parallel(deadline))
+            # The iterations ran in the workers, only their simulations are known here
+            self.stats.simulations = int(self.tree.visits[self.tree.root])
+        else:
+            self.hashtable.new_search()
+            self._run_iterations(self.iterations, deadline)
+        self.stop_event.clear()
+        move = self.best_move()
+        self._finish_stats(move)
+        return move
 
-        best_child = max(self.current_node.children, key=lambda c: c.ucb1(self.exploration_constant))
-        self.current_node = best_child
-        return best_child.move
+    def _finish_stats(self, move: str | None = None):
+        """ Complete the statistics of the search and write them to the sink
+
+         :param move: The move the search picked"""
+        self.stats.finish(self, move)
+        if self.stats_sink is not None:
+            self.stats_sink.write(self.stats)
+
+    def search(self, state: GameState, time_limit: float | None = None, iterations: int | None = None):
+        """ Search the given state for a while without picking a move. The tree is kept, so a search split in several
+        calls, like the time slices of a scheduler, adds up to one search of the whole time
+
+         :param state: The state to search
+         :param time_limit: The seconds to search for, None for no limit
+         :param iterations: The number of iterations, None for no limit"""
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.stats = SearchStats("search")
+        self.stats.start(self)
+        self.set_current_node(state)
+        self._run_iterations(iterations, deadline)
+        self.stop_event.clear()
+        self._finish_stats()
+
+    def best_move(self) -> str:
+        """ Pick the most visited child of the root as the search left them. When no child was visited yet, like
+        after a root-parallel merge of empty searches, the selection scores pick it instead
+
+         :return: The best move"""
+        with self._locked():
+            best_child = self._most_visited_child()
+            if best_child is None:
+                children, scores = self._child_scores(self.tree.root)
+                best = select_best(scores, self.rng)
+                if best is None:
+                    raise Checkmate("Game over: the position has no move to search")
+                best_child = children.start + best
+            return move_to_uci(int(self.tree.move[best_child]))
+
+    def _most_visited_child(self) -> int | None:
+        """ The root child the move is picked from: the most visited one, ties broken by the mean value
+
+         :return: The child, or None if no child of the root was visited"""
+        children = self.tree.children(self.tree.root)
+        span = slice(children.start, children.stop)
+        best = most_visited(self.tree.visits[span], self.tree.wins[span], self.rng)
+        return None if best is None else children.start + best
+
+    def _run_iterations(self, iterations: int | None, deadline: float | None = None):
+        """ Run iterations of selection, expansion, simulation and backpropagation from the root
+
+         :param iterations: The number of iterations, None for no limit
+         :param deadline: The time.perf_counter() time to stop at, None for no limit"""
+        if self.leaf_rollouts > 1 and self.leaf_pool is None:
+            self.leaf_pool = Pool(self.leaf_workers)
+        started = time.perf_counter()
+        if self.tree_workers > 1:
+            # The workers hold node indices the whole time, reclaim the nodes cut off by earlier moves before they
+            # start. The tree only grows while they run, which keeps every index valid
+            with self._locked():
+                self.tree.make_room()
+            counter = count()
+            with ThreadPoolExecutor(self.tree_workers) as executor:
+                workers = [executor.submit(self._tree_worker, counter, iterations, started, deadline)
+                           for _ in range(self.tree_workers)]
+                for worker in workers:
+                    worker.result()
+            return
+        done = 0
+        while not self._search_finished(done, iterations, started, deadline):
+            # Reclaim the nodes cut off by earlier moves while no node index is held
+            with self._locked():
+                self.tree.make_room()
+            self._iteration(self.state)
+            done += 1
+
+    def _tree_worker(self, counter: count, iterations: int | None, started: float, deadline: float | None):
+        """ Run iterations in one thread of the tree-parallel search on its own copy of the working state, until the
+        search is finished
+
+         :param counter: The counter of the iterations started by the workers together
+         :param iterations: The number of iterations, None for no limit
+         :param started: The time.perf_counter() time the search started at
+         :param deadline: The time.perf_counter() time to stop at, None for no limit"""
+        state = self.state.copy()
+        while not self._search_finished(next(counter), iterations, started, deadline):
+            self._iteration(state)
+
+    def _iteration(self, state: GameState):
+        """ Run one iteration of selection, expansion, simulation and backpropagation from the root. The tree is only
+        locked while it is walked and updated, the rollout runs unlocked
+
+         :param state: The working state, at the root"""
+        stats = self.stats
+        try:
+            with self._locked():
+                started = time.perf_counter()
+                node = self._select(self.tree.root, 0, state)
+                selected = time.perf_counter()
+                try:
+                    node = self._expand(node, state)
+                except LosingState:
+                    pass
+                expanded = time.perf_counter()
+                stats.add("select", selected - started)
+                stats.add("expand", expanded - selected)
+                stats.depths[len(state.board.history) - self.root_history_length] += 1
+            result, simulations = self._simulate_leaf(node, state)
+            simulated = time.perf_counter()
+            with self._locked():
+                self._backpropagate(node, result, simulations)
+                stats.add("simulate", simulated - expanded)
+                stats.add("backpropagate", time.perf_counter() - simulated)
+                stats.iterations += 1
+                stats.simulations += simulations
+        finally:
+            self._return_to_root(state)
+
+    def _search_finished(self, done: int, iterations: int | None, started: float, deadline: float | None) -> bool:
+        """ Check between two iterations whether the search is finished: the iterations are done, the search was
+        stopped, the deadline has passed, or the child best_move would play can't be overtaken in the time left. The
+        clock is read once per call and the root children are only looked at every STOP_CHECK_INTERVAL iterations
+
+         :param done: The number of iterations done
+         :param iterations: The number of iterations, None for no limit
+         :param started: The time.perf_counter() time the search started at
+         :param deadline: The time.perf_counter() time to stop at, None for no limit
+         :return: True if no other iteration should start"""
+        if iterations is not None and done >= iterations:
+            return True
+        # Run at least one iteration, so the root has children to pick the move from
+        if done == 0:
+            return False
+        if self.stop_event.is_set():
+            return True
+        if deadline is None:
+            return False
+        now = time.perf_counter()
+        if now >= deadline:
+            return True
+        if done % STOP_CHECK_INTERVAL:
+            return False
+        with self._locked():
+            children = self.tree.children(self.tree.root)
+            if len(children) < 2:
+                return True
+            # The lead of the child best_move would play over every other child
+            best_child = self._most_visited_child()
+            if best_child is None:
+                return False
+            visits = self.tree.visits[children.start:children.stop]
+            lead = visits[best_child - children.start] - np.delete(visits, best_child - children.start).max()
+        remaining = done / max(now - started, 1e-9) * (deadline - now)
+        if iterations is not None:
+            remaining = min(remaining, iterations - done)
+        return lead > remaining * max(self.leaf_rollouts, 1)
+
+    def principal_variation(self, move: str | None = None, max_length: int = 32) -> list[str]:
+        """ The line the search expects, following the most visited child from the root. It can be read while the
+        search runs
+
+         :param move: The first move of the line, the most visited root child if None
+         :param max_length: The maximum number of moves
+         :return: The moves of the line"""
+        with self._locked():
+            tree = self.tree
+            node = tree.root
+            line = []
+            if move is not None:
+                node = tree.find_child(node, uci_to_move(move))
+                line.append(move)
+            while node is not None and len(line) < max_length:
+                children = tree.children(node)
+                if not children:
+                    break
+                visits = tree.visits[children.start:children.stop]
+                if visits.max() <= 0:
+                    break
+                node = children.start + int(visits.argmax())
+                line.append(move_to_uci(int(tree.move[node])))
+            return line
+
+    def stop(self):
+        """ Stop the running search after its current iteration, select_move then returns the best move found so
+        far. The searches of root-parallel workers can't be stopped """
+        self.stop_event.set()
+
+    def ponder(self, state: GameState):
+        """ Search the given state in a background thread while the opponent thinks, until stop_pondering is called.
+        The tree is kept, so the next select_move starts from the subtree of the move the opponent plays. The
+        search runs in this process even with root-parallel workers
+
+         :param state: The state the opponent is to move in"""
+        self.stop_pondering()
+        self.stats = SearchStats("ponder")
+        self.stats.start(self)
+        self.set_current_node(state)
+        self.hashtable.new_search()
+        self.ponder_thread = threading.Thread(target=self._ponder, daemon=True)
+        self.ponder_thread.start()
+
+    def _ponder(self):
+        try:
+            self._run_iterations(None)
+        finally:
+            self.stop_event.clear()
+            self._finish_stats()
+
+    def stop_pondering(self):
+        """ Stop the background search started by ponder and wait for it to finish its current iteration """
+        if self.ponder_thread is None:
+            return
+        self.stop()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+
+    def root_statistics(self, state: GameState, iterations: int | None,
+                        time_limit: float | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Search the given state and return the statistics of the root children, this is the work of one
+        root-parallel worker
+
+         :param state: The state to search
+         :param iterations: The number of iterations, None for no limit
+         :param time_limit: The seconds to search for, None for no limit
+         :return: The moves, visit counts and win sums of the root children"""
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.set_current_node(state)
+        self.hashtable.new_search()
+        self._run_iterations(iterations, deadline)
+        children = self.tree.children(self.tree.root)
+        span = slice(children.start, children.stop)
+        return self.tree.move[span].copy(), self.tree.visits[span].copy(), self.tree.wins[span].copy()
+
+    def _search_root_parallel(self, deadline: float | None = None) -> list:
+        """ Search the working state in every root-parallel worker, each one with its own seed
+
+         :param deadline: The time.perf_counter() time to stop at, None for no limit
+         :return: The root child statistics of every worker"""
+        if self.pool is None:
+            self.pool = Pool(self.root_workers, initializer=init_root_worker, initargs=(self.state, self.options))
+        seeds = self.rng.integers(1 << 31, size=self.root_workers)
+        # The clocks of other processes aren't comparable, the workers get the time left instead of the deadline
+        time_limit = max(deadline - time.perf_counter(), 0) if deadline is not None else None
+        return self.pool.starmap(search_root, [(self.state, self.iterations, int(seed), time_limit)
+                                               for seed in seeds])
+
+    def _merge_root_statistics(self, statistics: list):
+        """ Sum the root child statistics of the workers into the children of this tree's root, the move is then
+        picked from them like after a search in this process
+
+         :param statistics: The moves, visit counts and win sums of every worker"""
+        with self._locked():
+            self._add_root_statistics(statistics)
+
+    def _add_root_statistics(self, statistics: list):
+        tree = self.tree
+        root = tree.root
+        if tree.first_child[root] < 0:
+            tree.add_children(root, list(self.state.board.position.legal_moves()))
+        children = tree.children(root)
+        child_index = {int(tree.move[child]): child for child in children}
+        tree.visits[children.start:children.stop] = 0
+        tree.wins[children.start:children.stop] = 0
+        for moves, visits, wins in statistics:
+            for move, visit_count, win_sum in zip(moves, visits, wins):
+                child = child_index[int(move)]
+                tree.visits[child] += visit_count
+                tree.wins[child] += win_sum
+        tree.visits[root] = tree.visits[children.start:children.stop].sum()
+
+    def close(self):
+        """ Stop pondering, the root-parallel and leaf-parallel workers and the evaluator created by this search """
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        if self.leaf_pool is not None:
+            self.leaf_pool.terminate()
+            self.leaf_pool = None
+        if self.owns_evaluator:
+            self.evaluator.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a game of MCTS against itself")
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--stats", default=None, help="A JSON-lines file to append the statistics of every move to")
+    parser.add_argument("--profile", action="store_true", help="Profile the game and print the slowest calls")
+    args = parser.parse_args()
+
     chess_repository = ChessRepository()
     chess_repository.initialize_board()
     chess_state = GameState(chess_repository)
-    mcts = MCTS(chess_state, iterations=2)
+    mcts = MCTS(chess_state, iterations=args.iterations, stats_sink=StatsSink(args.stats) if args.stats else None)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
     start = time.time()
+    moves = 0
     while not chess_state.board.game_over:
-        # pr = cProfile.Profile()
-        # pr.enable()
         move = mcts.select_move(chess_state)
-        # pr.disable()
-        # s = io.StringIO()
-        #  sortby = 'cumulative'
-        #  ps = pstats.Stats(pr, stream=s).sort_stats(sortby)
-        # ps.print_stats()
-        # print(s.getvalue())
-        # print(move)
-        print(f"\nTime taken on average/game: {(time.time() - start)/20}")
-        chess_state.make_move(move)
-        # mcts.set_current_node(chess_state)
+        moves += 1
+        stats = mcts.stats
+        print(f"\n{move}: {stats.simulations} simulations in {stats.elapsed:.2f}s ({stats.nps:.1f}/s), "
+              f"average time per move: {(time.time() - start) / moves:.2f}s")
+        try:
+            chess_state.make_move(move)
+        except Checkmate as game_over:
+            print(game_over)
         print_board(chess_state.get_board())
+    if profiler is not None:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+        print(output.getvalue())
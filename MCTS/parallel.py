@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+
+from Chess.Exceptions.Checkmate import Checkmate
+
+# The search of a root-parallel worker process, it keeps its tree between moves like a search in the main process
+_root_search = None
+
+
+def init_root_worker(state, options: dict):
+    """ Set up the search of a root-parallel worker process
+
+     :param state: The state of the game when the workers start
+     :param options: The MCTS settings of the worker searches"""
+    global _root_search
+    from MCTS.monte_carlo_tree_search import MCTS
+    _root_search = MCTS(state, 0, **options)
+
+
+def search_root(state, iterations: int | None, seed: int,
+                time_limit: float | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Search a state in a root-parallel worker process
+
+     :param state: The state to search
+     :param iterations: The number of iterations, None for no limit
+     :param seed: The seed of this worker's search for this move
+     :param time_limit: The seconds to search for, None for no limit
+     :return: The moves, visit counts and win sums of the root children"""
+    # The rollouts draw their moves from the random module, seed it too so every worker plays its own games
+    random.seed(seed)
+    _root_search.rng = np.random.default_rng(seed)
+    return _root_search.root_statistics(state, iterations, time_limit)
+
+
+def rollout_leaf(state, rollouts: int, seed: int) -> float:
+    """ Play random games from the position of a leaf in a leaf-parallel worker process
+
+     :param state: The state at the leaf
+     :param rollouts: The number of games
+     :param seed: The seed of this worker's games
+     :return: The sum of the results of the games"""
+    random.seed(seed)
+    start_depth = len(state.board.history)
+    total = 0.0
+    for _ in range(rollouts):
+        try:
+            while not state.board.game_over:
+                state.play_random_move()
+        except Checkmate:
+            pass
+        total += state.board.result
+        while len(state.board.history) > start_depth:
+            state.pop()
+    return total
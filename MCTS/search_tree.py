@@ -0,0 +1,172 @@
+import numpy as np
+
+# The per-node statistics, each one is a NumPy array indexed by node
+NODE_FIELDS = {
+    "visits": np.int32,
+    "wins": np.float64,  # The sum of the simulation results backed up through the node
+    "prior": np.float32,  # The prior probability of the move leading to the node
+    "parent": np.int32,  # -1 for the root
+    "first_child": np.int32,  # The children of a node are stored next to each other, -1 if not expanded yet
+    "child_count": np.int16,
+    "move": np.uint16,  # The move leading to the node, encoded with Bitboard.encode_move
+    "alpha": np.float32,
+    "beta": np.float32,
+    "key": np.uint64,  # The Zobrist key of the position, 0 until the node is visited
+    "status": np.int8,  # UNKNOWN, ONGOING or TERMINAL
+    "result": np.float32,  # The result of the game for terminal nodes
+}
+UNKNOWN, ONGOING, TERMINAL = 0, 1, 2
+MAX_CHILDREN = 256  # More than the number of legal moves in any chess position
+
+
+class SearchTree:
+    """ Structure-of-arrays storage for the Monte Carlo search tree. A node is an index into the arrays, the children
+    of a node are allocated together when it is expanded, and positions are not stored at all: the search replays
+    the moves from the root on a single GameState. Nodes that are cut off when the root moves are reclaimed by
+    compact(), which the search calls between iterations when the arrays are full. """
+
+    def __init__(self, capacity: int = 4096):
+        """ Create a tree holding only a root node
+
+         :param capacity: The number of nodes to allocate room for up front"""
+        self.capacity = capacity
+        for name, dtype in NODE_FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.size = 1
+        self.root = 0
+        self.parent[0] = -1
+        self.first_child[0] = -1
+        self.alpha[0] = -np.inf
+        self.beta[0] = np.inf
+
+    def _allocate(self, count: int) -> int:
+        """ Reserve room for count consecutive nodes, growing the arrays if they are full. Node indices stay valid
+
+         :param count: The number of nodes
+         :return: The index of the first node"""
+        if self.size + count > self.capacity:
+            self._grow(max(self.capacity * 2, self.size + count))
+        first = self.size
+        self.size += count
+        return first
+
+    def _grow(self, capacity: int):
+        """ Resize the arrays
+
+         :param capacity: The new number of nodes"""
+        for name in NODE_FIELDS:
+            grown = np.zeros(capacity, dtype=NODE_FIELDS[name])
+            grown[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, grown)
+        self.capacity = capacity
+
+    def make_room(self, count: int = MAX_CHILDREN):
+        """ Make sure count more nodes fit without growing, by reclaiming the nodes outside the root's subtree first.
+        Compaction moves nodes, so this must only be called while no node indices are held
+
+         :param count: The number of nodes that should fit"""
+        if self.size + count <= self.capacity:
+            return
+        self.compact()
+        if self.size + count > self.capacity // 2:
+            self._grow(max(self.capacity * 2, self.size + count))
+
+    def compact(self):
+        """ Copy the subtree of the root to the front of the arrays and drop every other node. The order is breadth
+        first so the children of every node stay next to each other """
+        order = [self.root]
+        index = 0
+        while index < len(order):
+            node = order[index]
+            if self.first_child[node] >= 0:
+                first = int(self.first_child[node])
+                order.extend(range(first, first + int(self.child_count[node])))
+            index += 1
+        order = np.array(order, dtype=np.int64)
+        live = len(order)
+        new_index = np.full(self.size, -1, dtype=np.int32)
+        new_index[order] = np.arange(live, dtype=np.int32)
+        for name in NODE_FIELDS:
+            array = getattr(self, name)
+            array[:live] = array[order]
+        self.parent[1:live] = new_index[self.parent[1:live]]
+        self.parent[0] = -1
+        children = self.first_child[:live]
+        expanded = children >= 0
+        children[expanded] = new_index[children[expanded]]
+        self.root = 0
+        self.size = live
+
+    def add_children(self, node: int, moves: list[int], priors=None) -> int:
+        """ Expand a node with one child per move
+
+         :param node: The node to expand
+         :param moves: The encoded moves
+         :param priors: The prior probability of every move, uniform by default
+         :return: The index of the first child"""
+        count = len(moves)
+        first = self._allocate(count)
+        children = slice(first, first + count)
+        self.visits[children] = 0
+        self.wins[children] = 0
+        self.prior[children] = priors if priors is not None else (1 / count if count else 0)
+        self.parent[children] = node
+        self.first_child[children] = -1
+        self.child_count[children] = 0
+        self.move[children] = moves
+        self.alpha[children] = self.alpha[node]
+        self.beta[children] = self.beta[node]
+        self.key[children] = 0
+        self.status[children] = UNKNOWN
+        self.result[children] = 0
+        self.first_child[node] = first
+        self.child_count[node] = count
+        return first
+
+    def children(self, node: int) -> range:
+        """ Returns the indices of the children of a node
+
+         :param node: The node
+         :return: The range of child indices"""
+        first = int(self.first_child[node])
+        if first < 0:
+            return range(0)
+        return range(first, first + int(self.child_count[node]))
+
+    def find_child(self, node: int, move: int) -> int | None:
+        """ Find the child of a node reached with a move
+
+         :param node: The node
+         :param move: The encoded move
+         :return: The index of the child, or None if the node has no such child"""
+        children = self.children(node)
+        if not children:
+            return None
+        matches = np.flatnonzero(self.move[children.start:children.stop] == move)
+        return children.start + int(matches[0]) if len(matches) else None
+
+    def find_key(self, key: int) -> int | None:
+        """ Find a node of the root's subtree by the Zobrist key of its position
+
+         :param key: The Zobrist key
+         :return: The index of a matching node, or None"""
+        for node in np.flatnonzero(self.key[:self.size] == np.uint64(key)):
+            ancestor = int(node)
+            while ancestor >= 0 and ancestor != self.root:
+                ancestor = int(self.parent[ancestor])
+            if ancestor == self.root:
+                return int(node)
+        return None
+
+    def set_root(self, node: int):
+        """ Make a node the root of the tree in O(1), the rest of the tree is reclaimed by the next compaction
+
+         :param node: The new root"""
+        self.parent[node] = -1
+        self.root = node
+
+    def nbytes(self) -> int:
+        """ Returns the memory used by the node arrays
+
+         :return: The number of bytes"""
+        return sum(getattr(self, name).nbytes for name in NODE_FIELDS)
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def ucb1_scores(visits: np.ndarray, wins: np.ndarray, parent_visits: int, exploration_constant: float) -> np.ndarray:
+    """ Apply the UCB1 formula to all the children of a node at once. Unvisited children score infinity so they are
+    always tried first
+
+     :param visits: The visit counts of the children
+     :param wins: The win sums of the children
+     :param parent_visits: The visit count of the parent
+     :param exploration_constant: The exploration constant
+     :return: The score of every child"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = wins / visits + exploration_constant * np.sqrt(np.log(max(parent_visits, 1)) / visits)
+    scores[visits == 0] = np.inf
+    return scores
+
+
+def puct_scores(visits: np.ndarray, wins: np.ndarray, priors: np.ndarray, parent_visits: int,
+                exploration_constant: float) -> np.ndarray:
+    """ Apply the PUCT formula (mean value plus a prior-weighted exploration bonus) to all the children of a node.
+    Unvisited children score their exploration bonus alone, the search expands them before it selects among
+    the children of a node
+
+     :param visits: The visit counts of the children
+     :param wins: The win sums of the children
+     :param priors: The prior probabilities of the children
+     :param parent_visits: The visit count of the parent
+     :param exploration_constant: The exploration constant
+     :return: The score of every child"""
+    values = np.divide(wins, visits, out=np.zeros(len(visits), dtype=np.float64), where=visits > 0)
+    scores = values + exploration_constant * priors * np.sqrt(parent_visits) / (1 + visits)
+    return scores
+
+
+def select_best(scores: np.ndarray, rng: np.random.Generator) -> int | None:
+    """ Pick the index of the highest score, breaking ties at random
+
+     :param scores: The scores, -inf marks the children that can't be selected
+     :param rng: The random generator used for tie-breaking
+     :return: The index of the selected score, or None if no score can be selected"""
+    if len(scores) == 0:
+        return None
+    best = scores.max()
+    if best == -np.inf:
+        return None
+    candidates = np.flatnonzero(scores == best)
+    return int(candidates[0]) if len(candidates) == 1 else int(rng.choice(candidates))
+
+
+def most_visited(visits: np.ndarray, wins: np.ndarray, rng: np.random.Generator) -> int | None:
+    """ Pick the index of the most visited child to play, breaking ties by the mean value and then at random. A child
+    that was never visited is never picked
+
+     :param visits: The visit counts of the children
+     :param wins: The win sums of the children
+     :param rng: The random generator used for tie-breaking
+     :return: The index of the picked child, or None if no child was visited"""
+    if len(visits) == 0 or visits.max() <= 0:
+        return None
+    candidates = np.flatnonzero(visits == visits.max())
+    values = wins[candidates] / visits[candidates]
+    candidates = candidates[values == values.max()]
+    return int(candidates[0]) if len(candidates) == 1 else int(rng.choice(candidates))
@@ -0,0 +1,177 @@
+import argparse
+import json
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from Chess.Board.GameState import GameState
+from Chess.Exceptions.Checkmate import Checkmate
+from Chess.Repository.Bitboard import move_to_uci
+from Chess.Repository.ChessRepository import ChessRepository
+from MCTS.monte_carlo_tree_search import MCTS
+from MCTS.search_tree import MAX_CHILDREN
+from transformer.encoding import BOARD_LENGTH, COMPACT_LENGTH, CompactEncoder, PositionEncoder
+from transformer.pipeline import ShardWriter
+
+LABEL_CLASSES = ["0-1", "1-0", "1/2-1/2"]  # The order LabelEncoder gives the results of the training games
+
+# The model and the encoder of a worker process, set up once by _init_worker
+_worker_model = None
+_worker_encoder = None
+
+
+def tokenizer_vocabulary(tokenizer_json: str) -> dict[str, int]:
+    """ Read the word index out of a Keras tokenizer saved with to_json, without importing Keras
+
+     :param tokenizer_json: The JSON of the tokenizer
+     :return: The word index"""
+    return json.loads(json.loads(tokenizer_json)["config"]["word_index"])
+
+
+def game_result(state: GameState) -> str:
+    """ Returns the result of a finished game as a training label
+
+     :param state: The state at the end of the game
+     :return: "1-0", "0-1" or "1/2-1/2\""""
+    if state.board.result == 0.5:
+        return "1/2-1/2"
+    # The side to move is the side that got mated
+    return "1-0" if state.board.turn == "b" else "0-1"
+
+
+def play_game(seed: int, iterations: int, max_plies: int = 300, temperature_plies: int = 8, model=None):
+    """ Play one game between two MCTS players and record every ply
+
+     :param seed: The seed of the game, the players and the move sampling derive from it
+     :param iterations: The number of MCTS iterations per move
+     :param max_plies: The number of plies after which the game is adjudicated a draw
+     :param temperature_plies: The number of opening plies whose move is sampled from the visit distribution instead
+     of being the best move, so games started from the same position differ
+     :param model: The model guiding both players, None for plain rollouts
+     :return: The positions, the root child moves and visit distributions of every ply, and the result"""
+    rng = np.random.default_rng(seed)
+    repository = ChessRepository()
+    repository.initialize_board()
+    state = GameState(repository)
+    players = {color: MCTS(state, iterations, model=model, seed=int(rng.integers(1 << 31))) for color in "wb"}
+    positions, moves, distributions = [], [], []
+    result = "1/2-1/2"
+    try:
+        for ply in range(max_plies):
+            player = players[state.board.turn]
+            best_move = player.select_move(state)
+            tree = player.tree
+            children = tree.children(tree.root)
+            child_moves = tree.move[children.start:children.stop].copy()
+            visits = tree.visits[children.start:children.stop].astype(np.float64)
+            distribution = visits / visits.sum() if visits.sum() else np.full(len(visits), 1 / len(visits))
+            positions.append(state.board.position.copy())
+            moves.append(child_moves)
+            distributions.append(distribution)
+
+            move = best_move
+            if ply < temperature_plies:
+                move = move_to_uci(int(rng.choice(child_moves, p=distribution)))
+            try:
+                state.make_move(move)
+            except Checkmate:
+                result = game_result(state)
+                break
+    finally:
+        # The players' evaluator threads and worker pools would otherwise outlive every game
+        for player in players.values():
+            player.close()
+    return positions, moves, distributions, result
+
+
+def _init_worker(model_path: str | None, input_format: str, board_vocabulary: dict | None,
+                 turn_vocabulary: dict | None, max_length: int):
+    global _worker_model, _worker_encoder
+    if model_path is not None:
+        from transformer.runtime import InferenceModel
+        _worker_model = InferenceModel.load(model_path)
+    if input_format == "compact":
+        _worker_encoder = CompactEncoder()
+    else:
+        _worker_encoder = PositionEncoder(board_vocabulary, turn_vocabulary, max_length)
+
+
+def _play(seed: int, iterations: int, max_plies: int, temperature_plies: int) -> dict[str, np.ndarray]:
+    """ Play a game in a worker process and turn it into shard rows
+
+     :return: The rows of every shard column"""
+    positions, moves, distributions, result = play_game(seed, iterations, max_plies, temperature_plies,
+                                                        _worker_model)
+    policy_moves = np.zeros((len(positions), MAX_CHILDREN), dtype=np.uint16)
+    policy = np.zeros((len(positions), MAX_CHILDREN), dtype=np.float16)
+    for row, (child_moves, distribution) in enumerate(zip(moves, distributions)):
+        policy_moves[row, :len(child_moves)] = child_moves
+        policy[row, :len(distribution)] = distribution
+    return {
+        "features": _worker_encoder.encode_batch(positions).copy(),
+        "labels": np.full(len(positions), LABEL_CLASSES.index(result), dtype=np.int8),
+        "policy_moves": policy_moves,
+        "policy": policy,
+    }
+
+
+def run_self_play(games: int, directory: str, iterations: int = 200, workers: int | None = None,
+                  max_plies: int = 300, temperature_plies: int = 8, model_path: str | None = None,
+                  input_format: str = "compact", preprocessing: dict | None = None, shard_size: int = 16384,
+                  seed: int = 0) -> dict:
+    """ Play games in parallel worker processes and write every ply to compressed shards. The features and labels
+    are in the format ChessTransformer.train_on_shards reads, every row also holds the visit distribution of the
+    root children as policy_moves (moves encoded with Bitboard.encode_move, 0 padded) and policy
+
+     :param games: The number of games
+     :param directory: The directory to write the shards and the manifest to
+     :param iterations: The number of MCTS iterations per move
+     :param workers: The number of worker processes, all the cores if None
+     :param max_plies: The number of plies after which a game is adjudicated a draw
+     :param temperature_plies: The number of opening plies whose move is sampled from the visit distribution
+     :param model_path: The exported model artifact guiding the players, plain rollouts if None
+     :param input_format: "compact", or "tokens" with the tokenizers of preprocessing
+     :param preprocessing: The preprocessing state of the model to train (see ChessTransformer.save_preprocessing),
+     required for the "tokens" format
+     :param shard_size: The number of rows per shard
+     :param seed: The seed of the first game, the following games use the next seeds
+     :return: The manifest"""
+    max_length = BOARD_LENGTH
+    board_vocabulary = turn_vocabulary = None
+    if input_format == "compact":
+        preprocessing = {"input_format": "compact", "max_length": max_length, "board_tokenizer": None,
+                         "turn_tokenizer": None, "label_classes": LABEL_CLASSES}
+    else:
+        if preprocessing is None:
+            raise ValueError("The tokens format needs the preprocessing state of the model")
+        max_length = preprocessing["max_length"]
+        board_vocabulary = tokenizer_vocabulary(preprocessing["board_tokenizer"])
+        turn_vocabulary = tokenizer_vocabulary(preprocessing["turn_tokenizer"])
+        preprocessing = dict(preprocessing, input_format="tokens", label_classes=LABEL_CLASSES)
+    row_length = COMPACT_LENGTH if input_format == "compact" else 2 * max_length
+
+    writer = ShardWriter(directory, row_length, preprocessing, shard_size, compressed=True,
+                         extra_columns={"policy_moves": ((MAX_CHILDREN,), np.uint16),
+                                        "policy": ((MAX_CHILDREN,), np.float16)})
+    play = partial(_play, iterations=iterations, max_plies=max_plies, temperature_plies=temperature_plies)
+    arguments = (model_path, input_format, board_vocabulary, turn_vocabulary, max_length)
+    with Pool(workers, initializer=_init_worker, initargs=arguments) as pool:
+        for rows in pool.imap_unordered(play, range(seed, seed + games)):
+            writer.write(**rows)
+    return writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write training shards from MCTS self-play games")
+    parser.add_argument("directory")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-plies", type=int, default=300)
+    parser.add_argument("--model", default=None, help="An exported model artifact (.npz)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = run_self_play(args.games, args.directory, args.iterations, args.workers, args.max_plies,
+                             model_path=args.model, seed=args.seed)
+    print(f"Wrote {manifest['rows']} positions in {len(manifest['shards'])} shards")
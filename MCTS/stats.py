@@ -0,0 +1,137 @@
+import json
+import sys
+import time
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+PHASES = ("select", "expand", "simulate", "backpropagate", "evaluate")
+
+
+def peak_memory() -> int:
+    """ Returns the peak resident memory of the process
+
+     :return: The peak in bytes, 0 where the platform doesn't report it"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SearchStats:
+    """ The instrumentation of one search: the calls and the time of every phase, the simulations per second, the hit
+    rates of the transposition table and the evaluation cache, how deep the iterations went and how many children
+    the expanded nodes had. The select time includes the evaluate time of the model calls made while selecting """
+
+    def __init__(self, kind: str = "move"):
+        """ Create empty statistics
+
+         :param kind: What the search was for: "move", "search" or "ponder\""""
+        self.kind = kind
+        self.counts = dict.fromkeys(PHASES, 0)
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.iterations = 0
+        self.simulations = 0
+        self.depths = Counter()  # The depth of the node every iteration simulated from
+        self.branching = Counter()  # The number of children of every expanded node
+        self.elapsed = 0.0
+        self.hashtable_probes = 0
+        self.hashtable_hits = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.tree_size = 0
+        self.peak_memory = 0
+        self.move = None
+        self._started = time.perf_counter()
+        self._baseline = (0, 0, 0, 0)
+
+    def start(self, search):
+        """ Start timing and take the counters of the tables the search shares with earlier searches
+
+         :param search: The MCTS instance"""
+        self._started = time.perf_counter()
+        self._baseline = (search.hashtable.probes, search.hashtable.hits, search.eval_cache.hits,
+                          search.eval_cache.misses)
+
+    def finish(self, search, move: str | None = None):
+        """ Stop timing and read the counters and the tree at the end of the search
+
+         :param search: The MCTS instance
+         :param move: The move the search picked"""
+        self.elapsed = time.perf_counter() - self._started
+        probes, hits, cache_hits, cache_misses = self._baseline
+        self.hashtable_probes = search.hashtable.probes - probes
+        self.hashtable_hits = search.hashtable.hits - hits
+        self.cache_hits = search.eval_cache.hits - cache_hits
+        self.cache_misses = search.eval_cache.misses - cache_misses
+        self.tree_size = search.tree.size
+        self.peak_memory = peak_memory()
+        self.move = move
+
+    def add(self, phase: str, seconds: float, calls: int = 1):
+        """ Count calls of a phase and the time they took
+
+         :param phase: One of PHASES
+         :param seconds: The time of the calls
+         :param calls: The number of calls"""
+        self.counts[phase] += calls
+        self.times[phase] += seconds
+
+    @property
+    def nps(self) -> float:
+        """ The simulations per second """
+        return self.simulations / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def hashtable_hit_rate(self) -> float:
+        return self.hashtable_hits / self.hashtable_probes if self.hashtable_probes else 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        """ Returns the statistics as plain values, the histograms map a depth or a number of children to a count
+
+         :return: The statistics"""
+        return {
+            "kind": self.kind,
+            "move": self.move,
+            "elapsed": self.elapsed,
+            "iterations": self.iterations,
+            "simulations": self.simulations,
+            "nps": self.nps,
+            "counts": dict(self.counts),
+            "times": dict(self.times),
+            "hashtable_hit_rate": self.hashtable_hit_rate,
+            "cache_hit_rate": self.cache_hit_rate,
+            "depths": {str(depth): count for depth, count in sorted(self.depths.items())},
+            "branching": {str(children): count for children, count in sorted(self.branching.items())},
+            "tree_size": self.tree_size,
+            "peak_memory": self.peak_memory,
+        }
+
+
+class StatsSink:
+    """ Appends the statistics of every search to a JSON-lines file """
+
+    def __init__(self, path: str):
+        """ Open the file
+
+         :param path: The path of the file, appended to if it exists"""
+        self.file = open(path, "a")
+
+    def write(self, stats: SearchStats):
+        """ Write the statistics of a search as one line
+
+         :param stats: The statistics"""
+        self.file.write(json.dumps(stats.to_dict()) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
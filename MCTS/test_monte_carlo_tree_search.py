@@ -0,0 +1,29 @@
+import numpy as np
+
+from Chess.Board.GameState import GameState
+from Chess.Repository.Bitboard import move_to_uci
+from Chess.Repository.ChessRepository import ChessRepository
+from MCTS.monte_carlo_tree_search import MCTS
+
+ENDGAME_FEN = "8/8/8/4k3/8/8/8/R3K3 w - - 0 1"
+
+
+def game_state(fen: str) -> GameState:
+    repository = ChessRepository()
+    repository.initialize_board(fen)
+    return GameState(repository)
+
+
+def test_short_search_on_an_endgame():
+    # The rollouts go through positions the transposition table holds, they must still reach the end of the game
+    state = game_state(ENDGAME_FEN)
+    search = MCTS(state, iterations=50, seed=0)
+    move = search.select_move(state)
+    assert move in {move_to_uci(legal) for legal in state.board.position.legal_moves()}
+    tree = search.tree
+    assert tree.visits[tree.root] >= 50
+    assert search.hashtable.hits > 0
+    # Every result backed up is on the scale of the game results, between 0 and 1 per visit
+    used = slice(0, tree.size)
+    assert np.all(tree.wins[used] >= 0)
+    assert np.all(tree.wins[used] <= tree.visits[used])
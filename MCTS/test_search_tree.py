@@ -0,0 +1,63 @@
+import numpy as np
+
+from Chess.Repository.Bitboard import uci_to_move
+from MCTS.search_tree import SearchTree
+
+OPENING_MOVES = [uci_to_move(move) for move in ("e2e4", "d2d4", "g1f3")]
+REPLIES = [uci_to_move(move) for move in ("e7e5", "c7c5")]
+
+
+def build_tree(capacity: int = 4096) -> SearchTree:
+    """ A root with three children, each with two children, every node carrying its own statistics """
+    tree = SearchTree(capacity)
+    tree.add_children(tree.root, OPENING_MOVES)
+    for child in tree.children(tree.root):
+        tree.add_children(child, REPLIES)
+    for node in range(tree.size):
+        tree.visits[node] = node + 1
+        tree.key[node] = 1000 + node
+    return tree
+
+
+def subtree(tree: SearchTree, node: int) -> dict:
+    """ The moves, visits and keys of a subtree, independent of where its nodes are stored """
+    return {"visits": int(tree.visits[node]), "key": int(tree.key[node]),
+            "children": {int(tree.move[child]): subtree(tree, child) for child in tree.children(node)}}
+
+
+def test_children_and_find_child():
+    tree = build_tree()
+    assert [int(tree.move[child]) for child in tree.children(tree.root)] == OPENING_MOVES
+    child = tree.find_child(tree.root, OPENING_MOVES[1])
+    assert int(tree.parent[child]) == tree.root
+    assert tree.find_child(child, REPLIES[1]) in tree.children(child)
+    assert tree.find_child(child, OPENING_MOVES[0]) is None
+    assert tree.find_key(1000 + child) == child
+
+
+def test_compact_keeps_only_the_subtree_of_the_root():
+    tree = build_tree()
+    new_root = tree.find_child(tree.root, OPENING_MOVES[1])
+    expected = subtree(tree, new_root)
+    tree.set_root(new_root)
+    tree.compact()
+    assert tree.root == 0
+    assert tree.size == 1 + len(REPLIES)
+    assert int(tree.parent[0]) == -1
+    assert subtree(tree, tree.root) == expected
+    assert np.all(tree.parent[1:tree.size] == 0)
+    # The nodes of the other subtrees can't be found anymore
+    assert tree.find_key(1000 + 1) is None
+
+
+def test_make_room_grows_only_when_compaction_is_not_enough():
+    tree = build_tree(capacity=12)
+    tree.set_root(tree.find_child(tree.root, OPENING_MOVES[0]))
+    expected = subtree(tree, tree.root)
+    # The 10 nodes leave no room for 3 more, dropping the 7 outside the new root's subtree does
+    tree.make_room(3)
+    assert (tree.capacity, tree.size) == (12, 3)
+    assert subtree(tree, tree.root) == expected
+    tree.make_room(64)
+    assert tree.capacity >= tree.size + 64
+    assert subtree(tree, tree.root) == expected
@@ -0,0 +1,15 @@
+MOVES_TO_GO = 30  # The number of moves the clock is spread over when the time control doesn't give it
+MOVE_OVERHEAD = 0.05  # The seconds kept back on every move for picking the move and sending it
+MINIMUM_TIME = 0.01  # The smallest budget of a move, the search always runs at least one iteration
+
+
+def allocate_time(clock: float, increment: float = 0.0, moves_to_go: int | None = None) -> float:
+    """ The time budget of a move under a clock: an even share of the remaining time plus the increment, never more
+    than the clock holds
+
+     :param clock: The seconds left on the clock of the side to move
+     :param increment: The seconds added to the clock after every move
+     :param moves_to_go: The number of moves until the next time control, MOVES_TO_GO if None
+     :return: The seconds to search the move for"""
+    budget = clock / (moves_to_go or MOVES_TO_GO) + increment
+    return max(MINIMUM_TIME, min(budget, clock - MOVE_OVERHEAD) - MOVE_OVERHEAD)
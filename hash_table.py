@@ -1,37 +1,121 @@
-from Chess.Board.GameState import GameState
+import numpy as np
 
+from Chess.Repository.Bitboard import uci_to_move
 
-class HashTable:
-    def __init__(self, size):
-        """ Initialize the hash table
+# One 16 byte entry: the upper half of the Zobrist key to verify hits, the value, the best move encoded with
+# Bitboard.encode_move, the search depth, the visit count and the search generation that wrote the entry
+ENTRY_DTYPE = np.dtype([("verifier", np.uint32), ("value", np.float32), ("visits", np.uint32),
+                        ("move", np.uint16), ("depth", np.uint8), ("generation", np.uint8)])
+BUCKET_SIZE = 2  # Slot 0 is depth-preferred, slot 1 is always replaced
 
-        :param size: The size of the hash table (should be a prime number) """
-        self.size = size
-        self.table = [None] * size
 
-    def hash(self, state: GameState) -> int:
-        """ Create a unique hash value for the current state
+class TranspositionTable:
+    def __init__(self, size_mb: float = 64):
+        """ Initialize a fixed-memory transposition table. Entries live in a NumPy structured array of buckets, so
+        millions of positions cost no Python objects
 
-         :param state: The current state
-         :return: The hash value"""
-        return hash(str(state)) % self.size
+        :param size_mb: The memory budget of the table in megabytes """
+        entries = int(size_mb * 1024 * 1024) // ENTRY_DTYPE.itemsize
+        # Round the number of buckets down to a power of two so the index is a simple mask of the key
+        buckets = 1 << max(0, (entries // BUCKET_SIZE).bit_length() - 1)
+        self.mask = buckets - 1
+        self.table = np.zeros((buckets, BUCKET_SIZE), dtype=ENTRY_DTYPE)
+        self.generation = 1  # Generation 0 marks an empty slot
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0  # Stores that pushed another position out of the table
 
-    def lookup(self, state: GameState):
-        """ Look up the value and best move for the current state in the hash table
+    @property
+    def size(self) -> int:
+        """ The number of entries the table can hold """
+        return self.table.size
 
-         :param state: The current state
-         :return: The value and best move for the current state"""
-        h = self.hash(state)
-        if self.table[h]:
-            return self.table[h]
-        return None
+    def new_search(self):
+        """ Start a new search generation, entries from older generations are the first to be replaced """
+        self.generation = self.generation % 255 + 1
 
-    def store(self, state: GameState, value: int | float, move):
-        """ Store the value and best move for the current state in the hash table
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        self.table.fill(0)
+        self.generation = 1
+        self.probes = self.hits = self.stores = self.overwrites = 0
 
-         :param state: The current state
+    def _find(self, key: int):
+        """ Find the bucket and slot holding a key
+
+         :param key: The Zobrist key of the state
+         :return: A tuple of the form (bucket, slot), slot is None if the key isn't stored"""
+        bucket = self.table[key & self.mask]
+        verifier = key >> 32
+        for slot in range(BUCKET_SIZE):
+            if bucket[slot]["generation"] and bucket[slot]["verifier"] == verifier:
+                return bucket, slot
+        return bucket, None
+
+    def lookup(self, key: int):
+        """ Look up the value and best move for the state with the given key
+
+         :param key: The Zobrist key of the state (GameState.get_key())
+         :return: The value and best move (encoded, None if unknown) for the state, or None if the state isn't stored"""
+        self.probes += 1
+        bucket, slot = self._find(key)
+        if slot is None:
+            return None
+        self.hits += 1
+        entry = bucket[slot]
+        return float(entry["value"]), int(entry["move"]) or None
+
+    def lookup_entry(self, key: int) -> dict | None:
+        """ Look up every field stored for the state with the given key
+
+         :param key: The Zobrist key of the state
+         :return: A dictionary with the value, move, depth and visits of the entry, or None if it isn't stored"""
+        bucket, slot = self._find(key)
+        if slot is None:
+            return None
+        entry = bucket[slot]
+        return {"value": float(entry["value"]), "move": int(entry["move"]) or None, "depth": int(entry["depth"]),
+                "visits": int(entry["visits"])}
+
+    def store(self, key: int, value: int | float, move=None, depth: int = 0, visits: int = 0):
+        """ Store the value and best move for the state with the given key. A deeper (or same depth) result, or any
+        result from a newer search, goes to the depth-preferred slot, anything else goes to the always-replace slot
+
+         :param key: The Zobrist key of the state
          :param value: The value of the current state
-         :param move: The best move for the current state"""
+         :param move: The best move for the current state, as a move string or an encoded move
+         :param depth: The depth the value was searched to
+         :param visits: The number of visits behind the value"""
+        if isinstance(move, str):
+            move = uci_to_move(move)
+        bucket, slot = self._find(key)
+        preferred = bucket[0]
+        replace_preferred = preferred["generation"] != self.generation or depth >= preferred["depth"]
+        if slot is None:
+            if bucket[1]["generation"] and (not replace_preferred or preferred["generation"]):
+                self.overwrites += 1
+            if replace_preferred:
+                # The entry losing the depth-preferred slot moves down to the always-replace slot
+                bucket[1] = preferred
+                slot = 0
+            else:
+                slot = 1
+        elif slot == 1 and replace_preferred:
+            # The position earned its place in the depth-preferred slot, swap it with the entry there
+            bucket[1] = preferred
+            slot = 0
+        self.stores += 1
+        bucket[slot] = (key >> 32, value, min(visits, 0xFFFFFFFF), move or 0, min(depth, 255), self.generation)
+
+    def hit_rate(self) -> float:
+        """ Returns the share of lookups that found their state
+
+         :return: The hit rate between 0 and 1"""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def hashfull(self) -> float:
+        """ Returns the share of slots written during the current search generation
 
-        h = self.hash(state)
-        self.table[h] = (value, move)
+         :return: The occupancy between 0 and 1"""
+        return float(np.count_nonzero(self.table["generation"] == self.generation)) / self.size
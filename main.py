@@ -1,29 +1,28 @@
-from transformer.transformer import PositionalEncoding
-from transformer.transformer import TransformerBlock
-from transformer.transformer import ChessTransformer
-from MCTS.monte_carlo_tree_search import MCTS
+import os
+
 from Chess.Board.GameState import GameState
 from Chess.Repository.ChessRepository import ChessRepository
 from Chess.UI.console import UI
-from tensorflow.keras.preprocessing.text import Tokenizer
-from sklearn.preprocessing import LabelEncoder
-from transformer.transformer import load_and_preprocess_data
+from transformer.runtime import InferenceModel
+
+# Written by ChessTransformer.export, see transformer/transformer.py
+MODEL_ARTIFACT = "transformer/TrainedModels/transformer.npz"
+# Written by ChessTransformer.save, with its preprocessing state next to it
+MODEL_PATH = "transformer/TrainedModels/transformer.h5"
 
 
 if __name__ == "__main__":
-    
+
     chess_repository = ChessRepository()
     chess_repository.initialize_board()
     game_state = GameState(chess_repository)
 
+    # The engine only needs the exported weights and vocabulary, not TensorFlow or the training data
+    if os.path.exists(MODEL_ARTIFACT):
+        model = InferenceModel.load(MODEL_ARTIFACT)
+    else:
+        from transformer.transformer import ChessTransformer
+        model = ChessTransformer.from_saved(MODEL_PATH)
 
-    features, labels, board_tokenizer, turn_tokenizer, le = load_and_preprocess_data()
-    model = ChessTransformer(board_tokenizer, turn_tokenizer, le) 
-
-    
-    model.load("transformer/TrainedModels/transformer.h5")
-    
     ui = UI(game_state, model)
     ui.start()
-    
-    
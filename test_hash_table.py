@@ -0,0 +1,64 @@
+from Chess.Repository.Bitboard import uci_to_move
+from hash_table import TranspositionTable
+
+
+def colliding_keys(count: int) -> list[int]:
+    """ Keys of different positions that all fall in the first bucket of any table """
+    return [(index + 1) << 32 for index in range(count)]
+
+
+def test_lookup_returns_what_was_stored():
+    table = TranspositionTable(1)
+    assert table.lookup(12345) is None
+    table.store(12345, 0.75, "e2e4", depth=3, visits=40)
+    assert table.lookup(12345) == (0.75, uci_to_move("e2e4"))
+    assert table.lookup_entry(12345) == {"value": 0.75, "move": uci_to_move("e2e4"), "depth": 3, "visits": 40}
+    assert (table.probes, table.hits) == (2, 1)
+    assert table.hit_rate() == 0.5
+
+
+def test_store_without_a_move():
+    table = TranspositionTable(1)
+    table.store(7, 0.5)
+    assert table.lookup(7) == (0.5, None)
+
+
+def test_store_overwrites_the_same_position():
+    table = TranspositionTable(1)
+    table.store(99, 0.25, depth=2)
+    table.store(99, 0.5, depth=1)
+    assert table.lookup(99)[0] == 0.5
+    assert table.overwrites == 0
+
+
+def test_depth_preferred_replacement():
+    table = TranspositionTable(1)
+    deep, shallow, newer = colliding_keys(3)
+    table.store(deep, 0.1, depth=10)
+    table.store(shallow, 0.2, depth=1)
+    # The shallow entry only takes the always-replace slot, a third position pushes it out
+    table.store(newer, 0.3, depth=2)
+    assert table.lookup(deep) is not None
+    assert table.lookup(shallow) is None
+    assert table.lookup(newer) is not None
+    assert table.overwrites == 1
+
+
+def test_entries_of_an_older_search_are_replaced_first():
+    table = TranspositionTable(1)
+    old, new = colliding_keys(2)
+    table.store(old, 0.1, depth=10)
+    table.new_search()
+    table.store(new, 0.2, depth=1)
+    assert table.lookup_entry(new)["depth"] == 1
+    assert table.table[0][0]["verifier"] == new >> 32
+
+
+def test_clear_and_hashfull():
+    table = TranspositionTable(1)
+    for key in range(1, 101):
+        table.store(key, 0.5)
+    assert table.hashfull() == 100 / table.size
+    table.clear()
+    assert table.hashfull() == 0
+    assert table.lookup(1) is None
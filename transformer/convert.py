@@ -0,0 +1,32 @@
+import argparse
+
+from sklearn.preprocessing import LabelEncoder
+import numpy as np
+
+from transformer.pipeline import fit_preprocessing
+from transformer.transformer import ChessTransformer, preprocessing_path
+
+DATASET = "transformer/Resources/training_dataset.json"
+
+
+def write_preprocessing(model_path: str, dataset: str = DATASET) -> str:
+    """ Write the preprocessing state of a model saved without one, by fitting the tokenizers and the label encoder
+    on the dataset it was trained on, the way load_and_preprocess_data does
+
+     :param model_path: The path of the Keras model file
+     :param dataset: The path of the training dataset
+     :return: The path of the preprocessing file written next to the model"""
+    board_tokenizer, turn_tokenizer, classes = fit_preprocessing(dataset)
+    le = LabelEncoder()
+    le.classes_ = np.array(classes)
+    path = preprocessing_path(model_path)
+    ChessTransformer(board_tokenizer, turn_tokenizer, le).save_preprocessing(path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the preprocessing state of a saved model from its dataset")
+    parser.add_argument("model", help="The Keras model file (.h5)")
+    parser.add_argument("--dataset", default=DATASET, help="The dataset the model was trained on")
+    args = parser.parse_args()
+    print(f"Wrote {write_preprocessing(args.model, args.dataset)}")
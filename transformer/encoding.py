@@ -0,0 +1,220 @@
+import re
+
+import numpy as np
+
+from Chess.Repository.Bitboard import Bitboard, PIECE_SYMBOLS, WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, \
+    BLACK_QUEENSIDE
+
+BOARD_LENGTH = 512  # The board and the turn are each padded to this many tokens
+INPUT_LENGTH = 2 * BOARD_LENGTH
+SHIFTS = np.arange(64, dtype=np.uint64)
+# The squares in the order FEN lists them: rank 8 to rank 1, file a to file h
+FEN_ORDER = np.array([row * 8 + col for row in range(7, -1, -1) for col in range(8)])
+
+# The compact input: one token per square from a1 to h8, then the side to move, the four castling rights, the en
+# passant file and the half move clock in buckets of ten
+EMPTY_SQUARE = 0  # Pieces are 1 to 12, in the order of PIECE_SYMBOLS
+WHITE_TO_MOVE, BLACK_TO_MOVE = 13, 14
+CASTLING_FLAGS = (WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE)
+CASTLING_TOKENS = np.array([15, 16, 17, 18])  # The token of each right when it is held
+NO_CASTLING = 19
+NO_EN_PASSANT = 20  # The en passant files a to h are 21 to 28
+HALF_MOVE_TOKENS = 29  # The half move buckets are 29 to 38
+COMPACT_LENGTH = 64 + 1 + 4 + 1 + 1
+COMPACT_VOCABULARY = 39
+
+
+class PositionEncoder:
+    """ Writes positions straight into the model's input layout. The layout is the one produced at training time by
+    the character-level Keras tokenizers: the tokens of the lowercased FEN string, padded at the front to 512, then
+    the token of the side to move, padded at the front to 512. Characters missing from the vocabulary are skipped like
+    texts_to_sequences skips them. Boards are encoded from their bitboards, so no FEN string is built for the piece
+    placement, and a whole batch is encoded with a handful of NumPy operations into one preallocated int8 buffer. """
+
+    def __init__(self, board_vocabulary: dict[str, int], turn_vocabulary: dict[str, int],
+                 board_length: int = BOARD_LENGTH):
+        """ Build the lookup tables of the encoder
+
+         :param board_vocabulary: The word index of the board tokenizer, character to token
+         :param turn_vocabulary: The word index of the turn tokenizer, character to token
+         :param board_length: The length the board and the turn are each padded to"""
+        if max(board_vocabulary.values(), default=0) > 127 or max(turn_vocabulary.values(), default=0) > 127:
+            raise ValueError("The vocabulary doesn't fit int8 tokens")
+        self.board_vocabulary = board_vocabulary
+        self.turn_vocabulary = turn_vocabulary
+        self.board_length = board_length
+        # The token of every byte, 0 for the characters outside the vocabulary
+        self.board_table = np.zeros(256, dtype=np.int8)
+        self.turn_table = np.zeros(256, dtype=np.int8)
+        for table, vocabulary in ((self.board_table, board_vocabulary), (self.turn_table, turn_vocabulary)):
+            for byte in range(256):
+                table[byte] = vocabulary.get(chr(byte).lower(), 0)
+        self.piece_tokens = self.board_table[[ord(symbol) for symbol in PIECE_SYMBOLS]]
+        self.digit_tokens = self.board_table[[ord(str(digit)) for digit in range(9)]]
+        self.slash_token = self.board_table[ord("/")]
+        self.buffer = np.zeros((0, 2 * board_length), dtype=np.int8)
+
+    def _rows(self, count: int) -> np.ndarray:
+        """ Returns count cleared rows of the preallocated buffer, growing it if needed
+
+         :param count: The number of rows
+         :return: A view of the buffer"""
+        if len(self.buffer) < count:
+            self.buffer = np.zeros((max(count, 2 * len(self.buffer)), 2 * self.board_length), dtype=np.int8)
+        rows = self.buffer[:count]
+        rows.fill(0)
+        return rows
+
+    def _place(self, out: np.ndarray, tokens: np.ndarray, keep: np.ndarray):
+        """ Write the kept tokens of every row right-aligned into the board half of the rows, keeping the last
+        board_length tokens of longer rows like pad_sequences does
+
+         :param out: The output rows
+         :param tokens: A (rows, columns) array of candidate tokens
+         :param keep: A (rows, columns) mask of the tokens that are written"""
+        keep = keep & (tokens != 0)
+        counts = keep.sum(axis=1)
+        columns = self.board_length - counts[:, None] + np.cumsum(keep, axis=1) - 1
+        keep &= columns >= 0
+        rows = np.broadcast_to(np.arange(len(out))[:, None], keep.shape)
+        out[rows[keep], columns[keep]] = tokens[keep]
+
+    def encode_batch(self, positions: list[Bitboard], out: np.ndarray | None = None) -> np.ndarray:
+        """ Encode several positions at once
+
+         :param positions: The positions
+         :param out: The (len(positions), 1024) int8 array to write to, a view of the encoder's buffer if None
+         :return: The encoded rows"""
+        count = len(positions)
+        if out is None:
+            out = self._rows(count)
+        else:
+            out.fill(0)
+        if count == 0:
+            return out
+
+        # The piece on every square, in FEN order and grouped by rank
+        pieces = np.array([position.pieces for position in positions], dtype=np.uint64)
+        bits = ((pieces[:, :, None] >> SHIFTS) & np.uint64(1)).astype(bool)[:, :, FEN_ORDER]
+        occupied = bits.any(axis=1).reshape(count, 8, 8)
+        piece_tokens = np.tensordot(bits, self.piece_tokens.astype(np.int16), axes=([1], [0])).reshape(count, 8, 8)
+
+        # Empty squares are written as the length of their run, on the first square of the run
+        runs = np.zeros((count, 8, 9), dtype=np.int8)
+        for col in range(7, -1, -1):
+            runs[:, :, col] = np.where(occupied[:, :, col], 0, runs[:, :, col + 1] + 1)
+        previous_occupied = np.concatenate([np.ones((count, 8, 1), dtype=bool), occupied[:, :, :-1]], axis=2)
+        tokens = np.where(occupied, piece_tokens, self.digit_tokens[runs[:, :, :8]]).astype(np.int8)
+        keep = occupied | previous_occupied
+
+        # A slash closes every rank but the last one
+        tokens = np.concatenate([tokens, np.full((count, 8, 1), self.slash_token, dtype=np.int8)], axis=2)
+        keep = np.concatenate([keep, np.ones((count, 8, 1), dtype=bool)], axis=2)
+        keep[:, 7, 8] = False
+
+        # The few characters of the state fields are looked up from their bytes
+        states = [np.frombuffer((" " + position.fen_state()).encode(), dtype=np.uint8) for position in positions]
+        state_tokens = np.zeros((count, max(len(state) for state in states)), dtype=np.int8)
+        state_keep = np.zeros(state_tokens.shape, dtype=bool)
+        for row, state in enumerate(states):
+            state_tokens[row, :len(state)] = self.board_table[state]
+            state_keep[row, :len(state)] = True
+
+        self._place(out, np.concatenate([tokens.reshape(count, 72), state_tokens], axis=1),
+                    np.concatenate([keep.reshape(count, 72), state_keep], axis=1))
+        out[:, -1] = self.turn_table[[ord(position.turn) for position in positions]]
+        return out
+
+    def encode(self, position: Bitboard, out: np.ndarray | None = None) -> np.ndarray:
+        """ Encode one position
+
+         :param position: The position
+         :param out: The (1024,) int8 array to write to, a view of the encoder's buffer if None
+         :return: The encoded row"""
+        return self.encode_batch([position], None if out is None else out[None, :])[0]
+
+    def encode_fens(self, fens: list[str], out: np.ndarray | None = None,
+                    turns: list[str] | None = None) -> np.ndarray:
+        """ Encode several FEN strings, giving the same rows as encode_batch for the same positions
+
+         :param fens: The FEN strings
+         :param out: The (len(fens), 1024) int8 array to write to, a view of the encoder's buffer if None
+         :param turns: The texts of the turn half, like the 'turn' field of the training games, the side to move of
+         the FEN if None
+         :return: The encoded rows"""
+        if out is None:
+            out = self._rows(len(fens))
+        else:
+            out.fill(0)
+        for row, fen in enumerate(fens):
+            match = re.match(r"^(.*?)\s([wb])\s", fen)
+            if match is None:
+                raise ValueError("Invalid FEN string")
+            tokens = self.board_table[np.frombuffer(fen.encode(), dtype=np.uint8)]
+            tokens = tokens[tokens != 0][-self.board_length:]
+            out[row, self.board_length - len(tokens):self.board_length] = tokens
+            if turns is None:
+                out[row, -1] = self.turn_table[ord(match.group(2))]
+            else:
+                tokens = self.turn_table[np.frombuffer(turns[row].encode(), dtype=np.uint8)]
+                tokens = tokens[tokens != 0][-self.board_length:]
+                out[row, out.shape[1] - len(tokens):] = tokens
+        return out
+
+
+class CompactEncoder:
+    """ Writes positions in the compact input layout: 71 tokens that keep every piece's colour, the castling rights
+    and the en passant file, instead of 1024 mostly padding tokens. The layout has a fixed vocabulary, so unlike
+    PositionEncoder it needs no tokenizer. """
+
+    def __init__(self):
+        self.buffer = np.zeros((0, COMPACT_LENGTH), dtype=np.int8)
+
+    def encode_batch(self, positions: list[Bitboard], out: np.ndarray | None = None) -> np.ndarray:
+        """ Encode several positions at once
+
+         :param positions: The positions
+         :param out: The (len(positions), 71) int8 array to write to, a view of the encoder's buffer if None
+         :return: The encoded rows"""
+        count = len(positions)
+        if out is None:
+            if len(self.buffer) < count:
+                self.buffer = np.zeros((max(count, 2 * len(self.buffer)), COMPACT_LENGTH), dtype=np.int8)
+            out = self.buffer[:count]
+        if count == 0:
+            return out
+
+        pieces = np.array([position.pieces for position in positions], dtype=np.uint64)
+        bits = ((pieces[:, :, None] >> SHIFTS) & np.uint64(1)).astype(bool)
+        out[:, :64] = np.where(bits.any(axis=1), bits.argmax(axis=1) + 1, EMPTY_SQUARE)
+
+        turns = np.array([position.turn == "w" for position in positions])
+        out[:, 64] = np.where(turns, WHITE_TO_MOVE, BLACK_TO_MOVE)
+        castling = np.array([position.castling for position in positions])
+        held = (castling[:, None] & np.array(CASTLING_FLAGS)) != 0
+        out[:, 65:69] = np.where(held, CASTLING_TOKENS, NO_CASTLING)
+        out[:, 69] = [NO_EN_PASSANT if position.en_passant is None else NO_EN_PASSANT + 1 + position.en_passant % 8
+                      for position in positions]
+        out[:, 70] = [HALF_MOVE_TOKENS + min(position.half_moves, 99) // 10 for position in positions]
+        return out
+
+    def encode(self, position: Bitboard, out: np.ndarray | None = None) -> np.ndarray:
+        """ Encode one position
+
+         :param position: The position
+         :param out: The (71,) int8 array to write to, a view of the encoder's buffer if None
+         :return: The encoded row"""
+        return self.encode_batch([position], None if out is None else out[None, :])[0]
+
+    def encode_fens(self, fens: list[str], out: np.ndarray | None = None) -> np.ndarray:
+        """ Encode several FEN strings
+
+         :param fens: The FEN strings
+         :param out: The (len(fens), 71) int8 array to write to, a view of the encoder's buffer if None
+         :return: The encoded rows"""
+        positions = []
+        for fen in fens:
+            position = Bitboard()
+            position.set_fen(fen)
+            positions.append(position)
+        return self.encode_batch(positions, out)
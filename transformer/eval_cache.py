@@ -0,0 +1,85 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# The bookkeeping of one entry besides the stored array: the key and the linked list node of the OrderedDict
+ENTRY_OVERHEAD = 128
+
+
+class EvaluationCache:
+    """ Least recently used cache of model predictions keyed by the Zobrist key of the position. It sits between the
+    search and the model so a position is evaluated once, however many times the search reaches it, and it outlives
+    the search of one move so the positions of the previous search are not evaluated again. The searches of several
+    threads can share one cache. """
+
+    def __init__(self, max_entries: int | None = 100_000, max_bytes: int | None = None):
+        """ Create an empty cache, bounded by the number of entries, their memory or both
+
+         :param max_entries: The largest number of positions to keep, None for no limit
+         :param max_bytes: The largest number of bytes the entries may use, None for no limit"""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_size(value: np.ndarray) -> int:
+        return sys.getsizeof(value) + ENTRY_OVERHEAD
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: int):
+        return key in self.entries
+
+    def get(self, key: int) -> np.ndarray | None:
+        """ Look up the prediction for a position and mark it as recently used
+
+         :param key: The Zobrist key of the position
+         :return: The stored prediction, or None if the position isn't cached"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: int, value: np.ndarray):
+        """ Store the prediction for a position, evicting the least recently used ones to stay within the bounds
+
+         :param key: The Zobrist key of the position
+         :param value: The prediction"""
+        value = np.asarray(value)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= self._entry_size(previous)
+            self.entries[key] = value
+            self.nbytes += self._entry_size(value)
+            while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                                    or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= self._entry_size(evicted)
+                self.evictions += 1
+
+    def hit_rate(self) -> float:
+        """ Returns the share of lookups that found their position
+
+         :return: The hit rate between 0 and 1"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
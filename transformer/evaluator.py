@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchEvaluator:
+    """ Evaluation service between the search and the ChessTransformer. Positions submitted by any number of searches
+    are queued, a worker thread runs them through the model in batches of at most max_batch_size, waiting at most
+    max_wait seconds for a batch to fill, and hands every result back through the Future of the waiting leaf. One model
+    call per batch instead of one per position removes the framework dispatch overhead from all but the first row. """
+
+    def __init__(self, model, max_batch_size: int = 16, max_wait: float = 0.002):
+        """ Create the evaluator, the worker thread starts with the first submitted position
+
+         :param model: The model to evaluate with, it needs a predict_batch(positions) method
+         :param max_batch_size: The largest number of positions sent to the model at once
+         :param max_wait: The longest time in seconds the first queued position waits for the batch to fill"""
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.closed = False
+        self.flushing = False  # Set when a caller has queued everything it is going to wait for
+        self.batches = 0
+        self.positions = 0
+
+    def submit(self, position) -> Future:
+        """ Queue a position for evaluation
+
+         :param position: The position, as a FEN string or a Bitboard the caller won't change
+         :return: A Future that resolves to the probabilities predicted for the position"""
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The evaluator is closed")
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="BatchEvaluator", daemon=True)
+                self.worker.start()
+            self.queue.append((position, future))
+            # Wake the worker for the first position of a batch and again once the batch is full
+            if len(self.queue) == 1 or len(self.queue) >= self.max_batch_size:
+                self.condition.notify()
+        return future
+
+    def evaluate(self, position) -> np.ndarray:
+        """ Evaluate one position, waiting for the batch it joins
+
+         :param position: The position, as a FEN string or a Bitboard
+         :return: The probabilities predicted for the position"""
+        return self.submit(position).result()
+
+    def evaluate_many(self, positions: list) -> np.ndarray:
+        """ Evaluate several positions, they are queued together so they share batches
+
+         :param positions: The positions, as FEN strings or Bitboards
+         :return: A (len(positions), 3) array of probabilities"""
+        futures = [self.submit(position) for position in positions]
+        if not futures:
+            return np.zeros((0, 3), dtype=np.float32)
+        self.flush()
+        return np.stack([future.result() for future in futures])
+
+    def flush(self):
+        """ Send the queued positions to the model without waiting for the batch to fill """
+        with self.condition:
+            self.flushing = True
+            self.condition.notify()
+
+    def _next_batch(self) -> list | None:
+        """ Wait for queued positions and take up to max_batch_size of them
+
+         :return: The (position, future) pairs of the batch, or None once the evaluator is closed and drained"""
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            # Give other searches a chance to fill the batch, but never hold the first position past max_wait
+            deadline = time.monotonic() + self.max_wait
+            while len(self.queue) < self.max_batch_size and not self.closed and not self.flushing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self.flushing = False
+            count = min(len(self.queue), self.max_batch_size)
+            return [self.queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        """ The worker loop: evaluate batches until the evaluator is closed """
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Skip positions whose search gave up on them
+            batch = [(position, future) for position, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                probabilities = self.model.predict_batch([position for position, _ in batch])
+            except Exception as exception:
+                for _, future in batch:
+                    future.set_exception(exception)
+                continue
+            self.batches += 1
+            self.positions += len(batch)
+            for (_, future), result in zip(batch, probabilities):
+                future.set_result(result)
+
+    def average_batch_size(self) -> float:
+        """ Returns the mean number of positions per model call
+
+         :return: The average batch size"""
+        return self.positions / self.batches if self.batches else 0.0
+
+    def close(self):
+        """ Evaluate what is still queued, then stop the worker thread """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.worker is not None:
+            self.worker.join()
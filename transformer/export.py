@@ -0,0 +1,16 @@
+import argparse
+
+from transformer.transformer import ChessTransformer
+
+MODEL_PATH = "transformer/TrainedModels/transformer.h5"
+ARTIFACT_PATH = "transformer/TrainedModels/transformer.npz"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a saved model to the inference artifact the engine loads")
+    parser.add_argument("model", nargs="?", default=MODEL_PATH, help="The Keras model file (.h5), with its "
+                        "preprocessing state next to it")
+    parser.add_argument("artifact", nargs="?", default=ARTIFACT_PATH, help="The artifact to write (.npz)")
+    args = parser.parse_args()
+    ChessTransformer.from_saved(args.model).export(args.artifact)
+    print(f"Wrote {args.artifact}")
@@ -0,0 +1,265 @@
+import json
+import os
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+from transformer.encoding import BOARD_LENGTH, COMPACT_LENGTH, CompactEncoder, PositionEncoder
+
+MANIFEST = "manifest.json"
+READ_SIZE = 1 << 20  # The number of characters read from the dataset at a time
+
+# The encoder of a worker process, set up once by _init_worker
+_worker_encoder = None
+_worker_classes = None
+
+
+def read_games(path: str):
+    """ Stream the games of a dataset without loading the file: either a JSON document of the form
+    {"games": [...]} like training_dataset.json, or a JSON-lines file with one game per line
+
+     :param path: The path of the dataset
+     :return: A generator of game dictionaries with "board", "turn" and "result" keys"""
+    with open(path) as file:
+        if path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = file.read(READ_SIZE)
+        # Skip to the opening bracket of the games array
+        while "[" not in buffer:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise ValueError("No games array in the dataset")
+            buffer += chunk
+        position = buffer.index("[") + 1
+        while True:
+            # Skip the separators between games
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer):
+                    break
+                buffer, position = file.read(READ_SIZE), 0
+                if not buffer:
+                    raise ValueError("The games array isn't closed")
+            if buffer[position] == "]":
+                return
+            try:
+                game, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The game is cut by the end of the buffer, read more
+                chunk = file.read(READ_SIZE)
+                if not chunk:
+                    raise
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield game
+            position = end
+
+
+def read_chunks(path: str, chunk_size: int):
+    """ Group the streamed games of a dataset in chunks
+
+     :param path: The path of the dataset
+     :param chunk_size: The number of games per chunk
+     :return: A generator of lists of games"""
+    games = read_games(path)
+    while True:
+        chunk = list(islice(games, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fit_preprocessing(path: str, chunk_size: int = 8192):
+    """ Fit the tokenizers and collect the result labels in one streaming pass over the dataset. Keras tokenizers
+    count characters incrementally, so the vocabulary is the one fit_on_texts gives on the whole dataset
+
+     :param path: The path of the dataset
+     :param chunk_size: The number of games read at a time
+     :return: The board tokenizer, the turn tokenizer and the sorted label classes"""
+    from tensorflow.keras.preprocessing.text import Tokenizer
+
+    board_tokenizer = Tokenizer(char_level=True)
+    turn_tokenizer = Tokenizer(char_level=True)
+    classes = set()
+    for chunk in read_chunks(path, chunk_size):
+        board_tokenizer.fit_on_texts([game["board"] for game in chunk])
+        turn_tokenizer.fit_on_texts([game["turn"] for game in chunk])
+        classes.update(str(game["result"]) for game in chunk)
+    return board_tokenizer, turn_tokenizer, sorted(classes)
+
+
+def _init_worker(input_format: str, board_vocabulary: dict, turn_vocabulary: dict, max_length: int, classes: list):
+    global _worker_encoder, _worker_classes
+    if input_format == "compact":
+        _worker_encoder = CompactEncoder()
+    else:
+        _worker_encoder = PositionEncoder(board_vocabulary, turn_vocabulary, max_length)
+    _worker_classes = np.array(classes)
+
+
+def _encode_chunk(chunk: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """ Encode a chunk of games in a worker process, like load_and_preprocess_data does
+
+     :param chunk: The games
+     :return: The features and the labels of the chunk"""
+    fens = [game["board"] for game in chunk]
+    if isinstance(_worker_encoder, CompactEncoder):
+        features = _worker_encoder.encode_fens(fens)
+    else:
+        features = _worker_encoder.encode_fens(fens, turns=[game["turn"] for game in chunk])
+    labels = np.searchsorted(_worker_classes, [str(game["result"]) for game in chunk]).astype(np.int8)
+    return features.copy(), labels
+
+
+class ShardWriter:
+    """ Collects encoded rows and writes them to fixed-size shards, every shard but the last holds exactly
+    shard_size rows. The manifest written by close() lists the shards and carries the preprocessing state, so
+    ChessTransformer.load_preprocessing reads it directly """
+
+    def __init__(self, directory: str, row_length: int, preprocessing: dict, shard_size: int = 65536,
+                 extra_columns: dict[str, tuple] | None = None, compressed: bool = False):
+        """ Create the writer
+
+         :param directory: The directory of the shards, created if needed
+         :param row_length: The number of features per row
+         :param preprocessing: The preprocessing state stored in the manifest
+         :param shard_size: The number of rows per shard
+         :param extra_columns: Other arrays stored with every row, name to (shape of one row, dtype)
+         :param compressed: Whether to write every shard as one compressed .npz instead of one .npy per column"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.preprocessing = preprocessing
+        self.shard_size = shard_size
+        self.compressed = compressed
+        self.columns = {"features": ((row_length,), np.int8), "labels": ((), np.int8)}
+        self.columns.update(extra_columns or {})
+        self.buffers = {name: np.zeros((shard_size,) + shape, dtype=dtype)
+                        for name, (shape, dtype) in self.columns.items()}
+        self.filled = 0
+        self.shards = []
+        self.rows = 0
+
+    def write(self, **arrays: np.ndarray):
+        """ Append rows, one array per column with the same number of rows
+
+         :param arrays: The rows of every column"""
+        count = len(arrays["features"])
+        start = 0
+        while start < count:
+            taken = min(count - start, self.shard_size - self.filled)
+            for name in self.columns:
+                self.buffers[name][self.filled:self.filled + taken] = arrays[name][start:start + taken]
+            self.filled += taken
+            start += taken
+            if self.filled == self.shard_size:
+                self._flush()
+
+    def _flush(self):
+        if self.filled == 0:
+            return
+        index = len(self.shards)
+        shard = {"rows": self.filled}
+        if self.compressed:
+            shard["file"] = f"shard-{index:05d}.npz"
+            np.savez_compressed(os.path.join(self.directory, shard["file"]),
+                                **{name: self.buffers[name][:self.filled] for name in self.columns})
+        else:
+            for name in self.columns:
+                file_name = f"shard-{index:05d}.{name}.npy"
+                np.save(os.path.join(self.directory, file_name), self.buffers[name][:self.filled])
+                shard[name] = file_name
+        self.shards.append(shard)
+        self.rows += self.filled
+        self.filled = 0
+
+    def close(self) -> dict:
+        """ Write the last shard and the manifest
+
+         :return: The manifest"""
+        self._flush()
+        manifest = dict(self.preprocessing, shards=self.shards, rows=self.rows)
+        with open(os.path.join(self.directory, MANIFEST), "w") as file:
+            json.dump(manifest, file)
+        return manifest
+
+
+def build_shards(path: str, directory: str, input_format: str = "tokens", shard_size: int = 65536,
+                 chunk_size: int = 8192, workers: int | None = None, max_length: int = BOARD_LENGTH) -> dict:
+    """ Preprocess a dataset of any size into shards: one streaming pass fits the tokenizers, a second one sends
+    chunks of games to a pool of worker processes and writes their encoded rows in order
+
+     :param path: The path of the dataset, see read_games
+     :param directory: The directory to write the shards and the manifest to
+     :param input_format: "tokens" or "compact", like load_and_preprocess_data
+     :param shard_size: The number of rows per shard
+     :param chunk_size: The number of games sent to a worker at a time
+     :param workers: The number of worker processes, all the cores if None
+     :param max_length: The length the board and the turn are each padded to
+     :return: The manifest"""
+    board_tokenizer, turn_tokenizer, classes = fit_preprocessing(path, chunk_size)
+    preprocessing = {
+        "input_format": input_format,
+        "max_length": max_length,
+        "board_tokenizer": board_tokenizer.to_json(),
+        "turn_tokenizer": turn_tokenizer.to_json(),
+        "label_classes": classes,
+    }
+    row_length = COMPACT_LENGTH if input_format == "compact" else 2 * max_length
+    writer = ShardWriter(directory, row_length, preprocessing, shard_size)
+    arguments = (input_format, board_tokenizer.word_index, turn_tokenizer.word_index, max_length, classes)
+    with Pool(workers, initializer=_init_worker, initargs=arguments) as pool:
+        for features, labels in pool.imap(_encode_chunk, read_chunks(path, chunk_size)):
+            writer.write(features=features, labels=labels)
+    return writer.close()
+
+
+def load_shard(directory: str, shard: dict, columns: tuple[str, ...]) -> list[np.ndarray]:
+    """ Open columns of a shard, .npy columns are memory-mapped and compressed shards are read whole
+
+     :param directory: The directory of the shards
+     :param shard: The entry of the shard in the manifest
+     :param columns: The names of the columns
+     :return: One array per column"""
+    if "file" in shard:
+        with np.load(os.path.join(directory, shard["file"])) as arrays:
+            return [arrays[name] for name in columns]
+    return [np.load(os.path.join(directory, shard[name]), mmap_mode="r") for name in columns]
+
+
+def shard_dataset(directory: str, batch_size: int = 64, shuffle: bool = True, seed: int | None = None):
+    """ Feed the shards of a directory to training. Shards are read one at a time in a generator, so the dataset never
+    has to fit in memory, and batches are prefetched while the model trains
+
+     :param directory: The directory written by build_shards or the self-play runner
+     :param batch_size: The number of rows per batch
+     :param shuffle: Whether to shuffle the shard order and the rows of every shard, on every pass
+     :param seed: The seed of the shuffling
+     :return: A tf.data.Dataset of (features, labels) batches"""
+    import tensorflow as tf
+
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    shards = manifest["shards"]
+    row_length = COMPACT_LENGTH if manifest["input_format"] == "compact" else 2 * manifest["max_length"]
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        order = rng.permutation(len(shards)) if shuffle else range(len(shards))
+        for index in order:
+            features, labels = load_shard(directory, shards[index], ("features", "labels"))
+            rows = rng.permutation(len(labels)) if shuffle else np.arange(len(labels))
+            for start in range(0, len(rows), batch_size):
+                # Sorted indices keep the reads of a batch sequential in the mapped file
+                batch = np.sort(rows[start:start + batch_size])
+                yield features[batch], labels[batch].astype(np.int64)
+
+    signature = (tf.TensorSpec(shape=(None, row_length), dtype=tf.int8),
+                 tf.TensorSpec(shape=(None,), dtype=tf.int64))
+    return tf.data.Dataset.from_generator(batches, output_signature=signature).prefetch(tf.data.AUTOTUNE)
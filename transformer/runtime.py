@@ -0,0 +1,135 @@
+import json
+import threading
+
+import numpy as np
+
+from Chess.Repository.Bitboard import Bitboard
+from transformer.encoding import BOARD_LENGTH, CompactEncoder, PositionEncoder
+
+# The weights of an exported ChessTransformer, in the order of the forward pass
+WEIGHT_NAMES = ("embeddings", "positional_encoding",
+                "query_kernel", "query_bias", "key_kernel", "key_bias", "value_kernel", "value_bias",
+                "attention_kernel", "attention_bias", "layernorm1_gamma", "layernorm1_beta",
+                "ffn1_kernel", "ffn1_bias", "ffn2_kernel", "ffn2_bias", "layernorm2_gamma", "layernorm2_beta",
+                "output_kernel", "output_bias")
+ATTENTION_BYTES = 256 * 1024 * 1024  # The rows of a batch are evaluated in chunks whose attention fits this budget
+
+
+def softmax(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    exponentials = np.exp(x - x.max(axis=axis, keepdims=True))
+    return exponentials / exponentials.sum(axis=axis, keepdims=True)
+
+
+def layer_norm(x: np.ndarray, gamma: np.ndarray, beta: np.ndarray, epsilon: float) -> np.ndarray:
+    mean = x.mean(axis=-1, keepdims=True)
+    variance = x.var(axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(variance + epsilon) * gamma + beta
+
+
+def save_artifact(path: str, weights: dict[str, np.ndarray], metadata: dict):
+    """ Write an inference artifact: every weight of the model plus the metadata needed to encode its inputs
+
+     :param path: The path of the .npz file
+     :param weights: The weights, keyed by the names of WEIGHT_NAMES
+     :param metadata: The input format, vocabularies, label classes and layer settings"""
+    arrays = {name: np.asarray(weights[name], dtype=np.float32) for name in WEIGHT_NAMES}
+    np.savez(path, metadata=np.array(json.dumps(metadata)), **arrays)
+
+
+class InferenceModel:
+    """ The forward pass of an exported ChessTransformer in plain NumPy. It answers predict, predict_batch and features
+    like ChessTransformer does, so the search and the BatchEvaluator use either one, but loading it needs neither
+    TensorFlow nor the training data. Dropout is not applied, the results are deterministic. """
+
+    def __init__(self, weights: dict[str, np.ndarray], metadata: dict):
+        """ Create the model from exported weights
+
+         :param weights: The weights, keyed by the names of WEIGHT_NAMES
+         :param metadata: The metadata written by the export"""
+        self.weights = weights
+        self.metadata = metadata
+        self.input_format = metadata["input_format"]
+        self.num_heads = metadata["num_heads"]
+        self.key_dim = metadata["key_dim"]
+        self.epsilon = metadata["epsilon"]
+        self.classes = metadata["label_classes"]
+        if self.input_format == "compact":
+            self.encoder = CompactEncoder()
+        else:
+            self.encoder = PositionEncoder(metadata["board_vocabulary"], metadata["turn_vocabulary"],
+                                           metadata.get("max_length", BOARD_LENGTH))
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "InferenceModel":
+        """ Load an artifact written by save_artifact
+
+         :param path: The path of the .npz file
+         :return: The model"""
+        with np.load(path) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            weights = {name: artifact[name] for name in WEIGHT_NAMES}
+        return cls(weights, metadata)
+
+    def features(self, positions):
+        """ Turn positions into the model's input rows
+
+         :param positions: The positions, as FEN strings or Bitboards
+         :return: An int8 array with one row of features per position, a view of the encoder's buffer"""
+        if all(isinstance(position, str) for position in positions):
+            return self.encoder.encode_fens(positions)
+        positions = [position if isinstance(position, Bitboard) else self._parse(position)
+                     for position in positions]
+        return self.encoder.encode_batch(positions)
+
+    @staticmethod
+    def _parse(fen: str) -> Bitboard:
+        position = Bitboard()
+        position.set_fen(fen)
+        return position
+
+    def forward(self, tokens: np.ndarray) -> np.ndarray:
+        """ Run the network on encoded rows
+
+         :param tokens: A (rows, length) array of tokens
+         :return: A (rows, 3) array, the output of the final softmax layer"""
+        w = self.weights
+        length = tokens.shape[1]
+        x = w["embeddings"][tokens.astype(np.intp)] + w["positional_encoding"][:length]
+
+        # Multi-head self attention, the query is scaled like Keras' MultiHeadAttention does. The heads are moved to
+        # the front so the two large products are batched matrix multiplications
+        query = (np.einsum("nld,dhk->nhlk", x, w["query_kernel"]) + w["query_bias"][:, None]) / np.sqrt(self.key_dim)
+        key = np.einsum("nld,dhk->nhlk", x, w["key_kernel"]) + w["key_bias"][:, None]
+        value = np.einsum("nld,dhk->nhlk", x, w["value_kernel"]) + w["value_bias"][:, None]
+        context = softmax(query @ key.transpose(0, 1, 3, 2), axis=-1) @ value
+        attention = np.einsum("nhqk,hkd->nqd", context, w["attention_kernel"]) + w["attention_bias"]
+        x = layer_norm(x + attention, w["layernorm1_gamma"], w["layernorm1_beta"], self.epsilon)
+
+        # Feed forward network
+        hidden = np.maximum(x @ w["ffn1_kernel"] + w["ffn1_bias"], 0)
+        x = layer_norm(x + hidden @ w["ffn2_kernel"] + w["ffn2_bias"], w["layernorm2_gamma"], w["layernorm2_beta"],
+                       self.epsilon)
+
+        pooled = x.mean(axis=1)
+        return softmax(pooled @ w["output_kernel"] + w["output_bias"])
+
+    def predict_batch(self, positions):
+        """ Predict the result probabilities of many positions
+
+         :param positions: The positions, as FEN strings or Bitboards
+         :return: A (len(positions), 3) array of probabilities"""
+        if len(positions) == 0:
+            return np.zeros((0, 3), dtype=np.float32)
+        with self.lock:
+            tokens = self.features(positions)
+            length = tokens.shape[1]
+            # Bound the memory of the attention scores, which grow with the square of the input length
+            chunk = max(1, ATTENTION_BYTES // (self.num_heads * length * length * 4))
+            prediction = np.concatenate([self.forward(tokens[start:start + chunk])
+                                         for start in range(0, len(tokens), chunk)])
+        # Convert the raw predictions to probabilities like ChessTransformer.predict_batch does
+        return softmax(prediction, axis=1)
+
+    def predict(self, fen):
+        return self.predict_batch([fen])[0]
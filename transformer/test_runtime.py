@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from transformer.runtime import InferenceModel
+
+MODELS = os.path.join(os.path.dirname(__file__), "TrainedModels")
+MODEL_PATH = os.path.join(MODELS, "transformer.h5")
+ARTIFACT_PATH = os.path.join(MODELS, "transformer.npz")
+FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+    "r4rk1/1pq2pp1/p1n1p1b1/4P3/8/3B2QR/PPP2PP1/2KR4 b - - 4 20",
+    "8/8/8/4k3/8/8/8/R3K3 w - - 0 1",
+]
+
+
+@pytest.fixture(scope="module")
+def artifact():
+    return InferenceModel.load(ARTIFACT_PATH)
+
+
+def test_artifact_predicts_probabilities(artifact):
+    probabilities = artifact.predict_batch(FENS)
+    assert probabilities.shape == (len(FENS), 3)
+    assert np.allclose(probabilities.sum(axis=1), 1, atol=1e-5)
+    assert np.allclose(artifact.predict(FENS[2]), probabilities[2], atol=1e-6)
+
+
+def test_artifact_matches_the_keras_model(artifact):
+    pytest.importorskip("tensorflow")
+    from transformer.transformer import ChessTransformer
+
+    model = ChessTransformer.from_saved(MODEL_PATH)
+    assert np.array_equal(artifact.features(FENS), model.features(FENS))
+    # The saved model keeps its dropout at inference, the artifact runs without it: compare with the mean of runs
+    keras = np.mean([model.predict_batch(FENS) for _ in range(8)], axis=0)
+    assert np.allclose(artifact.predict_batch(FENS), keras, atol=5e-3)
@@ -4,16 +4,30 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
-from tensorflow.keras.preprocessing.text import Tokenizer
+from tensorflow.keras.preprocessing.text import Tokenizer, tokenizer_from_json
 from tensorflow.keras.utils import custom_object_scope
-import re
+import json
+import os
+import threading
 from scipy.special import softmax
+from Chess.Repository.Bitboard import Bitboard
+from transformer.runtime import save_artifact
+from transformer.pipeline import MANIFEST, shard_dataset
+from transformer.encoding import BOARD_LENGTH, COMPACT_LENGTH, COMPACT_VOCABULARY, INPUT_LENGTH, CompactEncoder, \
+    PositionEncoder
+
+# The input layout of a model, told apart by the length of its input
+INPUT_FORMATS = {INPUT_LENGTH: "tokens", COMPACT_LENGTH: "compact"}
 
 
 
 
 # --- Data Loading and Preprocessing ---
-def load_and_preprocess_data():
+def load_and_preprocess_data(input_format="tokens"):
+    """ Load the training games and turn them into model inputs
+
+     :param input_format: "tokens" for the padded character tokens of the FEN, "compact" for the 71 token layout
+     :return: The features, the labels, the board and turn tokenizers and the label encoder"""
     df = pd.read_json('/home/im07813/Desktop/checkit/training_dataset.json')
     df = pd.json_normalize(df['games'])
 
@@ -25,13 +39,17 @@ def load_and_preprocess_data():
     board_tokenizer.fit_on_texts(df['board'])
     turn_tokenizer.fit_on_texts(df['turn'])
 
-    board_tokens = board_tokenizer.texts_to_sequences(df['board'])
-    turn_tokens = turn_tokenizer.texts_to_sequences(df['turn'])
+    if input_format == "compact":
+        # The compact layout reads the side to move from the FEN itself, like the search does
+        features = CompactEncoder().encode_fens(list(df['board'])).copy()
+    else:
+        board_tokens = board_tokenizer.texts_to_sequences(df['board'])
+        turn_tokens = turn_tokenizer.texts_to_sequences(df['turn'])
 
-    board_tokens = tf.keras.preprocessing.sequence.pad_sequences(board_tokens, maxlen=512)
-    turn_tokens = tf.keras.preprocessing.sequence.pad_sequences(turn_tokens, maxlen=512)
+        board_tokens = tf.keras.preprocessing.sequence.pad_sequences(board_tokens, maxlen=512)
+        turn_tokens = tf.keras.preprocessing.sequence.pad_sequences(turn_tokens, maxlen=512)
 
-    features = np.concatenate([board_tokens, turn_tokens], axis=1)
+        features = np.concatenate([board_tokens, turn_tokens], axis=1)
 
     # Encode labels
     le = LabelEncoder()
@@ -88,18 +106,56 @@ class TransformerBlock(tf.keras.layers.Layer):
         return self.layernorm2(out1 + ffn_output)
 
 
+def preprocessing_path(model_path):
+    """ Returns the path of the preprocessing state saved next to a model file
+
+     :param model_path: The path of the model file
+     :return: The path of the JSON file"""
+    return os.path.splitext(model_path)[0] + ".preprocessing.json"
+
+
 class ChessTransformer:
-    def __init__(self, board_tokenizer, turn_tokenizer, le):
+    def __init__(self, board_tokenizer=None, turn_tokenizer=None, le=None, input_format="tokens",
+                 max_length=BOARD_LENGTH):
         self.model = None 
         self.board_tokenizer = board_tokenizer
         self.turn_tokenizer = turn_tokenizer
         self.le = le
+        self.input_format = input_format
+        self.max_length = max_length  # The length the board and the turn are each padded to
+        self.lock = threading.Lock()
+        self._set_encoder()
+
+    @classmethod
+    def from_saved(cls, path):
+        """ Load a model saved with save(), its tokenizers and label encoder come from the preprocessing state next to
+        it, so no dataset is read
+
+         :param path: The path of the model file
+         :return: The ChessTransformer"""
+        transformer = cls()
+        transformer.load(path)
+        return transformer
+
+    def _set_encoder(self):
+        if self.input_format == "compact":
+            self.encoder = CompactEncoder()
+        elif self.board_tokenizer is not None and self.turn_tokenizer is not None:
+            self.encoder = PositionEncoder(self.board_tokenizer.word_index, self.turn_tokenizer.word_index,
+                                           self.max_length)
+        else:
+            self.encoder = None
 
     def create_model(self, input_dim=100, embed_dim=64, num_heads=8, ff_dim=256):
-        inputs = layers.Input(shape=(1024,)) 
-       
+        if self.input_format == "compact":
+            # 71 tokens instead of 1024, the attention layer is quadratic in this length
+            input_length, input_dim = COMPACT_LENGTH, COMPACT_VOCABULARY
+        else:
+            input_length = 2 * self.max_length
+        inputs = layers.Input(shape=(input_length,))
+
         x = layers.Embedding(input_dim=input_dim, output_dim=embed_dim)(inputs)
-        x = PositionalEncoding(1024, embed_dim)(x) 
+        x = PositionalEncoding(input_length, embed_dim)(x)
         x = TransformerBlock(embed_dim, num_heads, ff_dim)(x, training=True)
         x = layers.GlobalAveragePooling1D()(x)
         outputs = layers.Dense(3, activation='softmax')(x)
@@ -108,39 +164,148 @@ class ChessTransformer:
     def load(self, path):
         with custom_object_scope({'PositionalEncoding': PositionalEncoding, 'TransformerBlock': TransformerBlock}):
             self.model = tf.keras.models.load_model(path)
-
-    def train(self, features, labels, epochs=1):
+        if os.path.exists(preprocessing_path(path)):
+            self.load_preprocessing(preprocessing_path(path))
+        else:
+            # The saved input shape tells which layout the model was trained on
+            self.input_format = INPUT_FORMATS.get(self.model.input_shape[1], "tokens")
+            self._set_encoder()
+            if self.encoder is None:
+                raise ValueError(f"No preprocessing state next to {path}, write it from the training dataset with "
+                                 f"python -m transformer.convert {path}")
+
+    def save(self, path):
+        """ Save the model and, next to it, the preprocessing state needed to use it
+
+         :param path: The path of the model file"""
+        self.model.save(path)
+        self.save_preprocessing(preprocessing_path(path))
+
+    def save_preprocessing(self, path):
+        """ Save the tokenizers, padding length, label classes and input format as JSON
+
+         :param path: The path of the JSON file"""
+        state = {
+            "input_format": self.input_format,
+            "max_length": self.max_length,
+            "board_tokenizer": self.board_tokenizer.to_json() if self.board_tokenizer is not None else None,
+            "turn_tokenizer": self.turn_tokenizer.to_json() if self.turn_tokenizer is not None else None,
+            "label_classes": [str(label) for label in self.le.classes_] if self.le is not None else None,
+        }
+        with open(path, "w") as file:
+            json.dump(state, file)
+
+    def load_preprocessing(self, path):
+        """ Restore the state written by save_preprocessing
+
+         :param path: The path of the JSON file"""
+        with open(path) as file:
+            state = json.load(file)
+        self.input_format = state["input_format"]
+        self.max_length = state["max_length"]
+        if state["board_tokenizer"] is not None:
+            self.board_tokenizer = tokenizer_from_json(state["board_tokenizer"])
+        if state["turn_tokenizer"] is not None:
+            self.turn_tokenizer = tokenizer_from_json(state["turn_tokenizer"])
+        if state["label_classes"] is not None:
+            self.le = LabelEncoder()
+            self.le.classes_ = np.array(state["label_classes"])
+        self._set_encoder()
+
+    def train(self, features, labels, epochs=1, path="/home/im07813/Desktop/checkit/transformer.h5"):
         if self.model is None:
             self.model = self.create_model()
 
         self.model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
         self.model.fit(features, labels, epochs=epochs) 
-        self.model.save("/home/im07813/Desktop/checkit/transformer.h5")
+        self.save(path)
 
-    def predict(self, fen):
-        # Split the FEN string into board and turn components
-        match = re.match(r"^(.*?)\s([wb])\s", fen)
-        if match is None:
-            raise ValueError("Invalid FEN string")
-        board, turn = match.groups()
-
-        # Transform the board and turn components
-        board_tokens = self.board_tokenizer.texts_to_matrix([board])
-        turn_tokens = self.turn_tokenizer.texts_to_matrix([turn])
+    def train_on_shards(self, directory, epochs=1, batch_size=64, path="/home/im07813/Desktop/checkit/transformer.h5"):
+        """ Train on the shards written by transformer.pipeline.build_shards, streaming them instead of holding the
+        dataset in memory. A new model takes its preprocessing state from the manifest of the shards
 
-        # Pad the sequences
-        board_tokens = tf.keras.preprocessing.sequence.pad_sequences(board_tokens, maxlen=512)
-        turn_tokens = tf.keras.preprocessing.sequence.pad_sequences(turn_tokens, maxlen=512)
+         :param directory: The directory of the shards
+         :param epochs: The number of passes over the shards
+         :param batch_size: The number of rows per batch
+         :param path: The path to save the trained model to"""
+        if self.model is None:
+            self.load_preprocessing(os.path.join(directory, MANIFEST))
+            self.model = self.create_model()
 
-        # Concatenate the tokens and make a prediction
-        features = np.concatenate([board_tokens, turn_tokens], axis=1)
-        prediction = self.model.predict(features)
-        
-        # Convert the raw prediction to probabilities using the softmax function
-        probabilities = softmax(prediction[0])
+        self.model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        self.model.fit(shard_dataset(directory, batch_size), epochs=epochs)
+        self.save(path)
+
+    def export(self, path):
+        """ Write the model to a self-contained inference artifact that transformer.runtime.InferenceModel runs with
+        NumPy alone
+
+         :param path: The path of the .npz file"""
+        layer = {type(layer).__name__: layer for layer in self.model.layers}
+        block = layer["TransformerBlock"]
+        query_kernel, query_bias, key_kernel, key_bias, value_kernel, value_bias, attention_kernel, attention_bias = \
+            [weight.numpy() for weight in block.att.weights]
+        length = self.model.input_shape[1]
+        weights = {
+            "embeddings": layer["Embedding"].embeddings.numpy(),
+            "positional_encoding": layer["PositionalEncoding"].pos_encoding.numpy()[0, :length],
+            "query_kernel": query_kernel, "query_bias": query_bias, "key_kernel": key_kernel, "key_bias": key_bias,
+            "value_kernel": value_kernel, "value_bias": value_bias,
+            "attention_kernel": attention_kernel, "attention_bias": attention_bias,
+            "layernorm1_gamma": block.layernorm1.gamma.numpy(), "layernorm1_beta": block.layernorm1.beta.numpy(),
+            "ffn1_kernel": block.ffn.layers[0].kernel.numpy(), "ffn1_bias": block.ffn.layers[0].bias.numpy(),
+            "ffn2_kernel": block.ffn.layers[1].kernel.numpy(), "ffn2_bias": block.ffn.layers[1].bias.numpy(),
+            "layernorm2_gamma": block.layernorm2.gamma.numpy(), "layernorm2_beta": block.layernorm2.beta.numpy(),
+            "output_kernel": layer["Dense"].kernel.numpy(), "output_bias": layer["Dense"].bias.numpy(),
+        }
+        metadata = {
+            "input_format": self.input_format,
+            "max_length": self.max_length,
+            "board_vocabulary": self.board_tokenizer.word_index,
+            "turn_vocabulary": self.turn_tokenizer.word_index,
+            "label_classes": [str(label) for label in self.le.classes_],
+            "num_heads": block.att._num_heads,
+            "key_dim": block.att._key_dim,
+            "epsilon": block.layernorm1.epsilon,
+        }
+        save_artifact(path, weights, metadata)
+
+    def features(self, positions):
+        """ Turn positions into the model's input rows
+
+         :param positions: The positions, as FEN strings or Bitboards
+         :return: An int8 array with one row of features per position, a view of the encoder's buffer"""
+        if self.encoder is None:
+            raise ValueError("No tokenizers: pass them to ChessTransformer or load a model saved with save()")
+        if all(isinstance(position, str) for position in positions):
+            return self.encoder.encode_fens(positions)
+        return self.encoder.encode_batch([position if isinstance(position, Bitboard) else self._parse(position)
+                                          for position in positions])
+
+    @staticmethod
+    def _parse(fen):
+        position = Bitboard()
+        position.set_fen(fen)
+        return position
+
+    def predict_batch(self, positions):
+        """ Predict the result probabilities of many positions with a single call to the model
+
+         :param positions: The positions, as FEN strings or Bitboards
+         :return: A (len(positions), 3) array of probabilities"""
+        if len(positions) == 0:
+            return np.zeros((0, 3), dtype=np.float32)
+        # The encoder's buffer is shared, so one batch is encoded and evaluated at a time
+        with self.lock:
+            # predict_on_batch skips the per-call dataset setup of predict, which dominates for small batches
+            prediction = np.asarray(self.model.predict_on_batch(self.features(positions)))
+
+        # Convert the raw predictions to probabilities using the softmax function
+        return softmax(prediction, axis=1)
 
+    def predict(self, fen):
         # Return the probabilities
-        return probabilities
+        return self.predict_batch([fen])[0]
 
         # Return the prediction
         #return self.le.inverse_transform([np.argmax(prediction)])
@@ -164,6 +329,9 @@ if __name__ == "__main__":
     # Load 
     model.load("/home/im07813/Desktop/chessgpt/AI/transformer/transformer.h5")  
 
+    # Export the inference artifact the engine loads (main.py)
+    model.export("transformer/TrainedModels/transformer.npz")
+
     # Example prediction
     #fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
     #prediction = model.predict(fen)